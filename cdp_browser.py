@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+CDP Browser
+Render trang JS bằng headless Chromium qua DevTools protocol (CDP), bất đồng bộ, nhiều tab song song:
+- 1 hoặc vài process Chromium, mỗi process N tab (asyncio, không cần WebDriver)
+- Tab được tái sử dụng; đóng và mở tab mới sau max_uses trang hoặc khi JS heap vượt giới hạn
+- Chromium crash (mất kết nối DevTools) -> khởi động lại process đó, tab của process cũ được thay bằng tab mới
+- Chặn tải ảnh/font/media (chỉ cần HTML sau khi chạy JS) -> nhẹ băng thông và bộ nhớ
+- WebSocket client tối giản viết bằng stdlib (asyncio) -> không cần thêm dependency
+
+Dùng bởi product_scraper.py (--browser cdp). Thử nhanh:
+    python cdp_browser.py https://cellphones.com.vn/iphone-15-pro-max.html
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+CHROME_CANDIDATES = ('chromium', 'chromium-browser', 'google-chrome', 'google-chrome-stable', 'chrome')
+BLOCKED_RESOURCES = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+                     '*.woff', '*.woff2', '*.ttf', '*.mp4', '*.webm']
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def find_chrome() -> Optional[str]:
+    """Đường dẫn Chromium/Chrome (biến môi trường CHROME_PATH hoặc tìm trong PATH)"""
+    path = os.environ.get('CHROME_PATH')
+    if path and os.path.exists(path):
+        return path
+    return next((p for p in map(shutil.which, CHROME_CANDIDATES) if p), None)
+
+
+class WebSocket:
+    """WebSocket client tối giản (RFC 6455, ws:// - CDP chỉ chạy trên localhost)"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, url: str) -> 'WebSocket':
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80, limit=2 ** 26)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET {parsed.path or '/'} HTTP/1.1\r\nHost: {parsed.netloc}\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        await writer.drain()
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        if not head.startswith('HTTP/1.1 101') or accept not in head:
+            writer.close()
+            raise ConnectionError(f"WebSocket handshake lỗi: {head.splitlines()[0] if head else ''}")
+        return cls(reader, writer)
+
+    @staticmethod
+    def _mask(data: bytes, key: bytes) -> bytes:
+        # XOR cả khối bằng số nguyên lớn (nhanh hơn nhiều so với lặp từng byte)
+        n = len(data)
+        repeated = (key * (n // 4 + 1))[:n]
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(n, 'big')
+
+    async def _send_frame(self, opcode: int, payload: bytes):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, n)
+        key = os.urandom(4)
+        self.writer.write(header + key + self._mask(payload, key))
+        await self.writer.drain()
+
+    async def send(self, text: str):
+        await self._send_frame(0x1, text.encode('utf-8'))
+
+    async def recv(self) -> str:
+        """Message text tiếp theo (ghép fragment, tự trả lời ping); EOFError khi đóng"""
+        parts: List[bytes] = []
+        while True:
+            b1, b2 = await self.reader.readexactly(2)
+            opcode, n = b1 & 0x0F, b2 & 0x7F
+            if n == 126:
+                n = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            key = await self.reader.readexactly(4) if b2 & 0x80 else None
+            payload = await self.reader.readexactly(n)
+            if key:
+                payload = self._mask(payload, key)
+            if opcode == 0x8:
+                raise EOFError('WebSocket closed')
+            if opcode == 0x9:
+                await self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            parts.append(payload)
+            if b1 & 0x80:
+                return b''.join(parts).decode('utf-8')
+
+    async def close(self):
+        try:
+            await self._send_frame(0x8, b'')
+        except Exception:
+            pass
+        self.writer.close()
+
+
+class CDPConnection:
+    """JSON-RPC của CDP trên 1 WebSocket: call() chờ response theo id, expect() chờ event theo session"""
+
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self._ids = itertools.count(1)
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._waiters: Dict[Tuple[Optional[str], str], List[asyncio.Future]] = {}
+        self.closed = False  # Mất kết nối (Chromium crash/bị kill) -> mọi call() lỗi ngay
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message = json.loads(await self.ws.recv())
+                if 'id' in message:
+                    future = self._calls.pop(message['id'], None)
+                    if future and not future.done():
+                        if 'error' in message:
+                            future.set_exception(RuntimeError(f"CDP error: {message['error'].get('message')}"))
+                        else:
+                            future.set_result(message.get('result', {}))
+                else:
+                    for future in self._waiters.pop((message.get('sessionId'), message.get('method')), []):
+                        if not future.done():
+                            future.set_result(message.get('params', {}))
+        except (EOFError, asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            self.closed = True
+            events = [f for waiters in self._waiters.values() for f in waiters]
+            self._waiters.clear()
+            for future in list(self._calls.values()) + events:
+                if not future.done():
+                    future.set_exception(ConnectionError(f"CDP mất kết nối: {e}"))
+            for future in events:
+                # Event có thể không còn ai chờ (call() trước đó đã lỗi) -> đánh dấu đã đọc exception
+                future.add_done_callback(lambda f: f.exception())
+
+    async def call(self, method: str, params: Optional[Dict[str, Any]] = None,
+                   session_id: Optional[str] = None, timeout: float = 30.0) -> Dict[str, Any]:
+        if self.closed:
+            raise ConnectionError('CDP mất kết nối (Chromium đã dừng)')
+        call_id = next(self._ids)
+        message: Dict[str, Any] = {'id': call_id, 'method': method, 'params': params or {}}
+        if session_id:
+            message['sessionId'] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        await self.ws.send(json.dumps(message))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._calls.pop(call_id, None)
+
+    def expect(self, session_id: Optional[str], method: str) -> asyncio.Future:
+        """Future của event tiếp theo (đăng ký trước khi gửi lệnh gây ra event)"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault((session_id, method), []).append(future)
+        return future
+
+    async def close(self):
+        self._reader.cancel()
+        await self.ws.close()
+
+
+@dataclass
+class _Tab:
+    conn: CDPConnection
+    target_id: str
+    session_id: str
+    slot: int           # Vị trí process Chromium của tab trong CDPBrowser._browsers
+    uses: int = 0
+
+
+@dataclass
+class _Browser:
+    process: asyncio.subprocess.Process
+    conn: CDPConnection
+    profile: str
+
+    @property
+    def alive(self) -> bool:
+        return not self.conn.closed and self.process.returncode is None
+
+
+class CDPBrowser:
+    """Pool tab trên 1..N process Chromium headless"""
+
+    def __init__(self, browsers: int = 1, tabs: int = 8, max_uses: int = 50, heap_limit_mb: int = 256,
+                 timeout: float = 30.0, settle: float = 0.5, wait_selector: Optional[str] = None,
+                 selector_timeout: float = 5.0, block_resources: bool = True, executable: Optional[str] = None):
+        self.browsers = max(1, browsers)
+        self.tabs = max(1, tabs)
+        self.max_uses = max_uses
+        self.heap_limit = heap_limit_mb * 1024 * 1024
+        self.timeout = timeout
+        self.settle = settle
+        self.wait_selector = wait_selector
+        self.selector_timeout = selector_timeout
+        self.block_resources = block_resources
+        self.executable = executable or find_chrome()
+        self._browsers: List[_Browser] = []
+        self._pool: Optional[asyncio.Queue] = None
+        self._relaunch_lock: Optional[asyncio.Lock] = None
+        self.stats = {'pages': 0, 'errors': 0, 'recycled': 0, 'relaunched': 0}
+
+    async def start(self):
+        if not self.executable:
+            raise RuntimeError('Không tìm thấy Chromium/Chrome (cài chromium hoặc đặt CHROME_PATH)')
+        self._pool = asyncio.Queue()
+        self._relaunch_lock = asyncio.Lock()
+        for slot in range(self.browsers):
+            self._browsers.append(await self._launch())
+            for _ in range(self.tabs):
+                self._pool.put_nowait(await self._open_tab(slot))
+
+    async def _launch(self) -> _Browser:
+        profile = tempfile.mkdtemp(prefix='cdp-profile-')
+        process = await asyncio.create_subprocess_exec(
+            self.executable, '--headless=new', '--remote-debugging-port=0', f'--user-data-dir={profile}',
+            '--no-sandbox', '--disable-gpu', '--disable-dev-shm-usage', '--no-first-run',
+            '--no-default-browser-check', '--disable-extensions', '--mute-audio',
+            f'--js-flags=--max-old-space-size={self.heap_limit // (1024 * 1024)}', 'about:blank',
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        try:
+            ws_url = await self._devtools_url(process)
+            return _Browser(process, CDPConnection(await WebSocket.connect(ws_url)), profile)
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+            shutil.rmtree(profile, ignore_errors=True)
+            raise
+
+    async def _connection(self, slot: int) -> CDPConnection:
+        """Connection của process Chromium ở slot; process đã chết (crash, bị kill) -> khởi động lại"""
+        async with self._relaunch_lock:
+            browser = self._browsers[slot]
+            if not browser.alive:
+                print(f"  ⚠️  Chromium #{slot} mất kết nối (exit={browser.process.returncode}), khởi động lại")
+                self.stats['relaunched'] += 1
+                await self._discard(browser)
+                self._browsers[slot] = await self._launch()
+            return self._browsers[slot].conn
+
+    @staticmethod
+    async def _discard(browser: _Browser):
+        if browser.process.returncode is None:
+            browser.process.kill()
+        await browser.conn.close()
+        await browser.process.wait()
+        shutil.rmtree(browser.profile, ignore_errors=True)
+
+    async def _devtools_url(self, process) -> str:
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            line = await asyncio.wait_for(process.stderr.readline(), deadline - time.monotonic())
+            if not line:
+                break
+            match = re.search(rb'DevTools listening on (ws://\S+)', line)
+            if match:
+                # Đọc bỏ stderr còn lại, tránh Chromium bị chặn khi pipe đầy
+                asyncio.ensure_future(self._drain(process.stderr))
+                return match.group(1).decode()
+        raise RuntimeError('Chromium không mở được DevTools endpoint')
+
+    @staticmethod
+    async def _drain(stream: asyncio.StreamReader):
+        while await stream.read(65536):
+            pass
+
+    async def _open_tab(self, slot: int) -> _Tab:
+        conn = await self._connection(slot)
+        target = await conn.call('Target.createTarget', {'url': 'about:blank'})
+        attached = await conn.call('Target.attachToTarget', {'targetId': target['targetId'], 'flatten': True})
+        tab = _Tab(conn, target['targetId'], attached['sessionId'], slot)
+        await conn.call('Page.enable', session_id=tab.session_id)
+        if self.block_resources:
+            await conn.call('Network.enable', session_id=tab.session_id)
+            await conn.call('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCES}, session_id=tab.session_id)
+        return tab
+
+    async def _recycle(self, tab: _Tab) -> _Tab:
+        self.stats['recycled'] += 1
+        try:
+            await tab.conn.call('Target.closeTarget', {'targetId': tab.target_id}, timeout=5)
+        except Exception:
+            pass
+        return await self._open_tab(tab.slot)
+
+    async def render(self, url: str, wait_selector: Optional[str] = None) -> str:
+        """HTML của trang sau khi chạy JS"""
+        tab: _Tab = await self._pool.get()
+        healthy = False
+        try:
+            if tab.conn.closed:
+                # Tab của process Chromium đã chết -> tab mới (khởi động lại process nếu cần)
+                tab = await self._open_tab(tab.slot)
+            loaded = tab.conn.expect(tab.session_id, 'Page.loadEventFired')
+            result = await tab.conn.call('Page.navigate', {'url': url}, tab.session_id, timeout=self.timeout)
+            if result.get('errorText'):
+                raise RuntimeError(f"Navigate lỗi {url}: {result['errorText']}")
+            await asyncio.wait_for(loaded, self.timeout)
+            selector = wait_selector or self.wait_selector
+            if selector:
+                await self._wait_for(tab, selector)
+            elif self.settle:
+                await asyncio.sleep(self.settle)
+            html = await tab.conn.call('Runtime.evaluate', {'expression': 'document.documentElement.outerHTML',
+                                                            'returnByValue': True}, tab.session_id)
+            tab.uses += 1
+            self.stats['pages'] += 1
+            healthy = True
+            return html['result']['value']
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            await self._release(tab, healthy)
+
+    async def _wait_for(self, tab: _Tab, selector: str):
+        """Chờ selector xuất hiện (tối đa selector_timeout), không có thì vẫn lấy HTML hiện tại"""
+        expression = f"!!document.querySelector({json.dumps(selector)})"
+        deadline = time.monotonic() + self.selector_timeout
+        while time.monotonic() < deadline:
+            found = await tab.conn.call('Runtime.evaluate', {'expression': expression, 'returnByValue': True},
+                                        tab.session_id)
+            if found.get('result', {}).get('value'):
+                return
+            await asyncio.sleep(0.1)
+
+    async def _release(self, tab: _Tab, healthy: bool):
+        """Trả tab về pool; tab lỗi/dùng nhiều/heap lớn -> đóng và mở tab mới.
+
+        Không mở được tab mới (vd: Chromium chưa khởi động lại được) -> vẫn trả tab cũ, lần dùng sau thử lại.
+        """
+        try:
+            recycle = not healthy or tab.conn.closed or tab.uses >= self.max_uses
+            if not recycle:
+                heap = await tab.conn.call('Runtime.getHeapUsage', session_id=tab.session_id, timeout=5)
+                recycle = heap.get('usedSize', 0) > self.heap_limit
+            if recycle:
+                tab = await self._recycle(tab)
+        except Exception:
+            pass
+        self._pool.put_nowait(tab)
+
+    async def close(self):
+        for browser in self._browsers:
+            try:
+                await browser.conn.call('Browser.close', timeout=5)
+            except Exception:
+                if browser.process.returncode is None:
+                    browser.process.kill()
+            await browser.conn.close()
+            await browser.process.wait()
+            shutil.rmtree(browser.profile, ignore_errors=True)
+        self._browsers = []
+
+
+class CDPRenderer:
+    """Chạy CDPBrowser trong event loop riêng (thread nền) -> render() đồng bộ, gọi từ nhiều thread cùng lúc"""
+
+    def __init__(self, **options):
+        self.browser = CDPBrowser(**options)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='cdp-loop', daemon=True)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self) -> 'CDPRenderer':
+        with self._lock:
+            if not self._started:
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self.browser.start(), self._loop).result()
+                self._started = True
+        return self
+
+    def render(self, url: str, wait_selector: Optional[str] = None) -> str:
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.browser.render(url, wait_selector), self._loop)
+        return future.result()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.browser.stats)
+
+    def close(self):
+        with self._lock:
+            if self._started:
+                asyncio.run_coroutine_threadsafe(self.browser.close(), self._loop).result(timeout=30)
+                self._started = False
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render trang bằng headless Chromium qua CDP, in HTML')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--tabs', type=int, default=8, help='Số tab song song (default: %(default)s)')
+    args = parser.parse_args()
+
+    async def run():
+        browser = CDPBrowser(tabs=args.tabs)
+        await browser.start()
+        try:
+            started = time.monotonic()
+            pages = await asyncio.gather(*(browser.render(url) for url in args.urls), return_exceptions=True)
+            for url, html in zip(args.urls, pages):
+                print(f"{url}: {html if isinstance(html, Exception) else f'{len(html)} ký tự HTML'}")
+            print(f"{len(args.urls)} trang trong {time.monotonic() - started:.1f}s - {browser.stats}")
+        finally:
+            await browser.close()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Product URL Discovery
+Tìm URL sản phẩm từ trang danh mục/listing hoặc sitemap.xml (kể cả .xml.gz, sitemap index):
+- Theo phân trang (rel=next, link ?page=N) và "xem thêm" (tăng tham số trang tới khi hết sản phẩm mới)
+- Khử trùng chính xác (set, hoặc tập bất kỳ có add / in truyền vào seen) - không bỏ sót URL chưa gặp
+- Yield URL dạng stream -> nạp thẳng vào pipeline cào (product_scraper.py --discover SEED)
+
+Dùng riêng (in URL sản phẩm ra stdout):
+    python discovery.py https://www.dienmayxanh.com/may-lanh > urls.txt
+    python discovery.py https://cellphones.com.vn/sitemap.xml | python product_scraper.py -f -
+"""
+
+import argparse
+import gzip
+import html
+import io
+import re
+import sys
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+
+# fetch(url) -> (body bytes, encoding)
+Fetch = Callable[[str], Tuple[bytes, Optional[str]]]
+
+_HREF_RE = re.compile(rb'<a\b[^>]*?\bhref\s*=\s*["\']?([^"\'\s>]+)', re.I)
+_REL_NEXT_RE = re.compile(rb'<(?:a|link)\b[^>]*\brel\s*=\s*["\']?next\b[^>]*>', re.I)
+_TAG_HREF_RE = re.compile(rb'\bhref\s*=\s*["\']?([^"\'\s>]+)', re.I)
+
+
+@dataclass
+class SiteRules:
+    """Quy tắc nhận diện URL sản phẩm + phân trang của 1 site"""
+    product_path: str                    # Regex trên path của URL sản phẩm
+    exclude_path: str = r'^$'            # Path không phải sản phẩm dù khớp product_path (tin tức, khuyến mãi...)
+    page_param: str = 'page'             # Tham số trang của listing/"xem thêm"
+
+    def is_product(self, url: str) -> bool:
+        path = urlparse(url).path
+        return bool(re.search(self.product_path, path)) and not re.search(self.exclude_path, path)
+
+
+_MWG_EXCLUDE = (r'^/(tin-tuc|kinh-nghiem-hay|game-app|hoi-dap|khuyen-mai|tra-gop|he-thong|chinh-sach|'
+                r'lien-he|tuyen-dung|may-doi-tra|thu-cu-doi-moi|sitemap|tim-kiem|gio-hang)')
+
+# Theo host suffix; site không có trong bảng dùng DEFAULT_RULES
+SITE_RULES: Dict[str, SiteRules] = {
+    'dienmayxanh.com': SiteRules(r'^/[a-z0-9-]+/[a-z0-9-]+$', _MWG_EXCLUDE, page_param='p'),
+    'thegioididong.com': SiteRules(r'^/[a-z0-9-]+/[a-z0-9-]+$', _MWG_EXCLUDE, page_param='p'),
+    'cellphones.com.vn': SiteRules(r'^/[a-z0-9-]+\.html$', r'^/(sforum|chinh-sach|tin-tuc)', page_param='p'),
+    'fptshop.com.vn': SiteRules(r'^/[a-z0-9-]+/[a-z0-9-]+$', r'^/(tin-tuc|khuyen-mai|ho-tro|cua-hang)',
+                                page_param='trang'),
+}
+DEFAULT_RULES = SiteRules(r'(/(product|products|san-pham|p)/[^/]+$|\.html?$)')
+
+
+def rules_for(url: str) -> SiteRules:
+    labels = (urlparse(url).hostname or '').split('.')
+    for i in range(len(labels)):
+        rules = SITE_RULES.get('.'.join(labels[i:]))
+        if rules:
+            return rules
+    return DEFAULT_RULES
+
+
+def is_sitemap(url: str) -> bool:
+    path = urlparse(url).path.lower()
+    return path.endswith(('.xml', '.xml.gz')) or 'sitemap' in path
+
+
+def iter_sitemap(fetch: Fetch, url: str, max_depth: int = 3) -> Iterator[str]:
+    """Stream <loc> của sitemap (giải nén gzip, iterparse + clear -> không dựng cả cây XML).
+    Sitemap index: đi vào từng sitemap con (tối đa max_depth cấp)."""
+    import xml.etree.ElementTree as ET
+    body, _ = fetch(url)
+    stream = io.BytesIO(body)
+    if body[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+    root = None
+    loc = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end':
+            continue
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'loc':
+            loc = (elem.text or '').strip()
+        elif tag in ('url', 'sitemap'):
+            if loc:
+                if tag == 'url':
+                    yield loc
+                elif max_depth > 0:
+                    try:
+                        yield from iter_sitemap(fetch, loc, max_depth - 1)
+                    except Exception as e:
+                        print(f"  ✗ Sitemap lỗi {loc}: {e}")
+            loc = None
+            root.clear()  # Bỏ các phần tử đã xử lý
+
+
+def iter_links(page_url: str, body: bytes, encoding: Optional[str] = None) -> Iterator[str]:
+    """Các link <a href> (absolute, bỏ fragment) trong trang"""
+    for match in _HREF_RE.finditer(body):
+        href = html.unescape(match.group(1).decode(encoding or 'utf-8', errors='replace'))
+        if href.startswith(('javascript:', 'mailto:', 'tel:', '#')):
+            continue
+        yield urljoin(page_url, href).split('#', 1)[0]
+
+
+def rel_next(page_url: str, body: bytes, encoding: Optional[str] = None) -> Optional[str]:
+    """Link rel=next (phân trang chuẩn) nếu có"""
+    for tag in _REL_NEXT_RE.finditer(body):
+        href = _TAG_HREF_RE.search(tag.group(0))
+        if href:
+            return urljoin(page_url, html.unescape(href.group(1).decode(encoding or 'utf-8', errors='replace')))
+    return None
+
+
+def with_page(url: str, param: str, page: int) -> str:
+    parsed = urlparse(url)
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k != param]
+    query.append((param, str(page)))
+    return urlunparse(parsed._replace(query=urlencode(query), fragment=''))
+
+
+class DiscoveryCrawler:
+    """Crawl listing/sitemap -> stream URL sản phẩm (mỗi URL chỉ yield 1 lần).
+
+    fetch: hàm tải trang (nên dùng fetch của scraper để có rate limit/retry/circuit breaker theo host)
+    normalize: chuẩn hóa URL trước khi khử trùng (vd: UrlCanonicalizer.canonicalize)
+    seen: tập URL đã gặp (mặc định set)
+    """
+
+    def __init__(self, fetch: Fetch, normalize: Optional[Callable[[str], str]] = None,
+                 max_pages: int = 200, seen: Optional[Any] = None):
+        self.fetch = fetch
+        self.normalize = normalize or (lambda url: url)
+        self.max_pages = max_pages  # Số trang listing tối đa mỗi seed
+        self.seen = set() if seen is None else seen  # URL sản phẩm + trang listing đã gặp
+        self.stats = {'pages': 0, 'sitemaps': 0, 'products': 0, 'duplicates': 0, 'errors': 0}
+
+    def _mark(self, url: str) -> bool:
+        """True nếu URL mới (chưa gặp)"""
+        if url in self.seen:
+            self.stats['duplicates'] += 1
+            return False
+        self.seen.add(url)
+        return True
+
+    def discover(self, seeds: Iterable[str]) -> Iterator[str]:
+        for seed in seeds:
+            try:
+                if is_sitemap(seed):
+                    yield from self._crawl_sitemap(seed)
+                else:
+                    yield from self._crawl_listing(seed)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"  ✗ Discovery lỗi {seed}: {e}")
+
+    def _crawl_sitemap(self, url: str) -> Iterator[str]:
+        self.stats['sitemaps'] += 1
+        rules = rules_for(url)
+        for loc in iter_sitemap(self.fetch, url):
+            if rules.is_product(loc):
+                loc = self.normalize(loc)
+                if self._mark(loc):
+                    self.stats['products'] += 1
+                    yield loc
+
+    def _crawl_listing(self, seed: str) -> Iterator[str]:
+        rules = rules_for(seed)
+        listing = urlparse(seed)
+        queue = deque([(self.normalize(seed), 1)])
+        self.seen.add(queue[0][0])
+        pages = 0
+        while queue and pages < self.max_pages:
+            page_url, page_no = queue.popleft()
+            try:
+                body, encoding = self.fetch(page_url)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"  ✗ Discovery lỗi {page_url}: {e}")
+                continue
+            pages += 1
+            self.stats['pages'] += 1
+            new_products = 0
+            next_pages: List[Tuple[str, int]] = []
+            for link in iter_links(page_url, body, encoding):
+                parsed = urlparse(link)
+                if parsed.netloc != listing.netloc:
+                    continue
+                if rules.is_product(link):
+                    link = self.normalize(link)
+                    if self._mark(link):
+                        new_products += 1
+                        self.stats['products'] += 1
+                        yield link
+                elif parsed.path == listing.path and dict(parse_qsl(parsed.query)).get(rules.page_param, '').isdigit():
+                    # Link phân trang của chính listing này (?page=N)
+                    next_pages.append((link, int(dict(parse_qsl(parsed.query))[rules.page_param])))
+            print(f"  Discovery: {page_url} -> {new_products} sản phẩm mới")
+            nxt = rel_next(page_url, body, encoding)
+            if nxt:
+                next_pages.append((nxt, page_no + 1))
+            if new_products:
+                # "Xem thêm": trang kế tiếp theo tham số trang, dừng khi 1 trang không còn sản phẩm mới
+                next_pages.append((with_page(page_url, rules.page_param, page_no + 1), page_no + 1))
+            for link, number in next_pages:
+                link = self.normalize(link)
+                if link not in self.seen:
+                    self.seen.add(link)
+                    queue.append((link, number))
+
+
+def main():
+    # Import lazy: product_scraper cũng import module này khi chạy --discover
+    from product_scraper import (BaseScraper, HostRateScheduler, ProductScraperManager, check_dependencies,
+                                 positive_float)
+    parser = argparse.ArgumentParser(description='Tìm URL sản phẩm từ trang danh mục hoặc sitemap.xml')
+    parser.add_argument('seeds', nargs='+', help='URL trang danh mục/listing hoặc sitemap (.xml, .xml.gz)')
+    parser.add_argument('--max-pages', type=int, default=200, help='Số trang listing tối đa mỗi seed (default: %(default)s)')
+    parser.add_argument('--rate', type=positive_float, default=2.0, help='Số request/giây tối đa cho mỗi host (default: %(default)s)')
+    args = parser.parse_args()
+    check_dependencies()
+    BaseScraper.scheduler = HostRateScheduler(rate=args.rate)
+    manager = ProductScraperManager()
+
+    def fetch(url: str) -> Tuple[bytes, Optional[str]]:
+        response = manager.scraper_for(url).fetch_response(url)
+        return response.content, response.encoding
+
+    crawler = DiscoveryCrawler(fetch, BaseScraper.canonicalizer.canonicalize, max_pages=args.max_pages)
+    # stdout chỉ có URL (log của crawler sang stderr) -> pipe thẳng vào product_scraper.py -f -
+    log, sys.stdout = sys.stdout, sys.stderr
+    try:
+        for url in crawler.discover(args.seeds):
+            print(url, file=log, flush=True)
+    finally:
+        sys.stdout = log
+    print(f"Discovery: {crawler.stats}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
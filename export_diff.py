@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Export Diff
+So sánh các dòng export (Products / Variants / Attributes / Media) với snapshot lần export trước:
+- Mỗi dòng có khóa (sku_prefix, sku, sku_prefix + tên thuộc tính, sku_prefix + URL ảnh) và digest nội dung
+- Kết quả: dòng thêm mới, dòng thay đổi, dòng bị xóa + bảng tóm tắt theo sheet
+- Snapshot lưu trong SQLite, chỉ cập nhật các dòng thay đổi (không ghi lại cả catalog mỗi lần)
+- Dòng bị xóa chỉ tính cho sản phẩm trong scope (đã cào lần này / URL trả 404, 410); input là toàn bộ
+  catalog (--full-catalog) thì mọi dòng không còn xuất hiện đều là bị xóa
+
+Dùng bởi product_scraper.py (--changes-only, --snapshot). Xem snapshot:
+    python export_diff.py [--db export_snapshot.db]
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    sheet       TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    digest      TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (sheet, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    url         TEXT PRIMARY KEY,
+    sku_prefix  TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sources_prefix ON sources (sku_prefix);
+"""
+
+# Cột tạo khóa dòng của từng sheet
+SHEET_KEYS = {
+    'Products': ('sku_prefix',),
+    'Variants': ('sku',),
+    'Attributes': ('product_sku_prefix', 'attribute_name'),
+    'Media': ('product_sku_prefix', 'url'),
+}
+# Cột SKU prefix sản phẩm của từng sheet (giới hạn dòng bị xóa theo sản phẩm)
+PRODUCT_COLUMNS = {
+    'Products': 'sku_prefix',
+    'Variants': 'product_sku_prefix',
+    'Attributes': 'product_sku_prefix',
+    'Media': 'product_sku_prefix',
+}
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _digest(values: Sequence[Any]) -> str:
+    return hashlib.blake2b(json.dumps(list(values), ensure_ascii=False, default=str).encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+@dataclass
+class SheetChanges:
+    headers: List[str]
+    inserted: List[list] = field(default_factory=list)
+    updated: List[list] = field(default_factory=list)
+    removed: List[Tuple[str, list]] = field(default_factory=list)   # (key, dòng cũ)
+    unchanged: int = 0
+    # Thay đổi cần ghi vào snapshot khi apply(): key -> (digest, dòng) hoặc None = xóa
+    pending: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+
+class ExportSnapshot:
+    """SQLite snapshot các dòng đã export lần trước"""
+
+    def __init__(self, path: str = 'export_snapshot.db'):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def diff(self, sheets: Dict[str, Tuple[List[str], List[list]]], removals: bool = True,
+             scope: Optional[Set[str]] = None) -> Dict[str, SheetChanges]:
+        """So sánh {sheet: (headers, rows)} với snapshot; chưa ghi gì (gọi apply() sau khi export xong).
+
+        removals=False: không coi dòng thiếu là bị xóa.
+        scope: chỉ dòng thiếu của các SKU prefix này mới là bị xóa; None = mọi dòng thiếu (input là toàn bộ catalog).
+        """
+        changes: Dict[str, SheetChanges] = {}
+        for sheet, (headers, rows) in sheets.items():
+            key_columns = [headers.index(c) for c in SHEET_KEYS.get(sheet, headers[:1])]
+            with self._lock:
+                previous = dict(self._conn.execute('SELECT key, digest FROM rows WHERE sheet = ?', (sheet,)))
+            result = changes[sheet] = SheetChanges(list(headers))
+            seen: Dict[str, int] = {}
+            for row in rows:
+                key = '\x1f'.join(str(row[i]) for i in key_columns)
+                # Khóa lặp lại trong cùng sản phẩm (vd: 2 thuộc tính cùng tên) -> đánh số thứ tự
+                n = seen[key] = seen.get(key, 0) + 1
+                if n > 1:
+                    key = f"{key}\x1f#{n}"
+                digest = _digest(row)
+                old = previous.pop(key, None)
+                if old == digest:
+                    result.unchanged += 1
+                    continue
+                (result.inserted if old is None else result.updated).append(row)
+                result.pending[key] = (digest, row)
+            if previous and removals:
+                product_column = headers.index(PRODUCT_COLUMNS[sheet]) if sheet in PRODUCT_COLUMNS else None
+                with self._lock:
+                    for key in previous:
+                        row = json.loads(self._conn.execute('SELECT data FROM rows WHERE sheet = ? AND key = ?',
+                                                            (sheet, key)).fetchone()[0])
+                        if scope is not None and (product_column is None or row[product_column] not in scope):
+                            continue
+                        result.removed.append((key, row))
+                        result.pending[key] = None
+        return changes
+
+    def apply(self, changes: Dict[str, SheetChanges], sources: Optional[Dict[str, str]] = None):
+        """Cập nhật snapshot theo kết quả diff (1 transaction); sources: key URL nguồn -> SKU prefix sản phẩm"""
+        now = _now()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                for sheet, result in changes.items():
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO rows (sheet, key, digest, data, updated_at) VALUES (?, ?, ?, ?, ?)',
+                        [(sheet, key, value[0], json.dumps(value[1], ensure_ascii=False, default=str), now)
+                         for key, value in result.pending.items() if value is not None])
+                    self._conn.executemany('DELETE FROM rows WHERE sheet = ? AND key = ?',
+                                           [(sheet, key) for key, value in result.pending.items() if value is None])
+                self._conn.executemany('INSERT OR REPLACE INTO sources (url, sku_prefix) VALUES (?, ?)',
+                                       list((sources or {}).items()))
+                removed = changes.get('Products')
+                if removed:
+                    self._conn.executemany('DELETE FROM sources WHERE sku_prefix = ?',
+                                           [(key,) for key, value in removed.pending.items() if value is None])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def prefixes(self, urls: Iterable[str]) -> Set[str]:
+        """SKU prefix của các sản phẩm đã export từ các key URL này"""
+        urls = list(urls)
+        found: Set[str] = set()
+        with self._lock:
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                found.update(r[0] for r in self._conn.execute(
+                    f"SELECT sku_prefix FROM sources WHERE url IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute('SELECT sheet, COUNT(*) FROM rows GROUP BY sheet'))
+
+
+def summary(changes: Dict[str, SheetChanges]) -> List[Dict[str, Any]]:
+    return [{'sheet': sheet, 'inserted': len(c.inserted), 'updated': len(c.updated), 'removed': len(c.removed),
+             'unchanged': c.unchanged} for sheet, c in changes.items()]
+
+
+def change_sheets(changes: Dict[str, SheetChanges]) -> Tuple[Dict[str, Tuple[List[str], List[list]]], Dict[str, List[Dict[str, Any]]]]:
+    """Sheet dữ liệu (chỉ dòng thêm/đổi, thêm cột change cuối) + sheet Removed và Summary"""
+    sheets = {sheet: (c.headers + ['change'],
+                      [row + ['insert'] for row in c.inserted] + [row + ['update'] for row in c.updated])
+              for sheet, c in changes.items()}
+    extra = {'Summary': summary(changes)}
+    removed = []
+    for sheet, c in changes.items():
+        for _, row in c.removed:
+            # Chỉ giữ cột khóa -> backend biết cần xóa dòng nào
+            data = dict(zip(c.headers, row))
+            removed.append({'sheet': sheet, 'product_sku_prefix': data.get('product_sku_prefix', data.get('sku_prefix')),
+                            'sku': data.get('sku'), 'attribute_name': data.get('attribute_name'),
+                            'url': data.get('url')})
+    if removed:
+        extra['Removed'] = removed
+    return sheets, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem snapshot export')
+    parser.add_argument('--db', default='export_snapshot.db', help='File SQLite (default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(ExportSnapshot(args.db).stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Crawl Job Store
+Lưu trạng thái job cào vào SQLite để checkpoint liên tục và resume sau khi crash:
+- URL frontier (thứ tự, không trùng URL / key sản phẩm trong 1 job - khử trùng chính xác bằng UNIQUE index,
+  giữ nguyên qua --resume)
+- Tập key sản phẩm đã cào (KeySet) cho UrlCanonicalizer, thay set trong RAM
+- Trạng thái từng URL: pending / running / done / failed / gone (site trả 404/410) / skipped
+- Số lần thử, lỗi cuối cùng, kết quả đã trích xuất (JSON)
+- Nguồn URL của job (file -f, URL, seed discover) + vị trí đã đọc -> --resume đọc tiếp phần còn lại
+
+Dùng bởi product_scraper.py (--resume JOB, --job-db). Xem job:
+    python job_store.py [--db scrape_jobs.db] [JOB_ID]
+"""
+
+import argparse
+import itertools
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT NOT NULL DEFAULT 'running',
+    output      TEXT NOT NULL DEFAULT '',
+    sources     TEXT NOT NULL DEFAULT '{}',
+    source_offset INTEGER NOT NULL DEFAULT 0,
+    source_done INTEGER NOT NULL DEFAULT 0,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    job_id      TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    url         TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    result      TEXT,
+    updated_at  TEXT,
+    key         TEXT,
+    PRIMARY KEY (job_id, url)
+);
+CREATE INDEX IF NOT EXISTS idx_urls_job_status_seq ON urls (job_id, status, seq);
+CREATE TABLE IF NOT EXISTS fetched_keys (
+    job_id      TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    PRIMARY KEY (job_id, key)
+) WITHOUT ROWID;
+"""
+# Cột thêm sau (DB cũ chưa có -> ALTER TABLE khi mở)
+JOB_COLUMNS = (
+    ('sources', "TEXT NOT NULL DEFAULT '{}'"),
+    ('source_offset', 'INTEGER NOT NULL DEFAULT 0'),
+    ('source_done', 'INTEGER NOT NULL DEFAULT 0'),
+)
+URL_COLUMNS = (
+    ('key', 'TEXT'),
+)
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class JobStore:
+    """SQLite job store (WAL, mỗi thay đổi commit ngay = checkpoint liên tục)"""
+
+    def __init__(self, path: str = 'scrape_jobs.db'):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        for table, table_columns in (('jobs', JOB_COLUMNS), ('urls', URL_COLUMNS)):
+            columns = {row['name'] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            for name, ddl in table_columns:
+                if name not in columns:
+                    self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}')
+        # Key NULL (URL nạp trước khi có cột key) không xung đột với nhau
+        self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_job_key ON urls (job_id, key)')
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Job ----------
+
+    def create_job(self, urls: Iterable[str], output: str = '', job_id: Optional[str] = None,
+                   sources: Optional[Dict[str, Any]] = None) -> str:
+        """sources: mô tả nguồn URL (file -f, URL command line, seed discover) để --resume mở lại"""
+        job_id = job_id or datetime.now().strftime('job_%y%m%d_%H%M%S_%f')
+        with self._lock:
+            self._conn.execute('INSERT INTO jobs (id, output, sources, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                               (job_id, output, json.dumps(sources or {}, ensure_ascii=False), _now(), _now()))
+        self.add_urls(job_id, urls)
+        return job_id
+
+    def add_urls(self, job_id: str, urls: Iterable[str], chunk_size: int = 1000,
+                 key: Optional[Callable[[str], str]] = None) -> int:
+        """Thêm URL vào frontier (bỏ qua URL đã có), ghi theo chunk -> không cần giữ cả list trong RAM.
+
+        key: khóa sản phẩm của URL (vd: UrlCanonicalizer.static_key) -> URL khác nhưng cùng key cũng bị bỏ qua.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM urls WHERE job_id = ?', (job_id,)).fetchone()
+        seq = row[0]
+        added = 0
+        chunk: List[tuple] = []
+        for url in urls:
+            seq += 1
+            chunk.append((job_id, seq, url, key(url) if key else None))
+            if len(chunk) >= chunk_size:
+                added += self._insert_urls(chunk)
+                chunk = []
+        if chunk:
+            added += self._insert_urls(chunk)
+        return added
+
+    def _insert_urls(self, rows: List[tuple]) -> int:
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR IGNORE INTO urls (job_id, seq, url, key) VALUES (?, ?, ?, ?)', rows)
+            self._conn.execute('COMMIT')
+            return self._conn.total_changes - before
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['sources'] = json.loads(job['sources'] or '{}')
+        job['source_done'] = bool(job['source_done'])
+        job['progress'] = self.progress(job_id)
+        return job
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute('SELECT id FROM jobs ORDER BY created_at').fetchall()
+        return [self.get_job(r['id']) for r in rows]
+
+    def set_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?', (status, _now(), job_id))
+
+    def set_source_position(self, job_id: str, offset: int, done: bool = False):
+        """Số mục đã đọc từ source (đã nạp vào frontier) + đã đọc hết source chưa"""
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET source_offset = ?, source_done = ?, updated_at = ? WHERE id = ?',
+                               (offset, int(done), _now(), job_id))
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        """Số URL theo trạng thái + total"""
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) AS n FROM urls WHERE job_id = ? GROUP BY status',
+                                      (job_id,)).fetchall()
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0, 'gone': 0, 'skipped': 0}
+        counts.update({r['status']: r['n'] for r in rows})
+        counts['total'] = sum(counts.values())
+        return counts
+
+    # ---------- Frontier ----------
+
+    def requeue(self, job_id: str, include_failed: bool = False) -> int:
+        """Đưa URL 'running' (process chết giữa chừng) - và 'failed' nếu muốn - về pending"""
+        statuses = ('running', 'failed') if include_failed else ('running',)
+        with self._lock:
+            cur = self._conn.execute(
+                f"UPDATE urls SET status = 'pending' WHERE job_id = ? AND status IN ({','.join('?' * len(statuses))})",
+                (job_id, *statuses))
+            return cur.rowcount
+
+    def pending_after(self, job_id: str, after_seq: int = 0, limit: int = 1000) -> List[Tuple[int, str]]:
+        """1 trang URL pending có seq > after_seq -> [(seq, url)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, url FROM urls WHERE job_id = ? AND status = 'pending' AND seq > ? "
+                "ORDER BY seq LIMIT ?", (job_id, after_seq, limit)).fetchall()
+        return [(row['seq'], row['url']) for row in rows]
+
+    def pending_urls(self, job_id: str, page_size: int = 1000) -> Iterator[str]:
+        """Duyệt URL pending theo seq, đọc từng trang (không giữ cả frontier trong RAM)"""
+        last_seq = 0
+        while True:
+            rows = self.pending_after(job_id, last_seq, page_size)
+            if not rows:
+                return
+            for seq, url in rows:
+                yield url
+            last_seq = rows[-1][0]
+
+    def mark_running(self, job_id: str, url: str):
+        with self._lock:
+            self._conn.execute("UPDATE urls SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                               "WHERE job_id = ? AND url = ?", (_now(), job_id, url))
+
+    def record_success(self, job_id: str, url: str, result: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute("UPDATE urls SET status = 'done', result = ?, last_error = NULL, updated_at = ? "
+                               "WHERE job_id = ? AND url = ?",
+                               (json.dumps(result, ensure_ascii=False), _now(), job_id, url))
+
+    def record_failure(self, job_id: str, url: str, error: str):
+        with self._lock:
+            self._conn.execute("UPDATE urls SET status = 'failed', last_error = ?, updated_at = ? "
+                               "WHERE job_id = ? AND url = ?", (error, _now(), job_id, url))
+
+    def record_gone(self, job_id: str, url: str, error: str):
+        """Site trả 404/410: sản phẩm đã bị gỡ (không cào lại khi --retry-failed)"""
+        with self._lock:
+            self._conn.execute("UPDATE urls SET status = 'gone', last_error = ?, updated_at = ? "
+                               "WHERE job_id = ? AND url = ?", (error, _now(), job_id, url))
+
+    def record_skipped(self, job_id: str, url: str, reason: str):
+        """URL không cần cào (vd: trùng sản phẩm với URL khác)"""
+        with self._lock:
+            self._conn.execute("UPDATE urls SET status = 'skipped', last_error = ?, updated_at = ? "
+                               "WHERE job_id = ? AND url = ?", (reason, _now(), job_id, url))
+
+    def iter_results(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """Kết quả đã cào xong theo thứ tự frontier"""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, result FROM urls WHERE job_id = ? AND status = 'done' AND seq > ? "
+                    "ORDER BY seq LIMIT 500", (job_id, last_seq)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row['result'])
+            last_seq = rows[-1]['seq']
+
+    def gone_urls(self, job_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM urls WHERE job_id = ? AND status = 'gone' ORDER BY seq",
+                                      (job_id,)).fetchall()
+        return [r['url'] for r in rows]
+
+    # ---------- Key sản phẩm đã cào ----------
+
+    def add_key(self, job_id: str, key: str):
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO fetched_keys (job_id, key) VALUES (?, ?)', (job_id, key))
+
+    def has_key(self, job_id: str, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM fetched_keys WHERE job_id = ? AND key = ?',
+                                      (job_id, key)).fetchone() is not None
+
+    def count_keys(self, job_id: str) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM fetched_keys WHERE job_id = ?', (job_id,)).fetchone()[0]
+
+    def failures(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT url, attempts, last_error FROM urls WHERE job_id = ? AND status = 'failed' "
+                                      "ORDER BY seq", (job_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+
+class KeySet:
+    """Tập key chính xác của 1 job trong SQLite (add / in / len như set) - không false positive,
+    bộ nhớ không tăng theo số URL, còn nguyên khi --resume"""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    def add(self, key: str):
+        self.store.add_key(self.job_id, key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.store.has_key(self.job_id, key)
+
+    def __len__(self) -> int:
+        return self.store.count_keys(self.job_id)
+
+
+class Frontier:
+    """Frontier dạng stream: nạp URL từ source vào store theo chunk khi cần, yield URL pending theo seq.
+
+    URL pending có sẵn (khi resume) được yield trước, sau đó mới đọc tiếp source -> bộ nhớ chỉ ~1 chunk
+    dù source có hàng triệu dòng. URL trả về đã được đánh dấu 'running'.
+
+    Sau mỗi chunk, vị trí đọc source (position(), mặc định = số URL đã lấy từ source) được lưu vào job
+    -> --resume mở lại source và đọc tiếp từ đó.
+    key: khóa sản phẩm của URL (xem JobStore.add_urls) -> URL trùng bị bỏ khi nạp, cùng transaction với chunk.
+    """
+
+    def __init__(self, store: JobStore, job_id: str, source: Iterable[str] = (), chunk_size: int = 1000,
+                 position: Optional[Callable[[], int]] = None, key: Optional[Callable[[str], str]] = None):
+        self.store = store
+        self.job_id = job_id
+        self.source = iter(source)
+        self.chunk_size = chunk_size
+        self.position = position
+        self.key = key
+        self.read = 0           # Số URL đã lấy từ source
+        self.added = 0          # Số URL mới (không trùng) đã nạp từ source; read - added = số URL trùng
+        self.exhausted = False  # Đã đọc hết source
+
+    def __iter__(self) -> Iterator[str]:
+        last_seq = 0
+        while True:
+            rows = self.store.pending_after(self.job_id, last_seq, self.chunk_size)
+            if not rows:
+                if self.exhausted:
+                    return
+                chunk = list(itertools.islice(self.source, self.chunk_size))
+                self.read += len(chunk)
+                if not chunk:
+                    self.exhausted = True
+                    self.store.set_source_position(self.job_id, self._position(), done=True)
+                    continue
+                self.added += self.store.add_urls(self.job_id, chunk, key=self.key)
+                self.store.set_source_position(self.job_id, self._position())
+                continue
+            for seq, url in rows:
+                last_seq = seq
+                self.store.mark_running(self.job_id, url)
+                yield url
+
+    def _position(self) -> int:
+        return self.position() if self.position is not None else self.read
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem trạng thái các job cào trong SQLite job store')
+    parser.add_argument('job_id', nargs='?', help='Job cần xem chi tiết (bỏ trống = liệt kê tất cả)')
+    parser.add_argument('--db', default='scrape_jobs.db', help='File SQLite (default: %(default)s)')
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    if not args.job_id:
+        for job in store.list_jobs():
+            p = job['progress']
+            print(f"{job['id']}  {job['status']:<12} {p['done']}/{p['total']} done, {p['failed']} failed  -> {job['output']}")
+        return
+
+    job = store.get_job(args.job_id)
+    if job is None:
+        parser.error(f"Không tìm thấy job: {args.job_id}")
+    print(json.dumps(job, ensure_ascii=False, indent=2))
+    for failure in store.failures(args.job_id):
+        print(f"✗ {failure['url']} (attempts={failure['attempts']}): {failure['last_error']}")
+
+
+if __name__ == '__main__':
+    main()
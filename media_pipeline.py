@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Media Pipeline
+Tải ảnh sản phẩm song song (connection pool riêng), mỗi ảnh chỉ tải 1 lần cho cả catalog:
+- Chuẩn hóa URL về bản lớn nhất (bỏ hậu tố/segment kích thước của CDN: -300x300, /358x358,webp/, fit-in/...)
+- Khử trùng theo sha256 nội dung + perceptual hash (dHash, cần Pillow) -> cùng ảnh khác kích thước/nén chỉ giữ 1;
+  dHash là ảnh xám nên phải khớp thêm chữ ký màu (ảnh các màu của cùng sản phẩm không bị gộp)
+- URL bản lớn nhất tải lỗi -> dùng lại URL gốc
+- Cache local content-addressed: <dir>/ab/abcdef....jpg + thumbnail <dir>/thumbs/ab/abcdef....jpg
+- Index SQLite (<dir>/index.db): URL -> asset, chạy lại không tải lại ảnh đã có
+
+Dùng bởi product_scraper.py (--images DIR). Xem cache:
+    python media_pipeline.py [DIR]
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PIL_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+# (regex, thay thế) đưa URL ảnh về bản gốc/lớn nhất
+SIZE_VARIANT_RULES: List[Tuple[str, str]] = [
+    # Cellphones: cdn2.cellphones.com.vn/358x358,webp,q100/media/... -> bản gốc
+    (r'(cellphones\.com\.vn)/\d+x\d+(,[^/]*)?/', r'\1/'),
+    (r'/insecure/rs:fill:\d+:\d+/q:\d+/plain/', '/'),
+    # FPT Shop (thumbor): images.fpt.shop/unsafe/fit-in/214x214/filters:quality(90)/... -> unsafe/...
+    (r'/unsafe/(fit-in/)?\d+x\d+/', '/unsafe/'),
+    (r'/unsafe/filters:[^/]*/', '/unsafe/'),
+    # MWG (DMX/TGDD) + WordPress: ten-anh-300x300.jpg -> ten-anh.jpg
+    (r'-\d{2,4}x\d{2,4}(?=\.(jpe?g|png|webp|gif)\b)', ''),
+]
+# Query chỉ quy định kích thước/chất lượng
+_SIZE_QUERY_RE = re.compile(r'[?&](w|h|width|height|size|quality|q|fit)=[^&]*', re.I)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    digest       TEXT PRIMARY KEY,
+    phash        INTEGER,
+    color        TEXT,
+    width        INTEGER,
+    height       INTEGER,
+    bytes        INTEGER NOT NULL,
+    content_type TEXT,
+    path         TEXT NOT NULL,
+    thumb        TEXT
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url          TEXT PRIMARY KEY,
+    digest       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_assets_phash ON assets (phash);
+"""
+COLOR_TOLERANCE = 24    # Chênh lệch tối đa mỗi kênh màu (0-255) của chữ ký màu để coi là cùng ảnh
+
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+
+
+def normalize_image_url(url: str) -> str:
+    """URL bản lớn nhất của ảnh (bỏ biến thể kích thước)"""
+    url = url.strip()
+    if url.startswith('//'):
+        url = 'https:' + url
+    for pattern, replacement in SIZE_VARIANT_RULES:
+        url = re.sub(pattern, replacement, url)
+    url = _SIZE_QUERY_RE.sub(lambda m: '?' if m.group(0).startswith('?') else '', url)
+    return url.replace('?&', '?').rstrip('?')
+
+
+def dhash(image, size: int = 8) -> int:
+    """Difference hash 64-bit (ảnh PIL) - bền với resize/nén lại"""
+    gray = image.convert('L').resize((size + 1, size))
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (size + 1) + col + 1])
+    # SQLite INTEGER là số có dấu 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def color_signature(image, size: int = 2) -> str:
+    """Màu trung bình của size x size vùng ảnh (RGB, hex) - phân biệt ảnh cùng dáng khác màu mà dHash xám bỏ qua"""
+    return bytes(channel for pixel in image.convert('RGB').resize((size, size)).getdata() for channel in pixel).hex()
+
+
+def colors_close(a: Optional[str], b: Optional[str], tolerance: int = COLOR_TOLERANCE) -> bool:
+    if not a or not b or len(a) != len(b):
+        return False  # Thiếu chữ ký màu (asset cũ) -> không gộp theo perceptual hash
+    return max(abs(x - y) for x, y in zip(bytes.fromhex(a), bytes.fromhex(b))) <= tolerance
+
+
+class PerceptualIndex:
+    """Tìm ảnh gần giống theo Hamming distance của dHash.
+
+    Chia hash 64-bit thành (max_distance + 1) dải: 2 hash lệch <= max_distance bit thì chắc chắn trùng
+    ít nhất 1 dải (pigeonhole) -> chỉ so sánh với ứng viên cùng dải, không quét toàn bộ.
+    """
+
+    def __init__(self, max_distance: int = 4):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.width = -(-64 // self.bands)
+        self._buckets: List[Dict[int, List[Tuple[int, str, Optional[str]]]]] = [{} for _ in range(self.bands)]
+
+    def _keys(self, phash: int) -> Iterable[Tuple[int, int]]:
+        unsigned = phash & ((1 << 64) - 1)
+        mask = (1 << self.width) - 1
+        for band in range(self.bands):
+            yield band, (unsigned >> (band * self.width)) & mask
+
+    def add(self, phash: int, digest: str, color: Optional[str] = None):
+        for band, key in self._keys(phash):
+            self._buckets[band].setdefault(key, []).append((phash, digest, color))
+
+    def find(self, phash: int, color: Optional[str] = None) -> Optional[str]:
+        """Asset gần giống: dHash lệch <= max_distance bit và chữ ký màu gần nhau"""
+        for band, key in self._keys(phash):
+            for other, digest, other_color in self._buckets[band].get(key, ()):
+                if (bin((phash ^ other) & ((1 << 64) - 1)).count('1') <= self.max_distance
+                        and colors_close(color, other_color)):
+                    return digest
+        return None
+
+
+class ImageCache:
+    """Cache ảnh content-addressed trên đĩa + index SQLite (URL -> asset)"""
+
+    def __init__(self, root: str, thumb_size: Tuple[int, int] = (256, 256), max_distance: int = 4):
+        self.root = root
+        self.thumb_size = thumb_size
+        os.makedirs(os.path.join(root, 'thumbs'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        if 'color' not in {row['name'] for row in self._conn.execute('PRAGMA table_info(assets)')}:
+            self._conn.execute('ALTER TABLE assets ADD COLUMN color TEXT')  # Cache cũ
+        self._lock = threading.Lock()
+        self.phashes = PerceptualIndex(max_distance)
+        for row in self._conn.execute('SELECT digest, phash, color FROM assets WHERE phash IS NOT NULL'):
+            self.phashes.add(row['phash'], row['digest'], row['color'])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """Asset đã cache của URL (None nếu chưa tải)"""
+        with self._lock:
+            row = self._conn.execute('SELECT a.* FROM urls u JOIN assets a ON a.digest = u.digest WHERE u.url = ?',
+                                     (url,)).fetchone()
+        return dict(row) if row else None
+
+    def store(self, url: str, data: bytes, content_type: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """Lưu ảnh vừa tải -> (asset, lý do: 'new' | 'content' | 'perceptual')"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM assets WHERE digest = ?', (digest,)).fetchone()
+        if row:
+            self._link(url, digest)
+            return dict(row), 'content'
+
+        phash = color = width = height = None
+        image = None
+        if PIL_AVAILABLE:
+            try:
+                from PIL import Image
+                image = Image.open(io.BytesIO(data))
+                image.load()
+                width, height = image.size
+                phash = dhash(image)
+                color = color_signature(image)
+            except Exception:
+                image = None  # Không decode được (svg, ảnh hỏng...) -> chỉ khử trùng theo nội dung
+        if phash is not None:
+            with self._lock:
+                similar = self.phashes.find(phash, color)
+            if similar:
+                self._link(url, similar)
+                return self.lookup(url), 'perceptual'
+
+        ext = _EXTENSIONS.get((content_type or '').split(';')[0].strip().lower()) \
+            or os.path.splitext(url.split('?')[0])[1][:5] or '.bin'
+        path = os.path.join(self.root, digest[:2], digest + ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        thumb = None
+        if image is not None:
+            thumb = os.path.join(self.root, 'thumbs', digest[:2], digest + '.jpg')
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            preview = image.convert('RGB')
+            preview.thumbnail(self.thumb_size)
+            preview.save(thumb, 'JPEG', quality=85)
+        asset = {'digest': digest, 'phash': phash, 'color': color, 'width': width, 'height': height, 'bytes': len(data),
+                 'content_type': content_type, 'path': path, 'thumb': thumb}
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO assets (digest, phash, color, width, height, bytes, '
+                               'content_type, path, thumb) VALUES (:digest, :phash, :color, :width, :height, '
+                               ':bytes, :content_type, :path, :thumb)', asset)
+            if phash is not None:
+                self.phashes.add(phash, digest, color)
+        self._link(url, digest)
+        return asset, 'new'
+
+    def _link(self, url: str, digest: str):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)', (url, digest))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            assets, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM assets').fetchone()
+            urls = self._conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+        return {'assets': assets, 'urls': urls, 'bytes': size}
+
+
+class MediaPipeline:
+    """Stage media: tải ảnh của cả danh sách sản phẩm song song, khử trùng, ghi lại product.images"""
+
+    def __init__(self, cache: ImageCache, workers: int = 8, timeout: float = 20.0):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        # Connection pool riêng (CDN ảnh), không dùng chung session/rate limit của scraper trang
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 '
+                                              '(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36')
+        self.stats = {'urls': 0, 'cached': 0, 'downloaded': 0, 'duplicate_content': 0,
+                      'duplicate_perceptual': 0, 'fallback': 0, 'failed': 0}
+        if not PIL_AVAILABLE:
+            print("  (Pillow chưa cài: chỉ khử trùng ảnh theo nội dung, không có perceptual hash/thumbnail)")
+
+    def _download(self, url: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            asset, reason = self.cache.store(url, response.content, response.headers.get('Content-Type'))
+        except Exception as e:
+            print(f"  ✗ Ảnh lỗi {url}: {e}")
+            return 'failed', None
+        return ('downloaded' if reason == 'new' else f'duplicate_{reason}'), asset
+
+    def _resolve(self, urls: Iterable[str], assets: Dict[str, Dict[str, Any]]):
+        """Asset của từng URL: lấy từ cache hoặc tải song song (URL tải lỗi không có trong assets)"""
+        from concurrent.futures import ThreadPoolExecutor
+        todo = []
+        for url in urls:
+            cached = self.cache.lookup(url)
+            if cached:
+                self.stats['cached'] += 1
+                assets[url] = cached
+            else:
+                todo.append(url)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='media') as pool:
+            for url, (outcome, asset) in zip(todo, pool.map(self._download, todo)):
+                if asset is not None:
+                    self.stats[outcome] += 1
+                    assets[url] = asset
+
+    def process(self, products: Iterable[Any]) -> Dict[str, int]:
+        """Tải ảnh cho mọi sản phẩm (mỗi URL chuẩn hóa 1 lần), thay product.images bằng URL đã khử trùng"""
+        products = list(products)
+        normalized = {url: normalize_image_url(url) for p in products for url in p.images}
+        assets: Dict[str, Dict[str, Any]] = {}
+        largest = list(dict.fromkeys(normalized.values()))
+        self.stats['urls'] += len(largest)
+        self._resolve(largest, assets)
+        # URL bản lớn nhất chỉ là đoán theo quy tắc CDN: tải lỗi -> thử URL gốc trong trang sản phẩm
+        self._resolve(dict.fromkeys(url for url, large in normalized.items() if large not in assets and url != large),
+                      assets)
+        chosen = {}
+        for url, large in normalized.items():
+            if large in assets:
+                chosen[url] = large
+            else:
+                chosen[url] = url
+                self.stats['fallback' if url in assets else 'failed'] += 1
+
+        # Mỗi sản phẩm: URL bản lớn nhất (lỗi -> URL gốc), bỏ ảnh trùng asset
+        for product in products:
+            images, seen = [], set()
+            for url in product.images:
+                url = chosen[url]
+                asset = assets.get(url)
+                key = asset['digest'] if asset else url
+                if key not in seen:
+                    seen.add(key)
+                    images.append(url)
+            product.images = images
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem thống kê cache ảnh')
+    parser.add_argument('root', nargs='?', default='media_cache', help='Thư mục cache (default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(ImageCache(args.root).stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
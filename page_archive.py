@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Raw Page Archive
+Lưu body + headers của mọi trang đã fetch vào SQLite, nén + content-addressed:
+- Blob định danh bằng sha256 của body -> trang không đổi giữa các lần cào chỉ lưu 1 lần
+- Nén zlib với dictionary huấn luyện theo từng site (header/footer/boilerplate lặp lại giữa các trang)
+- Mỗi lần fetch là 1 bản ghi pages(url, thời điểm, encoding, headers, digest)
+- Bảng latest (url -> bản ghi fetch mới nhất) cập nhật khi ghi -> --reextract duyệt theo index, không GROUP BY
+
+Dùng bởi product_scraper.py (--archive, --reextract). Xem archive:
+    python page_archive.py [--db page_archive.db]
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id          INTEGER PRIMARY KEY,
+    site        TEXT NOT NULL,
+    data        BLOB NOT NULL,
+    created_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest      TEXT PRIMARY KEY,
+    dict_id     INTEGER,
+    size        INTEGER NOT NULL,
+    data        BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id          INTEGER PRIMARY KEY,
+    url         TEXT NOT NULL,
+    site        TEXT NOT NULL,
+    fetched_at  TEXT NOT NULL,
+    encoding    TEXT,
+    headers     TEXT,
+    digest      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest (
+    url         TEXT PRIMARY KEY,
+    site        TEXT NOT NULL,
+    page_id     INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_pages_url ON pages (url, id);
+CREATE INDEX IF NOT EXISTS idx_pages_site ON pages (site, id);
+CREATE INDEX IF NOT EXISTS idx_latest_page ON latest (page_id);
+CREATE INDEX IF NOT EXISTS idx_latest_site_page ON latest (site, page_id);
+"""
+
+DICT_SIZE = 32 * 1024    # zlib chỉ dùng 32KB cuối của dictionary
+TRAIN_SAMPLES = 16       # Số trang mẫu của 1 site trước khi huấn luyện dictionary
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def site_of(url: str) -> str:
+    host = (urlparse(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def train_dictionary(samples: List[bytes], size: int = DICT_SIZE) -> bytes:
+    """Dictionary từ các dòng lặp lại ở >= nửa số trang mẫu (template chung của site).
+
+    zlib ưu tiên dữ liệu ở cuối dictionary (khoảng cách ngắn hơn) -> dòng phổ biến nhất đặt cuối.
+    """
+    counts: Counter = Counter()
+    for body in samples:
+        counts.update(line for line in set(body.splitlines()) if 8 <= len(line) <= 4096)
+    threshold = max(2, len(samples) // 2)
+    chosen: List[bytes] = []
+    total = 0
+    for line, n in counts.most_common():
+        if n < threshold:
+            break
+        if total + len(line) + 1 > size:
+            continue
+        chosen.append(line)
+        total += len(line) + 1
+    return b'\n'.join(reversed(chosen))
+
+
+class PageArchive:
+    """SQLite archive trang thô (WAL, an toàn khi nhiều thread fetch cùng ghi)"""
+
+    def __init__(self, path: str = 'page_archive.db', level: int = 6, train_samples: int = TRAIN_SAMPLES):
+        self.path = path
+        self.level = level
+        self.train_samples = train_samples
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        if (self._conn.execute('SELECT 1 FROM pages LIMIT 1').fetchone()
+                and not self._conn.execute('SELECT 1 FROM latest LIMIT 1').fetchone()):
+            # Archive cũ chưa có bảng latest -> dựng 1 lần
+            self._conn.execute('INSERT INTO latest (url, site, page_id) '
+                               'SELECT url, site, MAX(id) FROM pages GROUP BY url')
+        self._lock = threading.Lock()
+        self._dicts: Dict[int, bytes] = {}         # dict_id -> data
+        self._site_dict: Dict[str, int] = {}       # site -> dict_id mới nhất
+        self._samples: Dict[str, List[bytes]] = {}  # Trang mẫu của site chưa có dictionary
+        for row in self._conn.execute('SELECT id, site, data FROM dictionaries ORDER BY id'):
+            self._dicts[row['id']] = row['data']
+            self._site_dict[row['site']] = row['id']
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Ghi ----------
+
+    def put(self, url: str, body: bytes, encoding: Optional[str] = None,
+            headers: Optional[Dict[str, str]] = None) -> str:
+        """Lưu 1 lần fetch, trả về digest của body"""
+        digest = hashlib.sha256(body).hexdigest()
+        site = site_of(url)
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            dict_id = self._dictionary_for(site, body) if not exists else None
+        if not exists:
+            # Nén ngoài lock (zlib nhả GIL) -> các thread fetch nén song song
+            data = self._compress(body, self._dicts.get(dict_id))
+            with self._lock:
+                self._conn.execute('INSERT OR IGNORE INTO blobs (digest, dict_id, size, data) VALUES (?, ?, ?, ?)',
+                                   (digest, dict_id, len(body), data))
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                page_id = self._conn.execute('INSERT INTO pages (url, site, fetched_at, encoding, headers, digest) '
+                                             'VALUES (?, ?, ?, ?, ?, ?)',
+                                             (url, site, _now(), encoding, json.dumps(headers or {}), digest)).lastrowid
+                self._conn.execute('INSERT INTO latest (url, site, page_id) VALUES (?, ?, ?) ON CONFLICT (url) '
+                                   'DO UPDATE SET site = excluded.site, page_id = excluded.page_id '
+                                   'WHERE excluded.page_id > latest.page_id', (url, site, page_id))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return digest
+
+    def _dictionary_for(self, site: str, body: bytes) -> Optional[int]:
+        """dict_id dùng để nén (gọi khi giữ lock); gom mẫu và huấn luyện khi đủ"""
+        dict_id = self._site_dict.get(site)
+        if dict_id is not None:
+            return dict_id
+        samples = self._samples.setdefault(site, [])
+        samples.append(body)
+        if len(samples) < self.train_samples:
+            return None
+        data = train_dictionary(samples)
+        del self._samples[site]
+        if not data:
+            return None
+        dict_id = self._conn.execute('INSERT INTO dictionaries (site, data, created_at) VALUES (?, ?, ?)',
+                                     (site, data, _now())).lastrowid
+        self._dicts[dict_id] = data
+        self._site_dict[site] = dict_id
+        return dict_id
+
+    def _compress(self, body: bytes, zdict: Optional[bytes]) -> bytes:
+        if zdict:
+            compressor = zlib.compressobj(self.level, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(body) + compressor.flush()
+
+    # ---------- Đọc ----------
+
+    def body(self, digest: str) -> bytes:
+        with self._lock:
+            row = self._conn.execute('SELECT dict_id, data FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                raise KeyError(digest)
+            zdict = self._load_dict(row['dict_id'])
+        if zdict:
+            decompressor = zlib.decompressobj(zdict=zdict)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(row['data']) + decompressor.flush()
+
+    def _load_dict(self, dict_id: Optional[int]) -> Optional[bytes]:
+        if dict_id is None:
+            return None
+        if dict_id not in self._dicts:
+            row = self._conn.execute('SELECT data FROM dictionaries WHERE id = ?', (dict_id,)).fetchone()
+            self._dicts[dict_id] = row['data']
+        return self._dicts[dict_id]
+
+    def page(self, page_id: int) -> Dict[str, Any]:
+        """Bản ghi fetch kèm body đã giải nén"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+        if row is None:
+            raise KeyError(page_id)
+        page = dict(row)
+        page['headers'] = json.loads(page['headers'] or '{}')
+        page['body'] = self.body(page['digest'])
+        return page
+
+    def latest_pages(self, site: Optional[str] = None, page_size: int = 1000) -> Iterator[Tuple[int, str]]:
+        """(page_id, url) của lần fetch mới nhất mỗi URL, đọc theo trang (range scan trên index của latest)"""
+        last_id = 0
+        while True:
+            with self._lock:
+                if site is None:
+                    rows = self._conn.execute('SELECT page_id, url FROM latest WHERE page_id > ? '
+                                              'ORDER BY page_id LIMIT ?', (last_id, page_size)).fetchall()
+                else:
+                    rows = self._conn.execute('SELECT page_id, url FROM latest WHERE site = ? AND page_id > ? '
+                                              'ORDER BY page_id LIMIT ?', (site, last_id, page_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row['page_id'], row['url']
+            last_id = rows[-1]['page_id']
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pages = self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            urls = self._conn.execute('SELECT COUNT(*) FROM latest').fetchone()[0]
+            blobs, raw, stored = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()
+            sites = self._conn.execute('SELECT site, COUNT(*) AS n FROM pages GROUP BY site ORDER BY n DESC').fetchall()
+        return {'pages': pages, 'urls': urls, 'blobs': blobs, 'raw_bytes': raw, 'stored_bytes': stored,
+                'ratio': round(raw / stored, 2) if stored else 0.0,
+                'dictionaries': len(self._dicts), 'sites': {r['site']: r['n'] for r in sites}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem thống kê archive trang thô')
+    parser.add_argument('--db', default='page_archive.db', help='File SQLite (default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(PageArchive(args.db).stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Price History Store
+Lịch sử giá/tồn kho theo từng SKU variant trong SQLite, chỉ ghi thay đổi:
+- latest: giá trị gần nhất của mỗi SKU (theo observed_at, quan sát ghi muộn không đè giá trị mới hơn)
+  -> mỗi lần chạy chỉ so với bảng này, không đọc lại lịch sử
+- history: append-only, 1 dòng khi giá / giá gốc / còn hàng thay đổi (hoặc SKU mới xuất hiện)
+- history là bảng WITHOUT ROWID khóa (sku, observed_at): dữ liệu 1 SKU nằm liền nhau theo thời gian
+  -> truy vấn lịch sử nhiều tháng của 1 sản phẩm chỉ là 1 range scan (mili giây)
+- runs: mỗi lần ghi (thời điểm, số SKU quan sát, số thay đổi)
+
+Dùng bởi product_scraper.py (--history). Xem lịch sử:
+    python price_history.py [--db price_history.db] [SKU_HOẶC_SKU_PREFIX] [--since 2026-01-01]
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    started_at  TEXT NOT NULL,
+    observed    INTEGER NOT NULL DEFAULT 0,
+    changed     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS latest (
+    sku              TEXT PRIMARY KEY,
+    sku_prefix       TEXT NOT NULL,
+    price            REAL,
+    compare_at_price REAL,
+    in_stock         INTEGER,
+    observed_at      TEXT NOT NULL,
+    last_seen_at     TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS history (
+    sku              TEXT NOT NULL,
+    observed_at      TEXT NOT NULL,
+    sku_prefix       TEXT NOT NULL,
+    run_id           INTEGER NOT NULL,
+    price            REAL,
+    compare_at_price REAL,
+    in_stock         INTEGER,
+    PRIMARY KEY (sku, observed_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_latest_prefix ON latest (sku_prefix);
+CREATE INDEX IF NOT EXISTS idx_history_prefix ON history (sku_prefix, observed_at);
+CREATE INDEX IF NOT EXISTS idx_history_run ON history (run_id);
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def observations(products: Iterable[Any]) -> Iterable[Tuple[str, str, str, Optional[float], Optional[float], Optional[int]]]:
+    """(sku, sku_prefix, observed_at, price, compare_at_price, in_stock) cho mỗi variant của ProductData"""
+    for p in products:
+        observed_at = p.scraped_at or _now()
+        for v in p.variants:
+            sku = v.get('sku')
+            if not sku:
+                continue
+            if 'in_stock' in v:
+                in_stock = int(bool(v['in_stock']))
+            elif 'stock_quantity' in v:
+                in_stock = int((v.get('stock_quantity') or 0) > 0)
+            else:
+                in_stock = None
+            yield (sku, p.sku_prefix, observed_at, float(v.get('price') or p.base_price or 0) or None,
+                   float(v.get('compare_at_price') or p.compare_at_price or 0) or None, in_stock)
+
+
+class PriceHistory:
+    """SQLite price history (WAL, 1 transaction mỗi lần record)"""
+
+    def __init__(self, path: str = 'price_history.db', chunk_size: int = 500):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Ghi ----------
+
+    def record(self, products: Iterable[Any]) -> Dict[str, int]:
+        """Ghi 1 lần quan sát; chỉ thêm dòng history cho SKU mới hoặc có giá trị thay đổi"""
+        stats = {'run_id': 0, 'observed': 0, 'new': 0, 'changed': 0}
+        rows = list(observations(products))
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                run_id = self._conn.execute('INSERT INTO runs (started_at) VALUES (?)', (_now(),)).lastrowid
+                for start in range(0, len(rows), self.chunk_size):
+                    self._record_chunk(run_id, rows[start:start + self.chunk_size], stats)
+                self._conn.execute('UPDATE runs SET observed = ?, changed = ? WHERE id = ?',
+                                   (stats['observed'], stats['new'] + stats['changed'], run_id))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        stats['run_id'] = run_id
+        return stats
+
+    def _record_chunk(self, run_id: int, rows: List[tuple], stats: Dict[str, int]):
+        placeholders = ','.join('?' * len(rows))
+        previous = {r['sku']: ((r['price'], r['compare_at_price'], r['in_stock']), r['observed_at'])
+                    for r in self._conn.execute(
+            f'SELECT sku, price, compare_at_price, in_stock, observed_at FROM latest WHERE sku IN ({placeholders})',
+            [r[0] for r in rows])}
+        changed, seen = [], []
+        for sku, prefix, observed_at, price, compare_at, in_stock in rows:
+            stats['observed'] += 1
+            old, latest_at = previous.get(sku, (None, ''))
+            if old == (price, compare_at, in_stock):
+                seen.append((observed_at, sku))
+                continue
+            stats['new' if old is None else 'changed'] += 1
+            if observed_at >= latest_at:  # Quan sát cũ hơn latest (ghi muộn) chỉ vào history
+                previous[sku] = ((price, compare_at, in_stock), observed_at)  # SKU lặp lại trong cùng lần chạy
+            changed.append((sku, prefix, price, compare_at, in_stock, observed_at, run_id))
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO history (sku, sku_prefix, price, compare_at_price, in_stock, observed_at, run_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', changed)
+        self._conn.executemany(
+            'INSERT INTO latest (sku, sku_prefix, price, compare_at_price, in_stock, observed_at, last_seen_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (sku) DO UPDATE SET sku_prefix = excluded.sku_prefix, '
+            'price = excluded.price, compare_at_price = excluded.compare_at_price, in_stock = excluded.in_stock, '
+            'observed_at = excluded.observed_at, last_seen_at = MAX(latest.last_seen_at, excluded.last_seen_at) '
+            'WHERE excluded.observed_at >= latest.observed_at', [(*row[:6], row[5]) for row in changed])
+        self._conn.executemany('UPDATE latest SET last_seen_at = MAX(last_seen_at, ?) WHERE sku = ?', seen)
+
+    # ---------- Đọc ----------
+
+    def history(self, sku: str, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Các lần thay đổi của 1 SKU variant, hoặc mọi variant của 1 SKU prefix sản phẩm"""
+        since, until = since or '', until or '\uffff'
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM history WHERE sku = ? AND observed_at >= ? AND observed_at <= ? ORDER BY observed_at',
+                (sku, since, until)).fetchall()
+            if not rows:
+                rows = self._conn.execute(
+                    'SELECT * FROM history WHERE sku_prefix = ? AND observed_at >= ? AND observed_at <= ? '
+                    'ORDER BY observed_at, sku', (sku, since, until)).fetchall()
+        return [dict(r) for r in rows]
+
+    def latest(self, sku: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM latest WHERE sku = ?', (sku,)).fetchone()
+        return dict(row) if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            skus = self._conn.execute('SELECT COUNT(*) FROM latest').fetchone()[0]
+            changes = self._conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+            runs = self._conn.execute('SELECT * FROM runs ORDER BY id DESC LIMIT 10').fetchall()
+        return {'skus': skus, 'history_rows': changes, 'recent_runs': [dict(r) for r in runs]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem lịch sử giá/tồn kho')
+    parser.add_argument('sku', nargs='?', help='SKU variant hoặc SKU prefix sản phẩm')
+    parser.add_argument('--db', default='price_history.db', help='File SQLite (default: %(default)s)')
+    parser.add_argument('--since', help='Từ thời điểm (ISO, vd: 2026-01-01)')
+    parser.add_argument('--until', help='Đến thời điểm (ISO)')
+    args = parser.parse_args()
+    store = PriceHistory(args.db)
+    if args.sku:
+        print(json.dumps(store.history(args.sku, args.since, args.until), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Product Matching
+Ghép cùng 1 sản phẩm bán ở nhiều nhà bán lẻ (DMX/TGDD, Cellphones, FPT Shop...):
+- Đặc trưng: tên chuẩn hóa (bỏ dấu, bỏ từ loại hàng như "điện thoại", "máy lạnh"), bigram, brand,
+  thông số chính (dung lượng GB/TB, HP, BTU, inch, lít, kg) và mã model
+- MinHash + LSH (banding): mỗi sản phẩm chỉ so với các ứng viên chung bucket -> không so từng cặp O(n²)
+- Ứng viên được xác nhận bằng Jaccard thật + luật chặn (khác brand khi cả 2 bên có brand, khác dung lượng lưu trữ,
+  Pro vs Pro Max, ...)
+- Kết quả: nhóm sản phẩm (union-find; chỉ gộp 2 nhóm khi mọi cặp thành viên đều qua luật chặn, tránh
+  listing thiếu dung lượng nối 128GB với 256GB), bảng merge và bảng so sánh giá theo nhà bán lẻ
+
+Dùng bởi product_scraper.py (--match): thêm sheet Matches và PriceComparison vào file Excel.
+"""
+
+import hashlib
+import random
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Sequence, Set, Tuple
+from urllib.parse import urlparse
+
+# Từ chỉ loại hàng / quảng cáo, không giúp phân biệt sản phẩm (đã bỏ dấu)
+STOPWORDS = frozenset({
+    'dien', 'thoai', 'may', 'lanh', 'dieu', 'hoa', 'tivi', 'tu', 'giat', 'loc', 'nuoc', 'khong', 'khi',
+    'chinh', 'hang', 'moi', 'new', 'gia', 're', 'quoc', 'te', 'vn', 'vna', 'vn/a', 'fullbox', 'nguyen', 'seal',
+    'ban', 'phien', 'cu', 'the', 'he', 'va', 'cho', 'voi', 'smartphone', 'laptop', 'man', 'hinh', 'chieu',
+})
+# Từ phân hạng model: có ở 1 bên mà không có ở bên kia -> khác sản phẩm (iPhone 15 Pro vs Pro Max)
+QUALIFIERS = frozenset({'pro', 'max', 'plus', 'ultra', 'mini', 'lite', 'fe', 'se', 'air', 'neo', 'edge', 'fold', 'flip'})
+# Thông số: (regex trên tên đã chuẩn hóa, đơn vị)
+SPEC_PATTERNS = (
+    (re.compile(r'\b(\d+(?:\.\d+)?)\s*(gb|tb)\b'), None),
+    (re.compile(r'\b(\d+(?:\.\d+)?)\s*(hp)\b'), None),
+    (re.compile(r'\b(\d+)\s*(btu)\b'), None),
+    (re.compile(r'\b(\d+(?:\.\d+)?)\s*(inch|")'), 'inch'),
+    (re.compile(r'\b(\d+(?:\.\d+)?)\s*(lit|l)\b'), 'lit'),
+    (re.compile(r'\b(\d+(?:\.\d+)?)\s*(kg)\b'), None),
+)
+# Tên dòng sản phẩm / tên brand viết khác -> brand chuẩn (đã bỏ dấu, chữ thường)
+BRAND_ALIASES = {
+    'iphone': 'apple', 'ipad': 'apple', 'macbook': 'apple', 'imac': 'apple', 'airpods': 'apple',
+    'galaxy': 'samsung', 'redmi': 'xiaomi', 'poco': 'xiaomi', 'mi': 'xiaomi', 'xiaomi mi': 'xiaomi',
+    'hewlett packard': 'hp', 'lg electronics': 'lg', 'panasonic vietnam': 'panasonic',
+}
+STORAGE_UNITS = {'gb': 1, 'tb': 1024}
+# Thuộc tính dùng làm đặc trưng (tên thuộc tính đã bỏ dấu, chữ thường)
+KEY_ATTRIBUTE_RE = re.compile(r'dung luong|bo nho|\bram\b|\brom\b|cong suat|kich thuoc man|model|ma san pham')
+
+_PRIME = (1 << 61) - 1
+
+
+def strip_accents(text: str) -> str:
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def normalize_text(text: str) -> str:
+    """Chữ thường, bỏ dấu, gộp số + đơn vị ("128 GB" -> "128gb", "1,5 HP" -> "1.5hp")"""
+    text = strip_accents(text).lower()
+    text = re.sub(r'(\d),(\d)', r'\1.\2', text)
+    text = re.sub(r'[^\w."/]+', ' ', text)
+    text = re.sub(r'\b(\d+(?:\.\d+)?)\s+(gb|tb|hp|btu|inch|lit|kg)\b', r'\1\2', text)
+    return ' '.join(text.split())
+
+
+def site_of(url: str) -> str:
+    host = (urlparse(url).hostname or '').lower()
+    return re.sub(r'^(www|m)\.', '', host)
+
+
+@dataclass
+class Features:
+    tokens: FrozenSet[str]                  # Tập đặc trưng để MinHash/Jaccard
+    specs: Dict[str, FrozenSet[str]]        # đơn vị -> giá trị ({'hp': {'1hp'}}), không gồm GB/TB
+    models: FrozenSet[str]                  # Mã model (token có cả chữ và số, vd: ftkb25wavmv, s24)
+    qualifiers: FrozenSet[str]
+    brand: str = ''                         # Chỉ brand khai báo (brand_name), đã quy về tên chuẩn
+    storage: float = 0                      # Dung lượng lưu trữ (GB): giá trị GB/TB lớn nhất, RAM bị bỏ qua
+
+
+def canonical_brand(name: str) -> str:
+    brand = normalize_text(name)
+    return BRAND_ALIASES.get(brand, brand)
+
+
+def extract_features(product: Any) -> Features:
+    """Đặc trưng của 1 ProductData (chỉ đọc name, brand_name, attributes)"""
+    name = normalize_text(getattr(product, 'name', ''))
+    extra = ' '.join(normalize_text(str(attr.get('value', '')))
+                     for attr in getattr(product, 'attributes', None) or []
+                     if KEY_ATTRIBUTE_RE.search(strip_accents(str(attr.get('attribute_name', ''))).lower()))
+    specs: Dict[str, Set[str]] = defaultdict(set)
+    for text in (name, extra):
+        for pattern, unit in SPEC_PATTERNS:
+            for value, found_unit in pattern.findall(text):
+                unit_name = unit or found_unit
+                specs[unit_name].add(f"{float(value):g}{unit_name}")
+    words = [w for w in name.split() if w not in STOPWORDS]
+    spec_values = {v for values in specs.values() for v in values}
+    # RAM và bộ nhớ trong cùng đơn vị GB, nhiều trang chỉ ghi 1 trong 2 -> chỉ giữ dung lượng lớn nhất
+    storage = max((float(v[:-2]) * STORAGE_UNITS[unit] for unit in STORAGE_UNITS for v in specs.pop(unit, ())),
+                  default=0)
+    models = frozenset(w for w in words if re.search(r'\d', w) and re.search(r'[a-z]', w) and w not in spec_values)
+    plain = [w for w in words if w not in spec_values]
+    tokens = set(plain)
+    tokens.update(f"{a}_{b}" for a, b in zip(plain, plain[1:]))
+    tokens.update(f"spec:{v}" for values in specs.values() for v in values)
+    if storage:
+        tokens.add(f"spec:{storage:g}gb")
+    tokens.update(f"model:{m}" for m in models)  # Mã model là đặc trưng phân biệt nhất -> tính 2 lần
+    # Brand không vào tokens: brand_name chỉ có ở 1 số trang, đoán từ tên (iPhone -> ?) dễ sai -> chỉ dùng làm luật chặn
+    return Features(frozenset(tokens), {k: frozenset(v) for k, v in specs.items()}, models,
+                    frozenset(w for w in words if w in QUALIFIERS),
+                    canonical_brand(getattr(product, 'brand_name', '') or ''), storage)
+
+
+def compatible(a: Features, b: Features) -> bool:
+    """Luật chặn: 2 sản phẩm giống tên nhưng chắc chắn khác nhau (chỉ so thông tin có ở cả 2 bên)"""
+    if a.brand and b.brand and a.brand != b.brand:
+        return False
+    if a.qualifiers != b.qualifiers:
+        return False
+    if a.models and b.models and not a.models & b.models:
+        return False
+    if a.storage and b.storage and a.storage != b.storage:
+        return False
+    return all(a.specs[unit] == b.specs[unit] for unit in a.specs.keys() & b.specs.keys())
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHasher:
+    """MinHash với num_perm hàm băm universal (a*x + b) mod p trên hash 64-bit của token"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, tokens: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=8).digest(), 'big') for t in tokens]
+        if not hashes:
+            return tuple(_PRIME for _ in self.params)
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self.params)
+
+
+@dataclass
+class MatchGroup:
+    group_id: str
+    members: List[int]                                      # Vị trí trong list products
+    similarity: Dict[int, float] = field(default_factory=dict)  # Jaccard cao nhất của member với nhóm
+
+
+class ProductMatcher:
+    """Index LSH: bands x rows = num_perm; ngưỡng LSH ~ (1/bands)^(1/rows), xác nhận bằng Jaccard >= threshold"""
+
+    def __init__(self, threshold: float = 0.6, num_perm: int = 64, bands: int = 16, cross_site_only: bool = True):
+        if num_perm % bands:
+            raise ValueError('num_perm phải chia hết cho bands')
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.cross_site_only = cross_site_only
+        self.hasher = MinHasher(num_perm)
+        self.stats = {'products': 0, 'candidates': 0, 'matches': 0, 'conflicts': 0, 'groups': 0}
+
+    def match(self, products: Sequence[Any]) -> List[MatchGroup]:
+        """Nhóm các sản phẩm trùng nhau (chỉ các nhóm có >= 2 sản phẩm)"""
+        features = [extract_features(p) for p in products]
+        sites = [site_of(getattr(p, 'source_url', '')) for p in products]
+        buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = defaultdict(list)
+        parent = list(range(len(products)))
+        group_members: Dict[int, List[int]] = {i: [i] for i in range(len(products))}  # gốc -> thành viên
+        best: Dict[int, float] = {}
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, feat in enumerate(features):
+            if not feat.tokens:
+                continue
+            signature = self.hasher.signature(feat.tokens)
+            candidates: Set[int] = set()
+            for band in range(self.bands):
+                bucket = buckets[(band, signature[band * self.rows:(band + 1) * self.rows])]
+                candidates.update(bucket)
+                bucket.append(i)
+            for j in candidates:
+                if self.cross_site_only and sites[i] == sites[j]:
+                    continue
+                self.stats['candidates'] += 1
+                score = jaccard(feat.tokens, features[j].tokens)
+                if score >= self.threshold and compatible(feat, features[j]):
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        # Ghép là bắc cầu -> kiểm tra luật chặn với mọi thành viên của 2 nhóm
+                        if not all(compatible(features[a], features[b])
+                                   for a in group_members[root_i] for b in group_members[root_j]):
+                            self.stats['conflicts'] += 1
+                            continue
+                        parent[root_i] = root_j
+                        group_members[root_j] += group_members.pop(root_i)
+                    self.stats['matches'] += 1
+                    best[i] = max(best.get(i, 0.0), score)
+                    best[j] = max(best.get(j, 0.0), score)
+
+        members: Dict[int, List[int]] = defaultdict(list)
+        for i in best:
+            members[find(i)].append(i)
+        groups = [MatchGroup(f"M{n:05d}", sorted(ids), {i: round(best[i], 3) for i in ids})
+                  for n, ids in enumerate(sorted(members.values(), key=min), 1)]
+        self.stats['products'] = len(products)
+        self.stats['groups'] = len(groups)
+        return groups
+
+
+def merge_table(products: Sequence[Any], groups: List[MatchGroup]) -> List[Dict[str, Any]]:
+    """Mỗi dòng: 1 sản phẩm thuộc nhóm trùng, kèm SKU chung của nhóm (SKU của sản phẩm đầu tiên)"""
+    rows = []
+    for group in groups:
+        primary = products[group.members[0]]
+        for i in group.members:
+            p = products[i]
+            rows.append({'group_id': group.group_id, 'merged_sku_prefix': primary.sku_prefix,
+                         'sku_prefix': p.sku_prefix, 'retailer': site_of(p.source_url), 'name': p.name,
+                         'brand_name': p.brand_name, 'base_price': p.base_price,
+                         'similarity': group.similarity.get(i), 'source_url': p.source_url})
+    return rows
+
+
+def price_comparison(products: Sequence[Any], groups: List[MatchGroup]) -> List[Dict[str, Any]]:
+    """Mỗi dòng: giá thấp nhất của 1 nhà bán lẻ trong nhóm, so với giá rẻ nhất của nhóm"""
+    rows = []
+    for group in groups:
+        by_site: Dict[str, Any] = {}
+        for i in group.members:
+            p = products[i]
+            site = site_of(p.source_url)
+            if p.base_price and (site not in by_site or p.base_price < by_site[site].base_price):
+                by_site[site] = p
+        if not by_site:
+            continue
+        cheapest = min(p.base_price for p in by_site.values())
+        highest = max(p.base_price for p in by_site.values())
+        name = products[group.members[0]].name
+        for site, p in sorted(by_site.items(), key=lambda item: item[1].base_price):
+            rows.append({'group_id': group.group_id, 'name': name, 'retailer': site, 'price': p.base_price,
+                         'compare_at_price': p.compare_at_price or None,
+                         'diff_vs_cheapest': p.base_price - cheapest,
+                         'diff_pct': round((p.base_price - cheapest) / cheapest * 100, 1),
+                         'is_cheapest': p.base_price == cheapest, 'group_spread': highest - cheapest,
+                         'source_url': p.source_url})
+    return rows
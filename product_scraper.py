@@ -12,42 +12,57 @@ Hỗ trợ:
 
 Usage:
     python product_scraper.py <url> [--output <file.xlsx>]
+    python product_scraper.py -f urls.txt.gz -f - < more_urls.txt   # file lớn/.gz/stdin, đọc dần
+    python product_scraper.py --discover https://www.dienmayxanh.com/may-lanh   # tìm URL từ danh mục/sitemap
+    python product_scraper.py --reextract -o fixed.xlsx   # extract lại từ page_archive.db, không cần mạng
     python product_scraper.py --help
+
+Library (stream, bộ nhớ không đổi với danh sách URL vô hạn):
+    from product_scraper import iter_scrape
+    for product in iter_scrape(url_iterable, max_in_flight=8):
+        ...
 """
 
 import argparse
+import importlib.util
 import json
+import math
 import os
+import random
 import re
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 from urllib.parse import urlparse
 
-try:
-    import requests
-    from bs4 import BeautifulSoup
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill
-except ImportError as e:
-    print(f"Error: Missing required package. Please install dependencies:")
-    print("pip install requests beautifulsoup4 openpyxl lxml")
-    sys.exit(1)
-
-# Optional Selenium support for JS-rendered pages
-SELENIUM_AVAILABLE = False
-try:
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    SELENIUM_AVAILABLE = True
-except ImportError:
-    pass
+# Các dependency nặng (requests, bs4, openpyxl, selenium) được import lazy trong hàm dùng tới
+# để `--help` / các lệnh không cần tới chúng khởi động nhanh.
+REQUIRED_PACKAGES = ('requests', 'bs4', 'openpyxl', 'lxml')
+
+# Optional Selenium support for JS-rendered pages (find_spec không import package)
+SELENIUM_AVAILABLE = importlib.util.find_spec('selenium') is not None
+
+
+def positive_float(value: str) -> float:
+    """argparse type: số thực > 0"""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"phải > 0 (nhận {value})")
+    return number
+
+
+def check_dependencies():
+    """Kiểm tra package bắt buộc đã cài chưa (không import)"""
+    missing = [name for name in REQUIRED_PACKAGES if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"Error: Missing required package ({', '.join(missing)}). Please install dependencies:")
+        print("pip install requests beautifulsoup4 openpyxl lxml")
+        sys.exit(1)
 
 
 @dataclass
@@ -82,12 +97,594 @@ class ProductData:
     scraped_at: str = ""
 
 
+# ============================================================
+# Fetch layer: retry policy + circuit breaker theo host
+# ============================================================
+
+# Status code đáng retry (lỗi tạm thời phía server / rate limit)
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Trang sản phẩm không còn -> --changes-only tính sản phẩm là bị xóa
+GONE_STATUS = {404, 410}
+
+
+class CircuitOpenError(RuntimeError):
+    """Host đang bị ngắt mạch (circuit open) - không gửi request"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse header Retry-After (số giây hoặc HTTP-date) -> số giây chờ"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass
+class RetryPolicy:
+    """Phân loại lỗi + exponential backoff có jitter, tôn trọng Retry-After"""
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    max_retry_after: float = 120.0
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Lỗi tạm thời (5xx, 429, timeout, mất kết nối) mới retry; 404/403... thì bỏ"""
+        import requests
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response.status_code in RETRYABLE_STATUS
+        return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                                  requests.exceptions.ChunkedEncodingError))
+
+    def retry_after(self, error: Exception) -> Optional[float]:
+        """Lấy Retry-After từ response lỗi (nếu có)"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        return parse_retry_after(response.headers.get('Retry-After'))
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff; Retry-After là mức chờ tối thiểu"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+class CircuitBreaker:
+    """Circuit breaker cho 1 host: closed -> open (sau N lỗi liên tiếp) -> half_open (thử 1 request)"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Cho phép gửi request hay không"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state == 'open':
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                self._probe_started = now
+                return True
+            # half_open: chỉ 1 probe tại 1 thời điểm (probe treo quá lâu thì cho probe mới)
+            if now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakerRegistry:
+    """Quản lý circuit breaker theo host (dùng chung giữa các scraper/worker)"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Trạng thái breaker theo host"""
+        with self._lock:
+            return {host: {'state': b.state, 'failures': b.failures}
+                    for host, b in self._breakers.items()}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile trên list đã sort"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+@dataclass
+class TimeoutSettings:
+    """Floor/ceiling cho connect và read timeout (giây)"""
+    connect_floor: float = 2.0
+    connect_ceiling: float = 10.0
+    read_floor: float = 3.0
+    read_ceiling: float = 30.0
+    multiplier: float = 3.0    # timeout = percentile * multiplier
+    min_samples: int = 5       # Chưa đủ mẫu thì dùng ceiling
+
+
+class LatencyTracker:
+    """Theo dõi latency theo host (rolling window) và tính timeout thích ứng"""
+
+    def __init__(self, settings: Optional[TimeoutSettings] = None, window: int = 200):
+        self.settings = settings or TimeoutSettings()
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, host: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None:
+                samples = self._samples[host] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentiles(self, host: str) -> Dict[str, float]:
+        """p50/p95/p99 của host (giây)"""
+        with self._lock:
+            values = sorted(self._samples.get(host, ()))
+        return {
+            'count': len(values),
+            'p50': _percentile(values, 50),
+            'p95': _percentile(values, 95),
+            'p99': _percentile(values, 99),
+        }
+
+    def timeout_for(self, host: str) -> Tuple[float, float]:
+        """(connect_timeout, read_timeout) cho requests"""
+        cfg = self.settings
+        stats = self.percentiles(host)
+        if stats['count'] < cfg.min_samples:
+            return cfg.connect_ceiling, cfg.read_ceiling
+        connect = min(cfg.connect_ceiling, max(cfg.connect_floor, stats['p50'] * cfg.multiplier))
+        read = min(cfg.read_ceiling, max(cfg.read_floor, stats['p99'] * cfg.multiplier))
+        return connect, read
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Stats + timeout hiện tại theo host"""
+        with self._lock:
+            hosts = list(self._samples)
+        result = {}
+        for host in hosts:
+            stats = self.percentiles(host)
+            stats['connect_timeout'], stats['read_timeout'] = self.timeout_for(host)
+            result[host] = stats
+        return result
+
+
+class TokenBucket:
+    """Token bucket: `rate` request/giây, burst tối đa `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError(f"rate phải > 0 (nhận {rate})")
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self) -> float:
+        """Số giây tới khi có token (không tiêu token)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """Đặt trước 1 token, trả về số giây cần chờ (chờ ngoài lock)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+class HostRateScheduler:
+    """Rate limit lịch sự theo host: token bucket + Crawl-delay từ robots.txt (cache theo host)"""
+
+    def __init__(self, rate: float = 2.0, burst: float = 2.0, respect_robots: bool = True,
+                 user_agent: str = '*'):
+        self.rate = rate
+        self.burst = burst
+        self.respect_robots = respect_robots
+        self.user_agent = user_agent
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._robots: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def robots(self, url: str) -> Optional['RobotFileParser']:
+        """robots.txt đã parse của host (None nếu không có / lỗi)"""
+        from urllib.robotparser import RobotFileParser
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        with self._lock:
+            if host in self._robots:
+                return self._robots[host]
+        import requests
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        parser = None
+        try:
+            response = requests.get(f"{parsed.scheme}://{parsed.netloc}/robots.txt", timeout=10, verify=False)
+            if response.status_code == 200:
+                parser = RobotFileParser()
+                parser.parse(response.text.splitlines())
+        except requests.RequestException:
+            pass
+        with self._lock:
+            return self._robots.setdefault(host, parser)
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        """Crawl-delay (giây) cho user agent, ưu tiên Crawl-delay rồi tới Request-rate"""
+        if not self.respect_robots:
+            return None
+        parser = self.robots(url)
+        if parser is None:
+            return None
+        delay = parser.crawl_delay(self.user_agent)
+        if delay:
+            return float(delay)
+        request_rate = parser.request_rate(self.user_agent)
+        if request_rate and request_rate.requests:
+            return request_rate.seconds / request_rate.requests
+        return None
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+        if bucket is not None:
+            return bucket
+        rate, burst = self.rate, self.burst
+        delay = self.crawl_delay(url)
+        if delay:
+            rate, burst = min(rate, 1.0 / delay), 1.0
+        with self._lock:
+            return self._buckets.setdefault(host, TokenBucket(rate, burst))
+
+    def acquire(self, url: str):
+        """Block tới khi host của url còn token"""
+        wait = self.bucket(url).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def interleave(self, urls: Iterable[str], window: int = 1000) -> Iterator[str]:
+        """Sắp xếp URL xen kẽ giữa các host: luôn chọn host sẵn sàng sớm nhất, hòa thì round-robin.
+
+        Chỉ đọc trước tối đa `window` URL -> input có thể là stream rất dài mà bộ nhớ không đổi.
+        """
+        url_iter = iter(urls)
+        queues: Dict[str, deque] = {}
+        order: deque = deque()  # Các host đang có URL chờ
+        buffered = 0
+        exhausted = False
+        while True:
+            while not exhausted and buffered < window:
+                url = next(url_iter, None)
+                if url is None:
+                    exhausted = True
+                    break
+                host = urlparse(url).netloc.lower()
+                if host not in queues:
+                    queues[host] = deque()
+                    order.append(host)
+                queues[host].append(url)
+                buffered += 1
+            if not order:
+                return
+            best = min(order, key=lambda h: self.bucket(queues[h][0]).ready_in())
+            yield queues[best].popleft()
+            buffered -= 1
+            order.remove(best)
+            if queues[best]:
+                order.append(best)
+            else:
+                del queues[best]
+
+    def snapshot(self) -> Dict[str, float]:
+        """Rate (request/giây) đang áp dụng theo host"""
+        with self._lock:
+            return {host: b.rate for host, b in self._buckets.items()}
+
+
+@dataclass
+class HostConcurrency:
+    """Trạng thái AIMD của 1 host"""
+    limit: float
+    in_flight: int = 0
+    latency_ewma: float = 0.0
+    last_decrease: float = 0.0
+    outcomes: deque = field(default_factory=lambda: deque(maxlen=20))  # True = lỗi/quá tải
+
+
+class AIMDController:
+    """Tự điều chỉnh số request đồng thời theo host: tăng cộng khi khỏe, giảm nhân khi 429/5xx/latency tăng vọt"""
+
+    def __init__(self, initial: float = 2.0, minimum: float = 1.0, maximum: float = 8.0,
+                 decrease_factor: float = 0.5, spike_factor: float = 3.0, error_threshold: float = 0.1):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.spike_factor = spike_factor
+        self.error_threshold = error_threshold
+        self._hosts: Dict[str, HostConcurrency] = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host: str) -> HostConcurrency:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostConcurrency(limit=min(self.maximum, max(self.minimum, self.initial)))
+        return state
+
+    def acquire(self, host: str):
+        """Block tới khi host còn slot"""
+        with self._cond:
+            state = self._state(host)
+            while state.in_flight >= int(state.limit):
+                self._cond.wait()
+            state.in_flight += 1
+
+    def release(self, host: str, latency: Optional[float], overloaded: bool = False):
+        """Trả slot + cập nhật limit theo kết quả request"""
+        with self._cond:
+            state = self._state(host)
+            state.in_flight -= 1
+            spike = (latency is not None and state.latency_ewma > 0
+                     and latency > self.spike_factor * state.latency_ewma)
+            if latency is not None and not overloaded:
+                state.latency_ewma = latency if not state.latency_ewma else 0.8 * state.latency_ewma + 0.2 * latency
+            state.outcomes.append(overloaded or spike)
+
+            now = time.monotonic()
+            if overloaded or spike:
+                # Giảm tối đa 1 lần mỗi "RTT" để 1 đợt lỗi không cắt limit về min ngay
+                if now - state.last_decrease >= max(1.0, state.latency_ewma):
+                    state.limit = max(self.minimum, state.limit * self.decrease_factor)
+                    state.last_decrease = now
+            else:
+                error_rate = sum(state.outcomes) / len(state.outcomes)
+                # Chỉ tăng khi đang dùng hết limit (tránh limit phình ra khi thiếu tải)
+                if error_rate <= self.error_threshold and state.in_flight + 1 >= int(state.limit):
+                    state.limit = min(self.maximum, state.limit + 1.0 / state.limit)
+            self._cond.notify_all()
+
+    def level(self, host: str) -> int:
+        """Số request đồng thời hiện được phép cho host"""
+        with self._cond:
+            return int(self._state(host).limit)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            return {host: {'limit': int(st.limit), 'in_flight': st.in_flight}
+                    for host, st in self._hosts.items()}
+
+
+# ============================================================
+# URL canonicalization: gộp URL trùng trước khi fetch
+# ============================================================
+
+# Query param chỉ dùng để tracking - bỏ khi chuẩn hóa
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'gclsrc', 'dclid', 'msclkid', 'yclid', 'igshid', 'srsltid', 'ttclid',
+    '_ga', '_gl', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'src', 'zarsrc', 'zalo_source',
+}
+TRACKING_PREFIXES = ('utm_', 'itm_', 'pk_', 'mtm_')
+
+# Nhóm site mirror (cùng catalog): TGDD và DMX thuộc MWG, cùng path = cùng sản phẩm
+MIRROR_GROUPS = {
+    'thegioididong.com': 'mwg',
+    'dienmayxanh.com': 'mwg',
+}
+
+_CANONICAL_LINK_RE = re.compile(rb'<link\b[^>]*\brel\s*=\s*["\']?canonical\b[^>]*>', re.I)
+_HREF_RE = re.compile(rb'\bhref\s*=\s*["\']?([^"\'\s>]+)', re.I)
+
+
+class DuplicateUrlError(RuntimeError):
+    """URL trỏ tới sản phẩm đã/đang được cào qua URL khác - bỏ qua"""
+
+    def __init__(self, url: str, canonical: str):
+        super().__init__(f"{url} trùng với {canonical}")
+        self.url = url
+        self.canonical = canonical
+
+
+class UrlCanonicalizer:
+    """Chuẩn hóa URL + khử trùng lặp.
+
+    - canonicalize(): bỏ tracking param/fragment, host chữ thường, bỏ port mặc định, path bỏ '//' và '/' cuối,
+      sắp xếp query -> URL dùng để fetch
+    - key(): khóa định danh sản phẩm (bỏ scheme, gộp host mirror, áp dụng mapping rel=canonical đã học)
+    - static_key(): như key() nhưng không dùng alias đã học (định danh SKU, khóa khử trùng của job store)
+    - unique(): lọc stream URL đầu vào (job dùng Frontier key=static_key thay thế); learn(): học
+      <link rel=canonical> từ trang vừa fetch
+    - finished(): chỉ khi extract ra sản phẩm, key mới được tính là đã cào
+    """
+
+    def __init__(self, mirror_groups: Optional[Dict[str, str]] = None, fetched: Optional[Any] = None):
+        self.mirror_groups = MIRROR_GROUPS if mirror_groups is None else mirror_groups
+        self._aliases: Dict[str, str] = {}   # key URL -> key canonical (học từ trang đã fetch)
+        self._claimed: Set[str] = set()      # key đã nhận từ input (unique())
+        # Key canonical đã có sản phẩm: set, hoặc job_store.KeySet (chính xác, trong SQLite, còn khi --resume)
+        self._fetched = set() if fetched is None else fetched
+        self._in_flight: Set[str] = set()    # key đã fetch, đang extract (tối đa = số URL đang xử lý)
+        self._lock = threading.Lock()
+        self.duplicates = {'input': 0, 'canonical': 0}
+
+    def canonicalize(self, url: str) -> str:
+        from urllib.parse import parse_qsl, urlencode, urlunparse
+        parsed = urlparse(url.strip())
+        scheme = (parsed.scheme or 'https').lower()
+        host = (parsed.hostname or '').rstrip('.')
+        netloc = host
+        if parsed.port and (scheme, parsed.port) not in (('http', 80), ('https', 443)):
+            netloc = f"{host}:{parsed.port}"
+        path = re.sub(r'/{2,}', '/', parsed.path or '/')
+        if len(path) > 1:
+            path = path.rstrip('/')
+        query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                       if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES))
+        return urlunparse((scheme, netloc, path, '', urlencode(query), ''))
+
+    def site(self, host: str) -> str:
+        """Nhóm site của host (mirror -> tên nhóm, còn lại bỏ www./m.)"""
+        host = host.lower()
+        labels = host.split('.')
+        for i in range(len(labels)):
+            group = self.mirror_groups.get('.'.join(labels[i:]))
+            if group:
+                return group
+        return re.sub(r'^(www|m)\.', '', host)
+
+    def static_key(self, url: str) -> str:
+        """Khóa chỉ từ URL (không áp dụng alias đã học) -> giống nhau ở mọi process/lần chạy"""
+        parsed = urlparse(self.canonicalize(url))
+        host = self.site(parsed.hostname or '')
+        if parsed.port:
+            host = f"{host}:{parsed.port}"
+        return f"{host}{parsed.path}" + (f"?{parsed.query}" if parsed.query else '')
+
+    def key(self, url: str) -> str:
+        raw = self.static_key(url)
+        with self._lock:
+            return self._aliases.get(raw, raw)
+
+    def unique(self, urls: Iterable[str]) -> Iterator[str]:
+        """Chuẩn hóa stream URL, bỏ URL trùng sản phẩm với URL trước đó"""
+        for url in urls:
+            canonical = self.canonicalize(url)
+            key = self.key(canonical)
+            with self._lock:
+                if key in self._claimed or key in self._fetched:
+                    self.duplicates['input'] += 1
+                    continue
+                self._claimed.add(key)
+            yield canonical
+
+    def duplicate_of(self, url: str) -> Optional[str]:
+        """Trước khi fetch: sản phẩm của URL đã được cào qua URL khác? -> key canonical"""
+        key = self.key(url)
+        with self._lock:
+            if key in self._fetched:
+                self.duplicates['canonical'] += 1
+                return key
+        return None
+
+    def learn(self, url: str, body: bytes, encoding: Optional[str] = None) -> Optional[str]:
+        """Sau khi fetch: học <link rel=canonical>; trả về key canonical nếu sản phẩm đã có từ URL khác"""
+        raw = self.static_key(url)
+        key = raw
+        canonical = self.find_canonical(url, body, encoding)
+        # Chỉ tin canonical cùng site/mirror (tránh trang trỏ canonical sang domain lạ)
+        if canonical and self.site(urlparse(canonical).hostname or '') == self.site(urlparse(url).hostname or ''):
+            key = self.static_key(canonical)
+        with self._lock:
+            key = self._aliases.get(key, key)
+            if key != raw:
+                self._aliases[raw] = key
+            if key in self._fetched or key in self._in_flight:
+                self.duplicates['canonical'] += 1
+                return key
+            self._in_flight.add(key)
+        return None
+
+    def finished(self, url: str, ok: bool):
+        """Sau extract (URL đã qua learn()): thành công -> key đã có sản phẩm; lỗi -> URL khác được cào lại"""
+        key = self.key(url)
+        with self._lock:
+            self._in_flight.discard(key)
+            if ok:
+                self._fetched.add(key)
+
+    @staticmethod
+    def find_canonical(url: str, body: bytes, encoding: Optional[str] = None) -> Optional[str]:
+        """Lấy href của <link rel=canonical> trong <head> (regex trên bytes, không cần parse cả trang)"""
+        import html
+        from urllib.parse import urljoin
+        head = body[:body.find(b'</head>')] if b'</head>' in body[:262144] else body[:262144]
+        for tag in _CANONICAL_LINK_RE.finditer(head):
+            href = _HREF_RE.search(tag.group(0))
+            if href:
+                value = html.unescape(href.group(1).decode(encoding or 'utf-8', errors='replace'))
+                return urljoin(url, value)
+        return None
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.duplicates, 'aliases': len(self._aliases)}
+
+
 class BaseScraper(ABC):
     """Base class cho các scraper"""
 
+    # Dùng chung cho mọi scraper để trạng thái host được chia sẻ giữa các worker
+    retry_policy = RetryPolicy()
+    circuit_breakers = CircuitBreakerRegistry()
+    latency = LatencyTracker()
+    scheduler = HostRateScheduler()
+    concurrency = AIMDController()
+    canonicalizer = UrlCanonicalizer()
+    # SKU ổn định theo mã sản phẩm của site / URL chuẩn hóa (sku_registry.SkuRegistry); tạo lazy khi cấp
+    # SKU đầu tiên, main() và scrape_service mở registry lưu file (--sku-db)
+    skus = None
+    _skus_lock = threading.Lock()
+    # Backend render dùng chung (vd: CDPRenderer - nhiều tab song song); None = Selenium riêng từng scraper
+    renderer = None
+
     def __init__(self, use_selenium: bool = False):
-        self.use_selenium = use_selenium and SELENIUM_AVAILABLE
+        self.use_selenium = use_selenium and self.browser_available()
         self.driver = None
+        self.driver_lock = threading.Lock()  # WebDriver không thread-safe
+        self.api = None  # ApiAdapter, tạo khi dùng lần đầu
+        import requests
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
@@ -109,6 +706,8 @@ class BaseScraper(ABC):
             print("Selenium not available. Install: pip install selenium")
             return None
         if self.driver is None:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
             options = Options()
             options.add_argument('--headless')
             options.add_argument('--no-sandbox')
@@ -125,50 +724,177 @@ class BaseScraper(ABC):
             self.driver.quit()
             self.driver = None
 
-    @abstractmethod
+    # Các domain (suffix của hostname) scraper hỗ trợ - dùng để build index dispatch
+    domains: Tuple[str, ...] = ()
+    # Class ApiAdapter (JSON endpoint của site) - thử trước khi fetch HTML/render browser
+    api_adapter: Optional[type] = None
+
+    def api_client(self) -> Optional['ApiAdapter']:
+        """ApiAdapter của scraper (tạo khi dùng lần đầu), None nếu site không có API"""
+        if self.api_adapter is None:
+            return None
+        if self.api is None:
+            with self.driver_lock:
+                if self.api is None:
+                    self.api = self.api_adapter(self)
+        return self.api
+
+    def api_product(self, url: str) -> Optional[ProductData]:
+        """ProductData từ JSON API của site, None nếu không có adapter/API không trả dữ liệu"""
+        found = self.api_lookup(url)
+        return found[0] if found else None
+
+    def api_lookup(self, url: str) -> Optional[Tuple[ProductData, Dict[str, Any]]]:
+        """(ProductData, JSON gốc) từ API - JSON gốc dùng để lưu archive"""
+        api = self.api_client()
+        return api.lookup(url) if api is not None else None
+
     def can_handle(self, url: str) -> bool:
         """Kiểm tra scraper có hỗ trợ URL này không"""
-        pass
+        host = urlparse(url).hostname or ''
+        return any(host == d or host.endswith('.' + d) for d in self.domains)
 
-    @abstractmethod
     def scrape(self, url: str) -> ProductData:
-        """Cào dữ liệu sản phẩm từ URL"""
+        """Cào dữ liệu sản phẩm từ URL (fetch -> parse -> extract)"""
+        return self.extract(url, self.fetch_page(url))
+
+    @abstractmethod
+    def extract(self, url: str, soup: 'BeautifulSoup') -> ProductData:
+        """Trích xuất ProductData từ HTML đã parse (không I/O)"""
         pass
 
-    def fetch_page(self, url: str, retries: int = 3) -> BeautifulSoup:
+    def expand_variants(self, product: ProductData) -> ProductData:
+        """Bổ sung dữ liệu variant từ trang riêng của từng variant (mặc định: không làm gì)"""
+        return product
+
+    def fetch_page(self, url: str, retries: Optional[int] = None) -> 'BeautifulSoup':
         """Fetch và parse HTML page với retry"""
-        # Use Selenium if enabled (for JS-rendered pages)
+        return self.parse_html(self.fetch_html(url, retries=retries))
+
+    def fetch_html(self, url: str, retries: Optional[int] = None) -> str:
+        """Tải HTML thô (requests, hoặc browser nếu bật)"""
+        # Use browser if enabled (for JS-rendered pages)
         if self.use_selenium:
-            return self._fetch_with_selenium(url)
+            return self._render(url)
+        return self.fetch_response(url, retries=retries).text
 
+    def fetch_body(self, url: str, retries: Optional[int] = None) -> Tuple[bytes, Optional[str]]:
+        """Tải body dạng bytes + encoding (chưa decode) - rẻ khi gửi sang process khác"""
+        body, encoding, _ = self.fetch_raw(url, retries=retries)
+        return body, encoding
+
+    def fetch_raw(self, url: str, retries: Optional[int] = None) -> Tuple[bytes, Optional[str], Dict[str, str]]:
+        """Như fetch_body, kèm response headers (để lưu archive)"""
+        if self.use_selenium:
+            return self._render(url).encode('utf-8'), 'utf-8', {'Content-Type': 'text/html; charset=utf-8'}
+        response = self.fetch_response(url, retries=retries)
+        return response.content, response.encoding, dict(response.headers)
+
+    def parse_html(self, html: Union[str, bytes], encoding: Optional[str] = None) -> 'BeautifulSoup':
+        """Parse HTML bằng lxml (nhận str hoặc bytes + encoding)"""
+        from bs4 import BeautifulSoup
+        if isinstance(html, bytes):
+            return BeautifulSoup(html, 'lxml', from_encoding=encoding)
+        return BeautifulSoup(html, 'lxml')
+
+    def fetch_response(self, url: str, retries: Optional[int] = None) -> 'requests.Response':
+        """GET url với retry policy + circuit breaker theo host"""
+        import requests
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-        for attempt in range(retries):
+        policy = self.retry_policy
+        attempts = retries or policy.max_attempts
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        breaker = self.circuit_breakers.get(host)
+        # Add referer header based on domain (per-request, không sửa session dùng chung)
+        headers = {'Referer': f"{parsed.scheme}://{parsed.netloc}/"}
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {host}, skipping {url}")
+            # Chờ token bucket trước khi giữ slot AIMD -> slot không bị chiếm trong lúc ngủ chờ rate limit
+            self.scheduler.acquire(url)
+            self.concurrency.acquire(host)
+            timeout = self.latency.timeout_for(host)
+            started = time.monotonic()
             try:
-                # Add referer header based on domain
-                from urllib.parse import urlparse
-                parsed = urlparse(url)
-                self.session.headers['Referer'] = f"{parsed.scheme}://{parsed.netloc}/"
-
-                response = self.session.get(url, timeout=30, verify=False)
+                response = self.session.get(url, timeout=timeout, verify=False, headers=headers)
+                elapsed = time.monotonic() - started
+                self.latency.record(host, elapsed)
                 response.raise_for_status()
-                return BeautifulSoup(response.text, 'lxml')
             except Exception as e:
-                if attempt < retries - 1:
-                    print(f"Retry {attempt + 1}/{retries} after error: {e}")
-                    import time
-                    time.sleep(2)
+                elapsed = time.monotonic() - started
+                if isinstance(e, requests.Timeout):
+                    # Timeout cũng là 1 mẫu latency -> host chậm thật thì timeout tự nới ra
+                    self.latency.record(host, elapsed)
+                retryable = policy.is_retryable(e)
+                self.concurrency.release(host, elapsed, overloaded=retryable)
+                if retryable:
+                    breaker.record_failure()
+                elif getattr(e, 'response', None) is not None:
+                    breaker.record_success()  # Host vẫn trả lời (vd: 404) -> host khỏe
+                if retryable and attempt < attempts - 1:
+                    delay = policy.backoff(attempt, policy.retry_after(e))
+                    print(f"Retry {attempt + 1}/{attempts} after error: {e} (sleep {delay:.1f}s)")
+                    time.sleep(delay)
                 else:
                     print(f"Error fetching {url}: {e}")
                     raise
-
-    def _fetch_with_selenium(self, url: str) -> BeautifulSoup:
+            else:
+                self.concurrency.release(host, elapsed)
+                breaker.record_success()
+                return response
+
+    @staticmethod
+    def sku_registry() -> 'SkuRegistry':
+        """Registry dùng chung; chưa mở thì tạo registry trong RAM (không import sqlite3 lúc import module)"""
+        if BaseScraper.skus is None:
+            with BaseScraper._skus_lock:
+                if BaseScraper.skus is None:
+                    from sku_registry import SkuRegistry
+                    BaseScraper.skus = SkuRegistry()
+        return BaseScraper.skus
+
+    @classmethod
+    def browser_available(cls) -> bool:
+        return cls.renderer is not None or SELENIUM_AVAILABLE
+
+    def render_html(self, url: str) -> str:
+        """Render trang bằng browser: renderer dùng chung (song song) hoặc Selenium (tuần tự theo scraper)"""
+        if self.renderer is not None:
+            return self._render(url)
+        with self.driver_lock:
+            return self._render_with_selenium(url)
+
+    def _render(self, url: str) -> str:
+        """Render không lấy driver_lock (caller giữ lock nếu dùng Selenium)"""
+        if self.renderer is not None:
+            self.scheduler.acquire(url)
+            return self.renderer.render(url)
+        return self._render_with_selenium(url)
+
+    # Field bắt buộc để coi là trích xuất đủ từ HTML tĩnh (hybrid: thiếu thì render bằng browser)
+    required_fields: Tuple[str, ...] = ('name', 'base_price')
+
+    def missing_fields(self, product: ProductData) -> List[str]:
+        return [name for name in self.required_fields if not getattr(product, name)]
+
+    def _fetch_with_selenium(self, url: str) -> 'BeautifulSoup':
         """Fetch page using Selenium for JS-rendered content"""
+        return self.parse_html(self._render_with_selenium(url))
+
+    def _render_with_selenium(self, url: str) -> str:
+        """Render page bằng Selenium, trả về HTML sau khi chạy JS"""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
         driver = self._init_selenium()
         if not driver:
             raise RuntimeError("Selenium driver not available")
 
+        self.scheduler.acquire(url)
         try:
             print(f"  Using Selenium to fetch {url}...")
             driver.get(url)
@@ -181,8 +907,7 @@ class BaseScraper(ABC):
                 )
             except Exception:
                 pass  # Continue even if not found
-            html = driver.page_source
-            return BeautifulSoup(html, 'lxml')
+            return driver.page_source
         except Exception as e:
             print(f"Selenium error: {e}")
             raise
@@ -203,15 +928,76 @@ class BaseScraper(ABC):
             return float(''.join(numbers))
         return 0
 
-    def generate_sku(self, name: str) -> str:
-        """Generate SKU prefix từ tên sản phẩm - unique với microseconds"""
-        import random
-        # Lấy chữ cái đầu của mỗi từ + timestamp + random
-        words = name.split()[:4]
-        prefix = ''.join(w[0].upper() for w in words if w and w[0].isalpha())[:4]
-        timestamp = datetime.now().strftime('%y%m%d%H%M%S')
-        random_suffix = random.randint(100, 999)
-        return f"{prefix}-{timestamp}-{random_suffix}"
+    def generate_sku(self, name: str, url: str = '', product_id: str = '') -> str:
+        """SKU prefix: chữ cái đầu tên + hash định danh sản phẩm - cào lại ra cùng SKU, không trùng trong registry.
+
+        Định danh = site#<mã sản phẩm của site> (không có mã thì URL chuẩn hóa tĩnh), giống nhau ở mọi đường lấy
+        dữ liệu (API, HTML, --hybrid, --reextract) và không phụ thuộc alias rel=canonical học trong process.
+        """
+        product_id = re.sub(r'\s+', '', str(product_id or '')).upper()
+        if url and product_id:
+            identity = f"{self.canonicalizer.site(urlparse(url).hostname or '')}#{product_id}"
+        else:
+            identity = self.canonicalizer.static_key(url) if url else f"name:{name}"
+        return self.sku_registry().allocate(identity, name)
+
+    def site_product_id(self, soup: 'BeautifulSoup') -> str:
+        """Mã sản phẩm của site, chỉ lấy từ node sản phẩm chính (không lấy của block sản phẩm liên quan):
+        __NEXT_DATA__ (cùng JSON với NextDataApi), rồi JSON-LD / microdata Product cấp ngoài cùng (nhiều node ->
+        node trùng h1). '' nếu không có.
+        """
+        script = soup.select_one('script#__NEXT_DATA__')
+        if script:
+            try:
+                found = find_product_json((json.loads(script.string or '').get('props') or {}).get('pageProps') or {})
+            except (ValueError, AttributeError):
+                found = None
+            if found and json_product_id(found):
+                return json_product_id(found)
+        # Nhiều node Product (block sản phẩm liên quan) -> chỉ nhận node trùng tiêu đề h1 của trang
+        title = soup.find('h1')
+        title = self.clean_text(title.get_text()) if title else ''
+        products = []
+        for script in soup.select('script[type="application/ld+json"]'):
+            try:
+                data = json.loads(script.string or '')
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                data = data.get('@graph') or [data]
+            products += [item for item in (data if isinstance(data, list) else [])
+                         if isinstance(item, dict) and 'Product' in str(item.get('@type'))]
+        if len(products) > 1:
+            products = [item for item in products if self.clean_text(str(item.get('name') or '')) == title]
+        if products:
+            return self.clean_text(str(products[0].get('sku') or products[0].get('productID') or ''))
+        product_type = re.compile(r'schema\.org/Product$')
+        nodes = [node for node in soup.find_all(attrs={'itemtype': product_type})
+                 if not node.find_parent(attrs={'itemtype': product_type})]
+        if len(nodes) > 1:
+            nodes = [node for node in nodes if node.find('h1')]
+        for node in nodes[:1]:
+            for elem in node.select('[itemprop="sku"], [itemprop="productID"]'):
+                if elem.find_parent(attrs={'itemscope': True}) is node:
+                    return self.clean_text(elem.get('content') or elem.text)
+        return ''
+
+    def assign_skus(self, product: ProductData, product_id: str = '') -> ProductData:
+        """Cấp SKU sản phẩm + SKU các variant chưa có (theo option của variant)"""
+        if product.name and not product.sku_prefix:
+            product.sku_prefix = self.generate_sku(product.name, product.source_url, product_id)
+        for variant in product.variants:
+            if not variant.get('sku'):
+                options = [(variant.get(f'option_{i}_type') or '', variant.get(f'option_{i}_value') or '')
+                           for i in (1, 2, 3)]
+                variant['sku'] = self.variant_sku(product.sku_prefix, options, variant.get('name') or '')
+        return product
+
+    def variant_sku(self, product_sku: str, options: Iterable[Tuple[str, str]] = (), name: str = '') -> str:
+        """SKU variant = SKU sản phẩm + hash giá trị option đã chuẩn hóa -> không đổi khi trang đổi thứ tự option"""
+        from sku_registry import VARIANT_HASH_LENGTH, variant_identity
+        return self.sku_registry().allocate(variant_identity(product_sku, options), name,
+                                            prefix=product_sku or 'SP', length=VARIANT_HASH_LENGTH)
 
     def generate_slug(self, name: str) -> str:
         """Generate slug từ tên sản phẩm"""
@@ -301,12 +1087,14 @@ class BaseScraper(ABC):
 class DienmayxanhScraper(BaseScraper):
     """Scraper cho Dienmayxanh.com và Thegioididong.com"""
 
-    def can_handle(self, url: str) -> bool:
-        domain = urlparse(url).netloc.lower()
-        return any(d in domain for d in ['dienmayxanh.com', 'thegioididong.com'])
+    domains = ('dienmayxanh.com', 'thegioididong.com')
+    required_fields = ('name', 'base_price', 'attributes', 'images')
+    # Khu vực mua hàng / trạng thái tồn kho của trang sản phẩm
+    STOCK_SELECTORS = ('.box_main .block-button', '.box-order', '.btn-buy', '.productstatus', '.product-status',
+                       '.stock-status', '.box-price .status', '.box_price .status')
+    OUT_OF_STOCK_TEXTS = ('tạm hết hàng', 'ngừng kinh doanh', 'hết hàng')
 
-    def scrape(self, url: str) -> ProductData:
-        soup = self.fetch_page(url)
+    def extract(self, url: str, soup: 'BeautifulSoup') -> ProductData:
         html_text = str(soup)
         product = ProductData(
             name="",
@@ -319,42 +1107,10 @@ class DienmayxanhScraper(BaseScraper):
         if name_elem:
             product.name = self.clean_text(name_elem.text)
             product.slug = self.generate_slug(product.name)
-            product.sku_prefix = self.generate_sku(product.name)
-
-        # Giá - thử nhiều cách
-        # 1. Từ JSON embedded
-        price_match = re.search(r'"price"\s*:\s*(\d+)', html_text)
-        if price_match:
-            product.base_price = float(price_match.group(1))
+            product.sku_prefix = self.generate_sku(product.name, url, self.site_product_id(soup))
 
-        # 2. Từ data-price attribute (giá lớn nhất hợp lý - thường là giá SP chính)
-        if product.base_price == 0:
-            data_prices = re.findall(r'data-price="(\d+)"', html_text)
-            valid_prices = [float(p) for p in data_prices if float(p) > 1000000]  # > 1 triệu
-            if valid_prices:
-                product.base_price = max(valid_prices)
-
-        # 3. Từ HTML selectors
-        if product.base_price == 0:
-            price_selectors = [
-                '.box-price .box-price-present', '.product-price .present',
-                '.bs_price', '.price', '[class*="price-current"]'
-            ]
-            for selector in price_selectors:
-                price_elem = soup.select_one(selector)
-                if price_elem:
-                    price = self.clean_price(price_elem.text)
-                    if price > 1000000:  # > 1 triệu
-                        product.base_price = price
-                        break
-
-        # Giá gốc (nếu có)
-        old_price_selectors = ['.box-price .box-price-old', '.product-price .old', '.price-old']
-        for selector in old_price_selectors:
-            old_price_elem = soup.select_one(selector)
-            if old_price_elem:
-                product.compare_at_price = self.clean_price(old_price_elem.text)
-                break
+        # Giá + giá gốc
+        product.base_price, product.compare_at_price = self._extract_prices(soup, html_text)
 
         # Brand từ breadcrumb hoặc title
         brand_elem = soup.select_one('.breadcrumb a:nth-child(2), .box04.box-brand a')
@@ -384,37 +1140,8 @@ class DienmayxanhScraper(BaseScraper):
         if desc_elem:
             product.description = self._html_to_markdown(desc_elem)
 
-        # Images - Lấy từ HTML với nhiều phương pháp
-        # Priority 1: Tìm ảnh sản phẩm từ mwg-static/Products (ảnh chính thức)
-        product_img_pattern = re.compile(r'https://cdnv2\.tgdd\.vn/mwg-static/dmx/Products/Images/\d+/\d+/[^"\'>\s]+\.(jpg|png|webp)', re.I)
-        found_urls = product_img_pattern.findall(html_text)
-        # Lấy unique URLs từ regex match
-        all_product_urls = set()
-        for match in re.finditer(product_img_pattern, html_text):
-            url = match.group(0)
-            # Loại bỏ thumb nhỏ, giữ ảnh lớn
-            if 'thumb' not in url.lower() or '550x' in url or '1020x' in url:
-                # Chuẩn hóa URL - bỏ size suffix nhỏ
-                size_match = re.search(r'-(\d+)x(\d+)(?=[-.])', url)
-                if size_match:
-                    w, h = int(size_match.group(1)), int(size_match.group(2))
-                    if w < 300:
-                        continue  # Skip thumbnails
-                all_product_urls.add(url)
-
-        # Thêm vào danh sách ảnh (limit 10)
-        for url in list(all_product_urls)[:10]:
-            if url not in product.images:
-                product.images.append(url)
-
-        # Priority 2: Fallback - tìm trong img tags
-        if not product.images:
-            for img in soup.select('img[src*="cdn"], img[data-src*="cdn"]'):
-                src = img.get('data-src') or img.get('src') or ''
-                if 'Products/Images' in src and src not in product.images:
-                    product.images.append(src)
-                    if len(product.images) >= 10:
-                        break
+        # Images
+        product.images = self._extract_images(soup, html_text)
 
         # Thông số kỹ thuật - lấy theo từng section/group
         # DMX có cấu trúc accordion: mỗi section có title riêng
@@ -579,23 +1306,32 @@ class DienmayxanhScraper(BaseScraper):
         variant_selectors = ['.box-color a', '.list-color a', '.box-choose a', '.choose-attr a']
         for selector in variant_selectors:
             variant_elems = soup.select(selector)
-            for i, var_elem in enumerate(variant_elems):
+            for var_elem in variant_elems:
                 var_name = self.clean_text(var_elem.get('title') or var_elem.text)
                 var_price = self.clean_price(var_elem.get('data-price') or '')
                 if var_name and var_name not in ['', ' ']:
-                    product.variants.append({
-                        'sku': f"{product.sku_prefix}-V{i+1}",
+                    sku = self.variant_sku(product.sku_prefix, [('Phiên bản', var_name)], f"{product.name} - {var_name}")
+                    if any(v['sku'] == sku for v in product.variants):
+                        continue  # Cùng option khớp nhiều selector
+                    variant = {
+                        'sku': sku,
                         'name': f"{product.name} - {var_name}",
                         'price': var_price or product.base_price,
                         'option_1_type': 'Phiên bản',
                         'option_1_value': var_name,
-                        'is_default': i == 0
-                    })
+                        'is_default': not product.variants
+                    }
+                    # Link trang riêng của variant (để --expand-variants lấy giá/ảnh/tồn kho thật)
+                    href = var_elem.get('href') or ''
+                    if href and not href.startswith(('#', 'javascript:')):
+                        from urllib.parse import urljoin
+                        variant['url'] = urljoin(url, href)
+                    product.variants.append(variant)
 
         # Nếu không có variants, tạo 1 variant mặc định
         if not product.variants:
             product.variants.append({
-                'sku': f"{product.sku_prefix}-01",
+                'sku': self.variant_sku(product.sku_prefix),
                 'name': product.name,
                 'price': product.base_price,
                 'is_default': True
@@ -603,15 +1339,515 @@ class DienmayxanhScraper(BaseScraper):
 
         return product
 
+    def _extract_prices(self, soup: 'BeautifulSoup', html_text: str) -> Tuple[float, float]:
+        """(giá bán, giá gốc) của trang sản phẩm"""
+        base_price = compare_at_price = 0.0
+        # Giá - thử nhiều cách
+        # 1. Từ JSON embedded
+        price_match = re.search(r'"price"\s*:\s*(\d+)', html_text)
+        if price_match:
+            base_price = float(price_match.group(1))
+
+        # 2. Từ data-price attribute (giá lớn nhất hợp lý - thường là giá SP chính)
+        if base_price == 0:
+            data_prices = re.findall(r'data-price="(\d+)"', html_text)
+            valid_prices = [float(p) for p in data_prices if float(p) > 1000000]  # > 1 triệu
+            if valid_prices:
+                base_price = max(valid_prices)
+
+        # 3. Từ HTML selectors
+        if base_price == 0:
+            price_selectors = [
+                '.box-price .box-price-present', '.product-price .present',
+                '.bs_price', '.price', '[class*="price-current"]'
+            ]
+            for selector in price_selectors:
+                price_elem = soup.select_one(selector)
+                if price_elem:
+                    price = self.clean_price(price_elem.text)
+                    if price > 1000000:  # > 1 triệu
+                        base_price = price
+                        break
+
+        # Giá gốc (nếu có)
+        old_price_selectors = ['.box-price .box-price-old', '.product-price .old', '.price-old']
+        for selector in old_price_selectors:
+            old_price_elem = soup.select_one(selector)
+            if old_price_elem:
+                compare_at_price = self.clean_price(old_price_elem.text)
+                break
+        return base_price, compare_at_price
+
+    def _extract_images(self, soup: 'BeautifulSoup', html_text: str) -> List[str]:
+        """Ảnh sản phẩm (bản lớn, tối đa 10)"""
+        images: List[str] = []
+        # Images - Lấy từ HTML với nhiều phương pháp
+        # Priority 1: Tìm ảnh sản phẩm từ mwg-static/Products (ảnh chính thức)
+        product_img_pattern = re.compile(r'https://cdnv2\.tgdd\.vn/mwg-static/dmx/Products/Images/\d+/\d+/[^"\'>\s]+\.(jpg|png|webp)', re.I)
+        found_urls = product_img_pattern.findall(html_text)
+        # Lấy unique URLs từ regex match
+        all_product_urls = set()
+        for match in re.finditer(product_img_pattern, html_text):
+            url = match.group(0)
+            # Loại bỏ thumb nhỏ, giữ ảnh lớn
+            if 'thumb' not in url.lower() or '550x' in url or '1020x' in url:
+                # Chuẩn hóa URL - bỏ size suffix nhỏ
+                size_match = re.search(r'-(\d+)x(\d+)(?=[-.])', url)
+                if size_match:
+                    w, h = int(size_match.group(1)), int(size_match.group(2))
+                    if w < 300:
+                        continue  # Skip thumbnails
+                all_product_urls.add(url)
+
+        # Thêm vào danh sách ảnh (limit 10)
+        for url in list(all_product_urls)[:10]:
+            if url not in images:
+                images.append(url)
+
+        # Priority 2: Fallback - tìm trong img tags
+        if not images:
+            for img in soup.select('img[src*="cdn"], img[data-src*="cdn"]'):
+                src = img.get('data-src') or img.get('src') or ''
+                if 'Products/Images' in src and src not in images:
+                    images.append(src)
+                    if len(images) >= 10:
+                        break
+        return images
+
+    def _extract_in_stock(self, soup: 'BeautifulSoup') -> Optional[bool]:
+        """Còn hàng theo khu vực mua hàng / trạng thái (None nếu trang không có khu vực này).
+
+        Chỉ đọc text trong buy box, không cả trang: gợi ý/sản phẩm liên quan "hết hàng" không làm sai kết quả.
+        """
+        boxes = soup.select(', '.join(self.STOCK_SELECTORS))
+        if not boxes:
+            return None
+        text = ' '.join(box.get_text(' ') for box in boxes).lower()
+        return not any(s in text for s in self.OUT_OF_STOCK_TEXTS)
+
+    # Fan-out trang variant: dùng chung cho mọi instance, cache theo URL canonical (các variant anh em
+    # link lẫn nhau -> mỗi trang chỉ fetch 1 lần)
+    variant_workers = 8
+    variant_cache_size = 2048
+    _variant_executor = None
+    _variant_cache: 'OrderedDict[str, Optional[Dict[str, Any]]]' = OrderedDict()
+    _variant_lock = threading.Lock()
+
+    def expand_variants(self, product: ProductData) -> ProductData:
+        """Fetch song song trang của các variant (qua fetch layer dùng chung) và merge giá/ảnh/tồn kho vào variants"""
+        canonicalize = self.canonicalizer.canonicalize
+        parent = canonicalize(product.source_url)
+        targets: Dict[str, List[Dict[str, Any]]] = {}
+        for variant in product.variants:
+            if variant.get('url'):
+                key = canonicalize(variant['url'])
+                if key == parent:
+                    # Variant đang chọn = chính trang cha, đã có đủ dữ liệu
+                    variant['price'] = product.base_price or variant['price']
+                    if product.images:
+                        variant['image_url'] = product.images[0]
+                else:
+                    targets.setdefault(key, []).append(variant)
+        if not targets:
+            return product
+        cls = DienmayxanhScraper
+        with cls._variant_lock:
+            if cls._variant_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                cls._variant_executor = ThreadPoolExecutor(max_workers=cls.variant_workers,
+                                                           thread_name_prefix='variants')
+        for key, page in zip(targets, cls._variant_executor.map(self._variant_page, targets)):
+            if page is None:
+                continue
+            for variant in targets[key]:
+                if page['price']:
+                    variant['price'] = page['price']
+                if page['compare_at_price']:
+                    variant['compare_at_price'] = page['compare_at_price']
+                if page['image_url']:
+                    variant['image_url'] = page['image_url']
+                if page['in_stock'] is not None:
+                    variant['in_stock'] = page['in_stock']
+        return product
+
+    def _variant_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Giá/ảnh/tồn kho từ trang variant (cache LRU, None nếu lỗi)"""
+        cls = DienmayxanhScraper
+        with cls._variant_lock:
+            if url in cls._variant_cache:
+                cls._variant_cache.move_to_end(url)
+                return cls._variant_cache[url]
+        try:
+            if self.use_selenium:
+                with self.driver_lock:
+                    body, encoding = self.fetch_body(url)
+            else:
+                body, encoding = self.fetch_body(url)
+            # Chỉ lấy giá/ảnh/tồn kho: không extract() cả trang (không cấp SKU cho trang variant)
+            soup = self.parse_html(body, encoding)
+            html_text = str(soup)
+            price, compare_at_price = self._extract_prices(soup, html_text)
+            images = self._extract_images(soup, html_text)
+            page = {
+                'price': price,
+                'compare_at_price': compare_at_price,
+                'image_url': images[0] if images else '',
+                'in_stock': self._extract_in_stock(soup),
+            }
+        except Exception as e:
+            print(f"  ✗ Variant lỗi {url}: {e}")
+            return None
+        with cls._variant_lock:
+            cls._variant_cache[url] = page
+            while len(cls._variant_cache) > cls.variant_cache_size:
+                cls._variant_cache.popitem(last=False)
+        return page
+
+
+# ============================================================
+# API-first: lấy dữ liệu từ JSON endpoint của site (XHR của chính trang) thay vì HTML/browser
+# ============================================================
+
+# Header đánh dấu bản ghi archive là JSON của API (giá trị = tên class ApiAdapter), không phải HTML
+API_ARCHIVE_HEADER = 'X-Api-Adapter'
+
+
+class ApiAdapter(ABC):
+    """Adapter JSON endpoint của 1 site, gắn với scraper (dùng chung fetch layer: rate limit/retry/breaker).
+
+    Subclass cài đặt key() / fetch_batch() / to_product(). batch_size > 1: các request đồng thời được gom
+    thành 1 lần gọi API (chờ tối đa batch_wait giây để gom đủ).
+    Sản phẩm từ API thiếu field bắt buộc của scraper (required_fields) -> coi như miss, caller cào HTML.
+    SKU chỉ được cấp (build) sau khi sản phẩm được chấp nhận -> kết quả bị loại không để lại dòng trong registry.
+    Adapter tự tắt theo host sau max_failures lần lỗi hoặc max_misses lần miss liên tiếp (endpoint đổi,
+    API không có dữ liệu của site) -> host đó chỉ cào HTML.
+    """
+
+    batch_size = 1
+    batch_wait = 0.05
+    max_failures = 3
+    max_misses = 10
+
+    def __init__(self, scraper: 'BaseScraper'):
+        self.scraper = scraper
+        self._cond = threading.Condition()
+        self._waiting: List[Tuple[str, Any]] = []
+        self._leader = False
+        self._lock = threading.Lock()
+        self._streaks: Dict[str, Tuple[int, int]] = {}  # host -> (lỗi liên tiếp, miss liên tiếp)
+        self.disabled_hosts: Set[str] = set()
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0, 'requests': 0}
+
+    @property
+    def disabled(self) -> bool:
+        return bool(self.disabled_hosts)
+
+    @abstractmethod
+    def key(self, url: str) -> Optional[str]:
+        """ID/khóa tra cứu API của URL (None = URL không dùng API được)"""
+
+    @abstractmethod
+    def fetch_batch(self, keys: List[str]) -> Dict[str, Any]:
+        """Gọi API cho nhiều khóa -> {key: JSON sản phẩm}"""
+
+    @abstractmethod
+    def to_product(self, url: str, data: Dict[str, Any]) -> ProductData:
+        """JSON sản phẩm -> ProductData chưa có SKU (không I/O, không cấp SKU)"""
+
+    def build(self, url: str, data: Dict[str, Any]) -> ProductData:
+        """to_product() + cấp SKU (dùng cả khi --reextract từ archive)"""
+        return self.scraper.assign_skus(self.to_product(url, data), json_product_id(data))
+
+    def product(self, url: str) -> Optional[ProductData]:
+        """ProductData từ API, None nếu API không có dữ liệu (caller fallback sang HTML)"""
+        found = self.lookup(url)
+        return found[0] if found else None
+
+    def lookup(self, url: str) -> Optional[Tuple[ProductData, Dict[str, Any]]]:
+        """(ProductData, JSON gốc) từ API; None nếu không có dữ liệu / thiếu field bắt buộc / host đã tắt API"""
+        host = urlparse(url).netloc.lower()
+        key = None if host in self.disabled_hosts else self.key(url)
+        if key is None:
+            return None
+        try:
+            data = self._batched(key) if self.batch_size > 1 else self._call([key]).get(key)
+        except Exception as e:
+            self._record(host, 'errors', e)
+            return None
+        if not data:
+            self._record(host, 'misses', 'không có dữ liệu')
+            return None
+        product = self.to_product(url, data)
+        missing = self.scraper.missing_fields(product)
+        if missing:
+            self._record(host, 'misses', f"thiếu {', '.join(missing)}")
+            return None
+        self._record(host, 'hits')
+        return self.scraper.assign_skus(product, json_product_id(data)), data
+
+    def _record(self, host: str, outcome: str, reason: Any = None):
+        """Cập nhật thống kê + chuỗi lỗi/miss liên tiếp của host; quá ngưỡng -> tắt API cho host"""
+        with self._lock:
+            self.stats[outcome] += 1
+            errors, misses = self._streaks.get(host, (0, 0))
+            if outcome == 'hits':
+                errors = misses = 0
+            else:
+                misses += 1
+                errors = errors + 1 if outcome == 'errors' else 0
+            self._streaks[host] = (errors, misses)
+            disable = (errors >= self.max_failures or misses >= self.max_misses) and host not in self.disabled_hosts
+            if disable:
+                self.disabled_hosts.add(host)
+        if disable:
+            print(f"  API {self.__class__.__name__} tắt cho {host} sau {misses} lần không dùng được "
+                  f"({reason}), chuyển về HTML")
+
+    def _call(self, keys: List[str]) -> Dict[str, Any]:
+        with self._lock:
+            self.stats['requests'] += 1
+        return self.fetch_batch(keys)
+
+    def _batched(self, key: str) -> Optional[Dict[str, Any]]:
+        """Gom request: thread đến đầu tiên làm leader, chờ gom batch rồi gọi API cho cả nhóm"""
+        from concurrent.futures import Future
+        future: Future = Future()
+        with self._cond:
+            self._waiting.append((key, future))
+            leader = not self._leader
+            self._leader = True
+            self._cond.notify_all()
+        if leader:
+            while True:
+                with self._cond:
+                    deadline = time.monotonic() + self.batch_wait
+                    while len(self._waiting) < self.batch_size and time.monotonic() < deadline:
+                        self._cond.wait(deadline - time.monotonic())
+                    batch = self._waiting[:self.batch_size]
+                    del self._waiting[:self.batch_size]
+                    if not batch:
+                        self._leader = False
+                        break
+                try:
+                    results = self._call(list(dict.fromkeys(k for k, _ in batch)))
+                except Exception as e:
+                    for _, waiter in batch:
+                        waiter.set_exception(e)
+                else:
+                    for k, waiter in batch:
+                        waiter.set_result(results.get(k))
+        return future.result()
+
+
+class MagentoGraphQLApi(ApiAdapter):
+    """Cellphones (Magento): GraphQL products(filter: url_key in [...]) - 1 request cho cả batch"""
+
+    endpoint = 'https://cellphones.com.vn/graphql'
+    batch_size = 20
+    query = ('{ products(filter: {url_key: {in: [%s]}}, pageSize: %d) { items { sku name url_key stock_status '
+             'price_range { minimum_price { regular_price { value } final_price { value } } } '
+             'media_gallery { url } short_description { html } description { html } categories { name level } '
+             'custom_attributesV2 { items { code ... on AttributeValue { value } '
+             '... on AttributeSelectedOptions { selected_options { label } } } } } } }')
+    brand_codes = ('brand', 'manufacturer', 'thuong_hieu')
+
+    def key(self, url: str) -> Optional[str]:
+        path = urlparse(url).path.strip('/')
+        return path[:-5] if path.endswith('.html') and '/' not in path else None
+
+    def fetch_batch(self, keys: List[str]) -> Dict[str, Any]:
+        from urllib.parse import urlencode
+        query = self.query % (', '.join(json.dumps(k) for k in keys), len(keys))
+        response = self.scraper.fetch_response(f"{self.endpoint}?{urlencode({'query': query})}")
+        items = ((response.json().get('data') or {}).get('products') or {}).get('items') or []
+        return {item.get('url_key'): item for item in items}
+
+    def to_product(self, url: str, data: Dict[str, Any]) -> ProductData:
+        s = self.scraper
+        price = (data.get('price_range') or {}).get('minimum_price') or {}
+        final = float(((price.get('final_price') or {}).get('value')) or 0)
+        regular = float(((price.get('regular_price') or {}).get('value')) or 0)
+        name = s.clean_text(data.get('name'))
+        product = ProductData(name=name, source_url=url, scraped_at=datetime.now().isoformat())
+        if name:
+            product.slug = s.generate_slug(name)
+        product.base_price = final or regular
+        product.compare_at_price = regular if regular > final else 0
+        product.short_description = s.clean_text(re.sub(r'<[^>]+>', ' ', (data.get('short_description') or {}).get('html') or ''))
+        product.description = (data.get('description') or {}).get('html') or ''
+        product.images = [m['url'] for m in data.get('media_gallery') or [] if m.get('url')]
+        categories = [c for c in data.get('categories') or [] if c.get('name')]
+        if categories:
+            product.category_name = s.clean_text(max(categories, key=lambda c: c.get('level') or 0)['name'])
+        # Thông số: custom attribute hiển thị (giá trị text hoặc option đã chọn)
+        for item in (data.get('custom_attributesV2') or {}).get('items') or []:
+            code = item.get('code') or ''
+            value = item.get('value') or ', '.join(o['label'] for o in item.get('selected_options') or [] if o.get('label'))
+            value = s.clean_text(str(value or ''))
+            if not code or not value:
+                continue
+            if code in self.brand_codes:
+                product.brand_name = product.brand_name or value
+                continue
+            product.attributes.append({'attribute_name': code.replace('_', ' ').strip().capitalize(), 'value': value,
+                                       'display_group': 'Thông số kỹ thuật',
+                                       'display_order': len(product.attributes) + 1})
+        product.variants.append({
+            'name': product.name,
+            'price': product.base_price,
+            'in_stock': data.get('stock_status') != 'OUT_OF_STOCK',
+            'is_default': True
+        })
+        return product
+
+
+class NextDataApi(ApiAdapter):
+    """FPT Shop (Next.js): JSON route /_next/data/<buildId>/<path>.json mà trang gọi khi điều hướng client-side.
+
+    buildId lấy 1 lần theo host từ __NEXT_DATA__ của trang chủ. 404 -> lấy lại buildId (tối đa 1 lần mỗi
+    refresh_interval giây/host); buildId không đổi -> sản phẩm không còn, coi là miss (trang HTML quyết định).
+    """
+
+    refresh_interval = 300.0
+
+    def __init__(self, scraper: 'BaseScraper'):
+        super().__init__(scraper)
+        self._build_ids: Dict[str, str] = {}
+        self._refreshed: Dict[str, float] = {}   # origin -> lúc lấy buildId gần nhất (monotonic)
+        self._build_lock = threading.Lock()
+
+    def key(self, url: str) -> Optional[str]:
+        parsed = urlparse(url)
+        return url if parsed.path.strip('/').count('/') >= 1 else None  # /danh-muc/san-pham
+
+    def _fetch_build_id(self, origin: str) -> str:
+        html = self.scraper.fetch_response(origin + '/').text
+        match = re.search(r'"buildId"\s*:\s*"([^"]+)"', html)
+        if not match:
+            raise ValueError(f"Không tìm thấy Next.js buildId trên {origin}")
+        self._refreshed[origin] = time.monotonic()
+        return match.group(1)
+
+    def _build_id(self, origin: str) -> str:
+        with self._build_lock:
+            if origin not in self._build_ids:
+                self._build_ids[origin] = self._fetch_build_id(origin)
+            return self._build_ids[origin]
+
+    def _refresh_build_id(self, origin: str, stale: str) -> Optional[str]:
+        """Sau 404 với buildId stale: buildId mới nếu site đã deploy bản khác, None nếu không đổi / vừa lấy lại"""
+        with self._build_lock:
+            current = self._build_ids.get(origin)
+            if current != stale:
+                return current  # Thread khác đã lấy buildId mới
+            if time.monotonic() - self._refreshed.get(origin, 0.0) < self.refresh_interval:
+                return None
+            current = self._build_ids[origin] = self._fetch_build_id(origin)
+        return current if current != stale else None
+
+    def fetch_batch(self, keys: List[str]) -> Dict[str, Any]:
+        import requests
+        results = {}
+        for url in keys:
+            parsed = urlparse(url)
+            origin = f"{parsed.scheme}://{parsed.netloc}"
+            build_id = self._build_id(origin)
+            while build_id:
+                data_url = f"{origin}/_next/data/{build_id}{parsed.path.rstrip('/')}.json"
+                try:
+                    response = self.scraper.fetch_response(data_url, retries=1)
+                except requests.HTTPError as e:
+                    if getattr(e.response, 'status_code', None) != 404:
+                        raise
+                    build_id = self._refresh_build_id(origin, build_id)
+                    continue
+                results[url] = find_product_json(response.json().get('pageProps') or {})
+                break
+        return results
+
+    def to_product(self, url: str, data: Dict[str, Any]) -> ProductData:
+        return product_from_json(self.scraper, url, data)
+
+
+_JSON_NAME_KEYS = ('displayName', 'productName', 'name', 'title')
+_JSON_PRICE_KEYS = ('currentPrice', 'finalPrice', 'salePrice', 'price')
+_JSON_OLD_PRICE_KEYS = ('originalPrice', 'listPrice', 'regularPrice', 'oldPrice')
+_JSON_ID_KEYS = ('sku', 'productId', 'id')
+
+
+def json_product_id(data: Dict[str, Any]) -> str:
+    """Mã sản phẩm của site trong JSON sản phẩm (API và __NEXT_DATA__ của trang HTML dùng chung)"""
+    return str(next((data[k] for k in _JSON_ID_KEYS if data.get(k) not in (None, '')), '')).strip()
+
+
+def find_product_json(obj: Any, depth: int = 0) -> Optional[Dict[str, Any]]:
+    """Tìm object sản phẩm (có tên + giá) trong JSON lồng nhau (schema của API không cố định)"""
+    if depth > 8:
+        return None
+    if isinstance(obj, dict):
+        if any(isinstance(obj.get(k), str) for k in _JSON_NAME_KEYS) and any(k in obj for k in _JSON_PRICE_KEYS):
+            return obj
+        children = obj.values()
+    elif isinstance(obj, list):
+        children = obj[:50]
+    else:
+        return None
+    for child in children:
+        found = find_product_json(child, depth + 1)
+        if found:
+            return found
+    return None
+
+
+def product_from_json(scraper: 'BaseScraper', url: str, data: Dict[str, Any]) -> ProductData:
+    """Map JSON sản phẩm (tên field phổ biến) -> ProductData (chưa có SKU, xem ApiAdapter.build)"""
+    def first(keys):
+        return next((data[k] for k in keys if data.get(k) not in (None, '')), None)
+
+    def number(value) -> float:
+        if isinstance(value, dict):  # vd: {"value": 1990000, "currency": "VND"}
+            value = next((v for v in value.values() if isinstance(v, (int, float))), 0)
+        return float(value) if isinstance(value, (int, float)) else scraper.clean_price(str(value or ''))
+
+    name = scraper.clean_text(str(first(_JSON_NAME_KEYS) or ''))
+    product = ProductData(name=name, source_url=url, scraped_at=datetime.now().isoformat())
+    if name:
+        product.slug = scraper.generate_slug(name)
+    product.base_price = number(first(_JSON_PRICE_KEYS))
+    old_price = number(first(_JSON_OLD_PRICE_KEYS))
+    product.compare_at_price = old_price if old_price > product.base_price else 0
+    brand = data.get('brand') or data.get('brandName')
+    product.brand_name = scraper.clean_text(str(brand.get('name', '') if isinstance(brand, dict) else brand or ''))
+    product.short_description = scraper.clean_text(str(data.get('shortDescription') or ''))
+    product.description = str(data.get('description') or '')
+    for image in data.get('images') or data.get('gallery') or data.get('media') or []:
+        src = image if isinstance(image, str) else (image or {}).get('url') or (image or {}).get('src')
+        if src and src not in product.images:
+            product.images.append(src)
+    specs = data.get('specifications') or data.get('attributes') or data.get('specs') or []
+    for order, spec in enumerate(specs if isinstance(specs, list) else [], 1):
+        if isinstance(spec, dict):
+            attr_name = scraper.clean_text(str(spec.get('name') or spec.get('displayName') or spec.get('label') or ''))
+            value = scraper.clean_text(str(spec.get('value') or spec.get('displayValue') or ''))
+            if attr_name and value:
+                product.attributes.append({'attribute_name': attr_name, 'value': value,
+                                           'display_group': 'Thông số kỹ thuật', 'display_order': order})
+    product.variants.append({
+        'name': product.name,
+        'price': product.base_price,
+        'is_default': True
+    })
+    return product
+
 
 class CellphonesScraper(BaseScraper):
     """Scraper cho Cellphones.com.vn"""
 
-    def can_handle(self, url: str) -> bool:
-        return 'cellphones.com.vn' in urlparse(url).netloc.lower()
+    domains = ('cellphones.com.vn',)
+    required_fields = ('name', 'base_price', 'attributes')
+    api_adapter = MagentoGraphQLApi
 
-    def scrape(self, url: str) -> ProductData:
-        soup = self.fetch_page(url)
+    def extract(self, url: str, soup: 'BeautifulSoup') -> ProductData:
         product = ProductData(
             name="",
             source_url=url,
@@ -623,7 +1859,7 @@ class CellphonesScraper(BaseScraper):
         if name_elem:
             product.name = self.clean_text(name_elem.text)
             product.slug = self.generate_slug(product.name)
-            product.sku_prefix = self.generate_sku(product.name)
+            product.sku_prefix = self.generate_sku(product.name, url, self.site_product_id(soup))
 
         # Giá
         price_elem = soup.select_one('.product__price--show, .tpt---sale-price')
@@ -672,7 +1908,7 @@ class CellphonesScraper(BaseScraper):
 
         # Default variant
         product.variants.append({
-            'sku': f"{product.sku_prefix}-01",
+            'sku': self.variant_sku(product.sku_prefix),
             'name': product.name,
             'price': product.base_price,
             'is_default': True
@@ -684,11 +1920,11 @@ class CellphonesScraper(BaseScraper):
 class FPTShopScraper(BaseScraper):
     """Scraper cho FPTShop.com.vn"""
 
-    def can_handle(self, url: str) -> bool:
-        return 'fptshop.com.vn' in urlparse(url).netloc.lower()
+    domains = ('fptshop.com.vn',)
+    required_fields = ('name', 'base_price', 'attributes')
+    api_adapter = NextDataApi
 
-    def scrape(self, url: str) -> ProductData:
-        soup = self.fetch_page(url)
+    def extract(self, url: str, soup: 'BeautifulSoup') -> ProductData:
         product = ProductData(
             name="",
             source_url=url,
@@ -700,7 +1936,7 @@ class FPTShopScraper(BaseScraper):
         if name_elem:
             product.name = self.clean_text(name_elem.text)
             product.slug = self.generate_slug(product.name)
-            product.sku_prefix = self.generate_sku(product.name)
+            product.sku_prefix = self.generate_sku(product.name, url, self.site_product_id(soup))
 
         # Giá
         price_elem = soup.select_one('.st-price-main, .price-value')
@@ -743,7 +1979,7 @@ class FPTShopScraper(BaseScraper):
 
         # Default variant
         product.variants.append({
-            'sku': f"{product.sku_prefix}-01",
+            'sku': self.variant_sku(product.sku_prefix),
             'name': product.name,
             'price': product.base_price,
             'is_default': True
@@ -758,8 +1994,7 @@ class GenericScraper(BaseScraper):
     def can_handle(self, url: str) -> bool:
         return True  # Fallback scraper
 
-    def scrape(self, url: str) -> ProductData:
-        soup = self.fetch_page(url)
+    def extract(self, url: str, soup: 'BeautifulSoup') -> ProductData:
         product = ProductData(
             name="",
             source_url=url,
@@ -779,7 +2014,7 @@ class GenericScraper(BaseScraper):
 
         if product.name:
             product.slug = self.generate_slug(product.name)
-            product.sku_prefix = self.generate_sku(product.name)
+            product.sku_prefix = self.generate_sku(product.name, url, self.site_product_id(soup))
 
         # Try common patterns for price
         price_selectors = [
@@ -820,7 +2055,7 @@ class GenericScraper(BaseScraper):
         # Default variant
         if product.name:
             product.variants.append({
-                'sku': f"{product.sku_prefix}-01",
+                'sku': self.variant_sku(product.sku_prefix),
                 'name': product.name,
                 'price': product.base_price,
                 'is_default': True
@@ -829,59 +2064,682 @@ class GenericScraper(BaseScraper):
         return product
 
 
+# Plugin scraper đăng ký qua entry points, tên entry point = domain. Ví dụ (pyproject.toml):
+#   [project.entry-points."product_scraper.scrapers"]
+#   "nguyenkim.com" = "my_scrapers:NguyenKimScraper"
+SCRAPER_ENTRY_POINT_GROUP = 'product_scraper.scrapers'
+
+
+def _scraper_entry_points() -> List[Any]:
+    """Entry points của group scraper (chưa load module)"""
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=SCRAPER_ENTRY_POINT_GROUP))
+    return list(eps.get(SCRAPER_ENTRY_POINT_GROUP, []))  # Python < 3.10
+
+
+class PathCosts:
+    """Chi phí theo đường lấy dữ liệu (api / static / browser): số trang + tổng thời gian"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._costs: Dict[str, List[float]] = {}
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            cost = self._costs.setdefault(path, [0, 0.0])
+            cost[0] += 1
+            cost[1] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {path: {'pages': int(n), 'seconds': round(total, 2), 'per_page': round(total / n, 3) if n else 0.0}
+                    for path, (n, total) in self._costs.items()}
+
+
 class ProductScraperManager:
-    """Manager để chọn scraper phù hợp"""
+    """Manager để chọn scraper phù hợp (index theo host suffix, khởi tạo lazy)"""
 
-    def __init__(self, use_selenium: bool = False):
+    builtin_scrapers = (DienmayxanhScraper, CellphonesScraper, FPTShopScraper)
+    fallback_scraper = GenericScraper
+
+    def __init__(self, use_selenium: bool = False, load_entry_points: bool = True,
+                 keep_browsers: bool = False, expand_variants: bool = False, api_first: bool = True,
+                 hybrid: bool = False):
         self.use_selenium = use_selenium
-        self.scrapers: List[BaseScraper] = [
-            DienmayxanhScraper(use_selenium=use_selenium),
-            CellphonesScraper(use_selenium=use_selenium),
-            FPTShopScraper(use_selenium=use_selenium),
-            GenericScraper(use_selenium=use_selenium),  # Fallback
-        ]
+        # Hybrid: HTML tĩnh trước, chỉ render browser trang thiếu field bắt buộc
+        self.hybrid = hybrid and not use_selenium
+        self.costs = PathCosts()
+        self.api_first = api_first  # Thử JSON API của site trước HTML/browser
+        self.expand_variants = expand_variants  # Fetch thêm trang riêng của từng variant
+        self.keep_browsers = keep_browsers  # Giữ browser sống giữa các lần scrape (daemon)
+        # domain -> class scraper hoặc EntryPoint (load khi dùng lần đầu)
+        self._index: Dict[str, Any] = {}
+        self._instances: Dict[Any, BaseScraper] = {}
+        self._lock = threading.Lock()
+        for scraper_cls in self.builtin_scrapers:
+            self.register(scraper_cls)
+        if load_entry_points:
+            for ep in _scraper_entry_points():
+                self._index[ep.name.lower()] = ep
+
+    def register(self, scraper_cls, domains: Optional[Iterable[str]] = None):
+        """Đăng ký scraper cho các domain (mặc định: scraper_cls.domains)"""
+        for domain in domains or scraper_cls.domains:
+            self._index[domain.lower()] = scraper_cls
+
+    def scraper_for(self, url: str) -> BaseScraper:
+        """Tìm scraper theo hostname: thử lần lượt các suffix (a.b.com -> b.com -> com)"""
+        host = urlparse(url).hostname or ''
+        labels = host.split('.')
+        for i in range(len(labels)):
+            target = self._index.get('.'.join(labels[i:]))
+            if target is not None:
+                break
+        else:
+            target = self.fallback_scraper
+        return self._instance(target)
+
+    def _instance(self, target) -> BaseScraper:
+        with self._lock:
+            scraper = self._instances.get(target)
+            if scraper is None:
+                scraper_cls = target.load() if hasattr(target, 'load') else target
+                scraper = self._instances[target] = scraper_cls(use_selenium=self.use_selenium)
+            return scraper
 
     def scrape(self, url: str) -> ProductData:
         """Cào dữ liệu từ URL"""
-        for scraper in self.scrapers:
-            if scraper.can_handle(url):
-                print(f"Using scraper: {scraper.__class__.__name__}")
-                if self.use_selenium:
-                    print("  (with Selenium for JS content)")
+        scraper = self.scraper_for(url)
+        print(f"Using scraper: {scraper.__class__.__name__}")
+        started = time.monotonic()
+        result = scraper.api_product(url) if self.api_first else None
+        if result is not None:
+            print("  (from JSON API)")
+            self.costs.record('api', time.monotonic() - started)
+            result = self.complete(scraper, url, result)
+        elif not self.use_selenium or BaseScraper.renderer is not None:
+            # HTML tĩnh, hoặc renderer dùng chung (thread-safe, không cần driver_lock)
+            started = time.monotonic()
+            result = scraper.scrape(url)
+            self.costs.record('browser' if self.use_selenium else 'static', time.monotonic() - started)
+            result = self.complete(scraper, url, result)
+        else:
+            print("  (with Selenium for JS content)")
+            started = time.monotonic()
+            with scraper.driver_lock:
                 result = scraper.scrape(url)
-                scraper._close_selenium()  # Cleanup
-                return result
-        raise ValueError(f"No scraper available for URL: {url}")
+                if not self.keep_browsers:
+                    scraper._close_selenium()  # Cleanup
+            self.costs.record('browser', time.monotonic() - started)
+        if self.expand_variants:
+            result = scraper.expand_variants(result)
+        return result
+
+    def complete(self, scraper: BaseScraper, url: str, product: ProductData) -> ProductData:
+        """Hybrid: product từ HTML tĩnh hoặc API thiếu field bắt buộc -> render bằng browser và extract lại"""
+        if not self.hybrid:
+            return product
+        missing = scraper.missing_fields(product)
+        if not missing or not BaseScraper.browser_available():
+            return product
+        print(f"  ↻ Thiếu {', '.join(missing)} trong HTML tĩnh -> render browser: {url}")
+        started = time.monotonic()
+        try:
+            rendered = scraper.extract(url, scraper.parse_html(scraper.render_html(url)))
+        except Exception as e:
+            print(f"  ✗ Render lỗi, giữ kết quả HTML tĩnh: {e}")
+            return product
+        finally:
+            self.costs.record('browser', time.monotonic() - started)
+            if not self.keep_browsers:
+                with scraper.driver_lock:
+                    scraper._close_selenium()
+        # Giữ bản đầy đủ hơn
+        return rendered if len(scraper.missing_fields(rendered)) <= len(missing) else product
+
+    def api_stats(self) -> Dict[str, Dict[str, int]]:
+        """Số lần API trả dữ liệu/không có/lỗi + số request theo scraper"""
+        with self._lock:
+            scrapers = list(self._instances.values())
+        return {s.__class__.__name__: dict(s.api.stats, disabled=sorted(s.api.disabled_hosts)) for s in scrapers if s.api}
+
+    def close(self):
+        """Đóng browser của các scraper đã khởi tạo"""
+        with self._lock:
+            scrapers = list(self._instances.values())
+        for scraper in scrapers:
+            with scraper.driver_lock:
+                scraper._close_selenium()
+
+
+@dataclass
+class ScrapeResult:
+    """Kết quả cào 1 URL (product hoặc error)"""
+    url: str
+    product: Optional[ProductData] = None
+    error: Optional[Exception] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _scrape_timed(manager: ProductScraperManager, url: str) -> ScrapeResult:
+    started = time.monotonic()
+    try:
+        product = manager.scrape(url)
+    except Exception as e:
+        return ScrapeResult(url, error=e, elapsed=time.monotonic() - started)
+    return ScrapeResult(url, product=product, elapsed=time.monotonic() - started)
+
+
+def iter_scrape_results(urls: Iterable[str], manager: Optional[ProductScraperManager] = None,
+                        max_in_flight: int = 8) -> Iterator[ScrapeResult]:
+    """Cào stream URL song song, yield ScrapeResult theo thứ tự hoàn thành.
+
+    Chỉ đọc URL tiếp theo khi có slot trống -> tối đa max_in_flight URL đang chạy/chờ consumer
+    (kể cả kết quả đã xong nhưng consumer chưa nhận), consumer chậm thì việc cào cũng dừng lại (backpressure).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    manager = manager or ProductScraperManager()
+    max_in_flight = max(1, max_in_flight)
+    url_iter = iter(urls)
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='scrape')
+    pending = set()
+    ready: deque = deque()  # Đã xong, chờ consumer nhận - vẫn tính vào max_in_flight
+
+    def submit_next() -> bool:
+        url = next(url_iter, None)
+        if url is None:
+            return False
+        pending.add(executor.submit(_scrape_timed, manager, url))
+        return True
+
+    try:
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending or ready:
+            if not ready:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                ready.extend(done)
+            future = ready.popleft()
+            submit_next()  # Slot được giải phóng khi kết quả giao cho consumer
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_scrape(urls: Iterable[str], manager: Optional[ProductScraperManager] = None,
+                max_in_flight: int = 8,
+                on_error: Optional[Callable[[str, Exception], None]] = None) -> Iterator[ProductData]:
+    """Như iter_scrape_results nhưng chỉ yield ProductData; lỗi chuyển cho on_error (mặc định: in ra)"""
+    for result in iter_scrape_results(urls, manager, max_in_flight):
+        if result.ok:
+            yield result.product
+        elif on_error:
+            on_error(result.url, result.error)
+        else:
+            print(f"✗ Error scraping {result.url}: {result.error}")
+
+
+async def aiter_scrape(urls: Union[Iterable[str], AsyncIterable[str]],
+                       manager: Optional[ProductScraperManager] = None, max_in_flight: int = 8,
+                       on_error: Optional[Callable[[str, Exception], None]] = None) -> AsyncIterator[ProductData]:
+    """Bản async của iter_scrape: nhận iterable hoặc async iterable URL, yield ProductData khi xong.
+
+    Việc cào (blocking) chạy trong thread pool riêng; tối đa max_in_flight URL cùng lúc.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    loop = asyncio.get_running_loop()
+    manager = manager or ProductScraperManager()
+    max_in_flight = max(1, max_in_flight)
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='ascrape')
+    if hasattr(urls, '__aiter__'):
+        url_iter = urls.__aiter__()
+
+        async def next_url() -> Optional[str]:
+            try:
+                return await url_iter.__anext__()
+            except StopAsyncIteration:
+                return None
+    else:
+        sync_iter = iter(urls)
+
+        async def next_url() -> Optional[str]:
+            # next() có thể block (đọc file/stdin, generator chậm) -> chạy ngoài event loop
+            return await loop.run_in_executor(None, next, sync_iter, None)
+
+    pending = set()
+    ready: deque = deque()
+
+    async def submit_next() -> bool:
+        url = await next_url()
+        if url is None:
+            return False
+        pending.add(loop.run_in_executor(executor, _scrape_timed, manager, url))
+        return True
+
+    try:
+        while len(pending) < max_in_flight and await submit_next():
+            pass
+        while pending or ready:
+            if not ready:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                ready.extend(done)
+            result = ready.popleft().result()
+            await submit_next()
+            if result.ok:
+                yield result.product
+            elif on_error:
+                on_error(result.url, result.error)
+            else:
+                print(f"✗ Error scraping {result.url}: {result.error}")
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Scraper dùng trong process con, cache theo "module:ClassName" (mỗi process khởi tạo 1 lần)
+_PROCESS_SCRAPERS: Dict[str, BaseScraper] = {}
+
+
+def scraper_ref(scraper: BaseScraper) -> str:
+    """Tham chiếu picklable tới class scraper: 'module:QualName'"""
+    cls = scraper.__class__
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def use_sku_registry(path: str):
+    """Initializer của process con: cấp SKU qua cùng file registry với process chính"""
+    if path != ':memory:':
+        from sku_registry import SkuRegistry
+        BaseScraper.skus = SkuRegistry(path)
+
+
+def extract_payload(ref: str, url: str, body: bytes, encoding: Optional[str]) -> Tuple[tuple, float]:
+    """Chạy trong process con: parse + extract -> (tuple giá trị field của ProductData, số giây xử lý).
+
+    Tuple theo thứ tự field (không có tên key) -> pickle nhỏ và nhanh; bên gọi dựng lại bằng ProductData(*payload).
+    """
+    started = time.monotonic()
+    scraper = _PROCESS_SCRAPERS.get(ref)
+    if scraper is None:
+        import importlib
+        module_name, _, qualname = ref.partition(':')
+        obj = importlib.import_module(module_name)
+        for part in qualname.split('.'):
+            obj = getattr(obj, part)
+        scraper = _PROCESS_SCRAPERS[ref] = obj()
+    product = scraper.extract(url, scraper.parse_html(body, encoding))
+    return tuple(getattr(product, f.name) for f in fields(ProductData)), time.monotonic() - started
+
+
+# Archive + manager dùng trong process con khi re-extract (mỗi process mở 1 lần)
+_PROCESS_ARCHIVES: Dict[str, 'PageArchive'] = {}
+_PROCESS_MANAGER: Optional['ProductScraperManager'] = None
+
+
+def reextract_payload(archive_path: str, page_id: int) -> Tuple[str, tuple]:
+    """Chạy trong process con: đọc + giải nén trang từ archive, extract bằng scraper hiện tại -> (url, payload)"""
+    global _PROCESS_MANAGER
+    archive = _PROCESS_ARCHIVES.get(archive_path)
+    if archive is None:
+        from page_archive import PageArchive
+        archive = _PROCESS_ARCHIVES[archive_path] = PageArchive(archive_path)
+    if _PROCESS_MANAGER is None:
+        _PROCESS_MANAGER = ProductScraperManager()
+    page = archive.page(page_id)
+    scraper = _PROCESS_MANAGER.scraper_for(page['url'])
+    api = scraper.api_client() if page['headers'].get(API_ARCHIVE_HEADER) else None
+    if api is not None:
+        product = api.build(page['url'], json.loads(page['body'].decode(page['encoding'] or 'utf-8')))
+    else:
+        product = scraper.extract(page['url'], scraper.parse_html(page['body'], page['encoding']))
+    return page['url'], tuple(getattr(product, f.name) for f in fields(ProductData))
+
+
+def iter_reextract(archive_path: str, processes: int = 0, site: Optional[str] = None) -> Iterator[ScrapeResult]:
+    """Chạy scraper hiện tại trên bản fetch mới nhất của mỗi URL trong archive (không dùng mạng).
+
+    Song song bằng process pool (mặc định = số core); đọc/giải nén trang cũng nằm trong process con.
+    """
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from page_archive import PageArchive
+    processes = processes or os.cpu_count() or 1
+    pages = PageArchive(archive_path).latest_pages(site)
+    max_in_flight = processes * 4
+    pending: Dict[Any, Tuple[str, float]] = {}
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=use_sku_registry, initargs=(getattr(BaseScraper.skus, 'path', ':memory:'),)) as pool:
+        def submit_next() -> bool:
+            for page_id, url in pages:
+                pending[pool.submit(reextract_payload, archive_path, page_id)] = (url, time.monotonic())
+                return True
+            return False
+
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, started = pending.pop(future)
+                try:
+                    _, payload = future.result()
+                    yield ScrapeResult(url, product=ProductData(*payload), elapsed=time.monotonic() - started)
+                except Exception as e:
+                    yield ScrapeResult(url, error=e, elapsed=time.monotonic() - started)
+                submit_next()
+
+
+# ============================================================
+# Pipeline: fetch (I/O) -> parse/extract (CPU) -> export sink, nối bằng queue có giới hạn
+# ============================================================
+
+_STAGE_DONE = object()  # Sentinel báo hết dữ liệu giữa các stage
+
+
+@dataclass
+class StageStats:
+    """Metrics của 1 stage: số item, thời gian bận, thời gian chờ queue"""
+    name: str
+    workers: int
+    items: int = 0
+    busy: float = 0.0          # Tổng thời gian xử lý (giây, cộng dồn các worker)
+    blocked: float = 0.0       # Thời gian chờ đẩy vào queue sau đã đầy (backpressure)
+    started: float = 0.0
+    finished: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, busy: float = 0.0, blocked: float = 0.0, items: int = 0):
+        with self._lock:
+            self.busy += busy
+            self.blocked += blocked
+            self.items += items
+
+    def utilization(self) -> float:
+        """Tỉ lệ thời gian các worker bận xử lý (0..1)"""
+        wall = (self.finished or time.monotonic()) - self.started
+        return self.busy / (wall * self.workers) if wall > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'stage': self.name, 'workers': self.workers, 'items': self.items,
+                'busy_s': round(self.busy, 2), 'blocked_s': round(self.blocked, 2),
+                'utilization': round(self.utilization(), 3)}
+
+
+class ScrapePipeline:
+    """Pipeline 3 stage: fetch workers (thread, I/O) -> parse/extract workers -> export sink (caller).
+
+    Các stage nối bằng queue giới hạn kích thước: stage sau chậm thì stage trước bị chặn (backpressure),
+    mỗi stage có thể chỉnh số worker độc lập.
+    """
+
+    def __init__(self, manager: Optional[ProductScraperManager] = None, fetch_workers: int = 8,
+                 parse_workers: int = 2, queue_size: int = 32, parse_processes: int = 0,
+                 canonicalizer: Optional[UrlCanonicalizer] = None, archive: Optional['PageArchive'] = None):
+        self.manager = manager or ProductScraperManager()
+        # Có archive: lưu body + headers mọi trang đã fetch (để --reextract sau này không cần mạng)
+        self.archive = archive
+        # Có canonicalizer: bỏ qua URL trùng sản phẩm (theo rel=canonical học được khi fetch)
+        self.canonicalizer = canonicalizer
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = max(1, parse_workers)
+        self.queue_size = max(1, queue_size)
+        # > 0: parse/extract chạy trong process pool (vượt GIL, dùng hết các core)
+        self.parse_processes = max(0, parse_processes)
+        self.stats: Dict[str, StageStats] = {}
+
+    def run(self, urls: Iterable[str]) -> Iterator[ScrapeResult]:
+        """Chạy pipeline, yield ScrapeResult khi xong - vòng lặp của caller chính là export sink"""
+        import queue
+        fetch_q = queue.Queue(self.queue_size)
+        parse_q = queue.Queue(self.queue_size)
+        out_q = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        pool = None
+        parse_threads = self.parse_workers
+        if self.parse_processes:
+            # Spawn (không fork khi đã có thread đang chạy); thread parse chỉ còn là dispatcher
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=self.parse_processes,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=use_sku_registry, initargs=(getattr(BaseScraper.skus, 'path', ':memory:'),))
+            parse_threads = self.parse_processes * 2  # Giữ mỗi process luôn có việc
+        self.stats = {
+            'fetch': StageStats('fetch', self.fetch_workers),
+            'parse': StageStats('parse', self.parse_processes or self.parse_workers),
+            'export': StageStats('export', 1),
+        }
+        for st in self.stats.values():
+            st.started = time.monotonic()
+        remaining = {'fetch': self.fetch_workers, 'parse': parse_threads}
+        remaining_lock = threading.Lock()
+
+        def put(q, item, stage: Optional[StageStats] = None) -> bool:
+            """Đẩy vào queue, chờ nếu đầy; False nếu pipeline bị dừng"""
+            started = time.monotonic()
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    if stage:
+                        stage.add(blocked=time.monotonic() - started)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            """Lấy từ queue; _STAGE_DONE nếu pipeline bị dừng"""
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _STAGE_DONE
+
+        def stage_done(name: str, next_q, count: int):
+            """Worker cuối cùng của stage báo hết dữ liệu cho stage sau"""
+            with remaining_lock:
+                remaining[name] -= 1
+                last = remaining[name] == 0
+            if last:
+                self.stats[name].finished = time.monotonic()
+                for _ in range(count):
+                    put(next_q, _STAGE_DONE)
+
+        def feeder():
+            try:
+                for url in urls:
+                    if not put(fetch_q, url):
+                        return
+            finally:
+                for _ in range(self.fetch_workers):
+                    put(fetch_q, _STAGE_DONE)
+
+        def fetch_worker():
+            stage = self.stats['fetch']
+            while True:
+                url = get(fetch_q)
+                if url is _STAGE_DONE:
+                    break
+                started = time.monotonic()
+                canonicalizer = self.canonicalizer
+                api_learned = False
+                try:
+                    # Sản phẩm đã cào qua URL khác (rel=canonical đã học) -> không fetch lại
+                    duplicate = canonicalizer and canonicalizer.duplicate_of(url)
+                    if duplicate:
+                        raise DuplicateUrlError(url, duplicate)
+                    scraper = self.manager.scraper_for(url)
+                    # API-first: có dữ liệu JSON (đủ field bắt buộc) thì bỏ qua fetch HTML + parse
+                    found = scraper.api_lookup(url) if self.manager.api_first else None
+                    if found is not None:
+                        product, data = found
+                        if self.archive is not None:
+                            # Lưu JSON gốc -> --reextract dựng lại sản phẩm bằng adapter.build()
+                            self.archive.put(url, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'utf-8',
+                                             {'Content-Type': 'application/json',
+                                              API_ARCHIVE_HEADER: scraper.api.__class__.__name__})
+                        duplicate = canonicalizer and canonicalizer.learn(url, b'')
+                        if duplicate:
+                            raise DuplicateUrlError(url, duplicate)
+                        api_learned = bool(canonicalizer)
+                        self.manager.costs.record('api', time.monotonic() - started)
+                        product = self.manager.complete(scraper, url, product)
+                        if self.manager.expand_variants:
+                            product = scraper.expand_variants(product)
+                        item = ScrapeResult(url, product=product, elapsed=time.monotonic() - started)
+                    else:
+                        if self.manager.use_selenium and BaseScraper.renderer is None:
+                            with scraper.driver_lock:
+                                body, encoding, headers = scraper.fetch_raw(url)
+                        else:
+                            body, encoding, headers = scraper.fetch_raw(url)
+                        if self.archive is not None:
+                            self.archive.put(url, body, encoding, headers)
+                        # Học rel=canonical ngay sau fetch: trùng thì bỏ qua parse/extract
+                        duplicate = canonicalizer and canonicalizer.learn(url, body, encoding)
+                        if duplicate:
+                            raise DuplicateUrlError(url, duplicate)
+                        item = (url, scraper, body, encoding, started)
+                except Exception as e:
+                    item = ScrapeResult(url, error=e, elapsed=time.monotonic() - started)
+                if api_learned:
+                    canonicalizer.finished(url, item.ok)
+                stage.add(busy=time.monotonic() - started, items=1)
+                if not put(parse_q if isinstance(item, tuple) else out_q, item, stage):
+                    break
+            stage_done('fetch', parse_q, parse_threads)
+
+        def parse_worker():
+            stage = self.stats['parse']
+            while True:
+                item = get(parse_q)
+                if item is _STAGE_DONE:
+                    break
+                url, scraper, body, encoding, fetch_started = item
+                started = time.monotonic()
+                busy = None
+                try:
+                    if pool is not None:
+                        payload, busy = pool.submit(extract_payload, scraper_ref(scraper), url, body, encoding).result()
+                        product = ProductData(*payload)
+                    else:
+                        product = scraper.extract(url, scraper.parse_html(body, encoding))
+                    path = 'browser' if self.manager.use_selenium else 'static'
+                    self.manager.costs.record(path, time.monotonic() - fetch_started)
+                    product = self.manager.complete(scraper, url, product)
+                    if self.manager.expand_variants:
+                        product = scraper.expand_variants(product)
+                    result = ScrapeResult(url, product=product, elapsed=time.monotonic() - fetch_started)
+                except Exception as e:
+                    result = ScrapeResult(url, error=e, elapsed=time.monotonic() - fetch_started)
+                if self.canonicalizer:
+                    self.canonicalizer.finished(url, result.ok)
+                # Process pool: tính thời gian xử lý thật trong process con, không tính thời gian chờ
+                stage.add(busy=time.monotonic() - started if busy is None else busy, items=1)
+                if not put(out_q, result, stage):
+                    break
+            stage_done('parse', out_q, 1)
+
+        threads = [threading.Thread(target=feeder, name='pipeline-feed', daemon=True)]
+        threads += [threading.Thread(target=fetch_worker, name=f'pipeline-fetch-{i}', daemon=True)
+                    for i in range(self.fetch_workers)]
+        threads += [threading.Thread(target=parse_worker, name=f'pipeline-parse-{i}', daemon=True)
+                    for i in range(parse_threads)]
+        for t in threads:
+            t.start()
+
+        export = self.stats['export']
+        try:
+            while True:
+                item = out_q.get()
+                if item is _STAGE_DONE:
+                    break
+                started = time.monotonic()
+                yield item  # Caller xử lý (ghi store, export...) = thời gian bận của export sink
+                export.add(busy=time.monotonic() - started, items=1)
+        finally:
+            export.finished = time.monotonic()
+            stop.set()
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats_report(self) -> List[Dict[str, Any]]:
+        return [st.as_dict() for st in self.stats.values()]
 
 
 class ExcelExporter:
     """Export dữ liệu sản phẩm ra Excel"""
 
+    PRODUCT_HEADERS = [
+        'name', 'sku_prefix', 'slug', 'brand_name', 'category_name',
+        'base_price', 'short_description', 'description', 'is_featured',
+        'status', 'meta_title', 'meta_description', 'tags'
+    ]
+    # Khớp với ProductImportService
+    VARIANT_HEADERS = [
+        'product_sku_prefix', 'sku', 'option_1_type', 'option_1_value',
+        'option_2_type', 'option_2_value', 'option_2_color_code',
+        'option_3_type', 'option_3_value',
+        'price', 'compare_at_price', 'cost_price', 'stock_quantity', 'is_default', 'image_url', 'in_stock'
+    ]
+    ATTRIBUTE_HEADERS = ['product_sku_prefix', 'attribute_name', 'value', 'display_group', 'display_order']
+    MEDIA_HEADERS = ['product_sku_prefix', 'type', 'url', 'alt_text', 'display_order', 'is_primary']
+
     def __init__(self):
+        from openpyxl import Workbook
+        from openpyxl.styles import Alignment, Font, PatternFill
         self.wb = Workbook()
         self.header_font = Font(bold=True, color="FFFFFF")
         self.header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         self.header_align = Alignment(horizontal="center", vertical="center")
 
-    def export(self, products: List[ProductData], output_path: str):
-        """Export danh sách sản phẩm ra file Excel"""
-
-        # Products sheet
-        ws_products = self.wb.active
-        ws_products.title = "Products"
-        self._create_products_sheet(ws_products, products)
-
-        # Variants sheet
-        ws_variants = self.wb.create_sheet("Variants")
-        self._create_variants_sheet(ws_variants, products)
-
-        # Attributes sheet
-        ws_attributes = self.wb.create_sheet("Attributes")
-        self._create_attributes_sheet(ws_attributes, products)
+    @classmethod
+    def sheet_rows(cls, products: List[ProductData]) -> Dict[str, Tuple[List[str], List[list]]]:
+        """Tên sheet -> (headers, các dòng giá trị) của 4 sheet import; dùng chung cho export đầy đủ và export thay đổi"""
+        return {
+            'Products': (cls.PRODUCT_HEADERS, cls._product_rows(products)),
+            'Variants': (cls.VARIANT_HEADERS, cls._variant_rows(products)),
+            'Attributes': (cls.ATTRIBUTE_HEADERS, cls._attribute_rows(products)),
+            'Media': (cls.MEDIA_HEADERS, cls._media_rows(products)),
+        }
 
-        # Media sheet
-        ws_media = self.wb.create_sheet("Media")
-        self._create_media_sheet(ws_media, products)
+    def export(self, products: List[ProductData], output_path: str,
+               extra_sheets: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        """Export danh sách sản phẩm ra file Excel (extra_sheets: tên sheet -> các dòng dict, vd: kết quả --match)"""
+        self.write(self.sheet_rows(products), output_path, extra_sheets)
+
+    def write(self, sheets: Dict[str, Tuple[List[str], List[list]]], output_path: str,
+              extra_sheets: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        """Ghi các sheet (headers, rows) theo thứ tự, sheet đầu tiên dùng worksheet mặc định"""
+        for i, (title, (headers, rows)) in enumerate(sheets.items()):
+            if i == 0:
+                ws = self.wb.active
+                ws.title = title
+            else:
+                ws = self.wb.create_sheet(title)
+            self._set_header(ws, headers)
+            for row, values in enumerate(rows, 2):
+                for col, value in enumerate(values, 1):
+                    ws.cell(row=row, column=col, value=value)
+            if title == 'Products':
+                # Auto-fit columns
+                for col in ws.columns:
+                    max_length = max(len(str(cell.value or "")) for cell in col)
+                    ws.column_dimensions[col[0].column_letter].width = min(max_length + 2, 50)
+
+        for title, rows in (extra_sheets or {}).items():
+            self._create_rows_sheet(self.wb.create_sheet(title), rows)
 
         # Save
         self.wb.save(output_path)
@@ -895,95 +2753,150 @@ class ExcelExporter:
             cell.fill = self.header_fill
             cell.alignment = self.header_align
 
-    def _create_products_sheet(self, ws, products: List[ProductData]):
-        """Tạo sheet Products"""
-        headers = [
-            'name', 'sku_prefix', 'slug', 'brand_name', 'category_name',
-            'base_price', 'short_description', 'description', 'is_featured',
-            'status', 'meta_title', 'meta_description', 'tags'
-        ]
-        self._set_header(ws, headers)
+    @staticmethod
+    def _product_rows(products: List[ProductData]) -> List[list]:
+        """Dòng sheet Products"""
+        return [[
+            p.name, p.sku_prefix, p.slug, p.brand_name, p.category_name, p.base_price, p.short_description,
+            p.description[:32000] if p.description else "",  # Excel limit
+            p.is_featured, p.status, p.meta_title or p.name, p.meta_description or p.short_description, p.tags
+        ] for p in products]
+
+    @staticmethod
+    def _variant_rows(products: List[ProductData]) -> List[list]:
+        """Dòng sheet Variants"""
+        return [[
+            p.sku_prefix, v.get('sku', ''), v.get('option_1_type', ''), v.get('option_1_value', ''),
+            v.get('option_2_type', ''), v.get('option_2_value', ''), v.get('option_2_color_code', ''),
+            v.get('option_3_type', ''), v.get('option_3_value', ''), v.get('price', 0),
+            v.get('compare_at_price') or p.compare_at_price or None, v.get('cost_price') or None,
+            ExcelExporter._stock_quantity(v), v.get('is_default', False), v.get('image_url', ''), v.get('in_stock')
+        ] for p in products for v in p.variants]
+
+    @staticmethod
+    def _stock_quantity(variant: Dict[str, Any]) -> Any:
+        """Số lượng tồn: có số thật thì dùng, hết hàng -> 0, còn hàng nhưng không rõ số lượng -> để trống"""
+        if 'stock_quantity' in variant:
+            return variant['stock_quantity']
+        if 'in_stock' in variant:
+            return None if variant['in_stock'] else 0
+        return 0
 
-        for row, p in enumerate(products, 2):
-            ws.cell(row=row, column=1, value=p.name)
-            ws.cell(row=row, column=2, value=p.sku_prefix)
-            ws.cell(row=row, column=3, value=p.slug)
-            ws.cell(row=row, column=4, value=p.brand_name)
-            ws.cell(row=row, column=5, value=p.category_name)
-            ws.cell(row=row, column=6, value=p.base_price)
-            ws.cell(row=row, column=7, value=p.short_description)
-            ws.cell(row=row, column=8, value=p.description[:32000] if p.description else "")  # Excel limit
-            ws.cell(row=row, column=9, value=p.is_featured)
-            ws.cell(row=row, column=10, value=p.status)
-            ws.cell(row=row, column=11, value=p.meta_title or p.name)
-            ws.cell(row=row, column=12, value=p.meta_description or p.short_description)
-            ws.cell(row=row, column=13, value=p.tags)
-
-        # Auto-fit columns
-        for col in ws.columns:
-            max_length = max(len(str(cell.value or "")) for cell in col)
-            ws.column_dimensions[col[0].column_letter].width = min(max_length + 2, 50)
-
-    def _create_variants_sheet(self, ws, products: List[ProductData]):
-        """Tạo sheet Variants - khớp với ProductImportService"""
-        headers = [
-            'product_sku_prefix', 'sku', 'option_1_type', 'option_1_value',
-            'option_2_type', 'option_2_value', 'option_2_color_code',
-            'option_3_type', 'option_3_value',
-            'price', 'compare_at_price', 'cost_price', 'stock_quantity', 'is_default', 'image_url'
-        ]
+    @staticmethod
+    def _attribute_rows(products: List[ProductData]) -> List[list]:
+        """Dòng sheet Attributes"""
+        return [[
+            p.sku_prefix, attr.get('attribute_name', ''), attr.get('value', ''),
+            attr.get('display_group', 'Thông tin chung'), attr.get('display_order', 0)
+        ] for p in products for attr in p.attributes]
+
+    @staticmethod
+    def _media_rows(products: List[ProductData]) -> List[list]:
+        """Dòng sheet Media"""
+        return [[p.sku_prefix, 'image', img_url, p.name, i + 1, i == 0]  # First image is primary
+                for p in products for i, img_url in enumerate(p.images)]
+
+    def _create_rows_sheet(self, ws, rows: List[Dict[str, Any]]):
+        """Sheet từ list dict (header = key của dòng đầu)"""
+        if not rows:
+            return
+        headers = list(rows[0])
         self._set_header(ws, headers)
+        for row, data in enumerate(rows, 2):
+            for col, key in enumerate(headers, 1):
+                ws.cell(row=row, column=col, value=data.get(key))
+
+
+def host_stats() -> Dict[str, Dict[str, Any]]:
+    """Latency p50/p95/p99, timeout, trạng thái breaker, concurrency và rate theo host"""
+    latency = BaseScraper.latency.snapshot()
+    breakers = BaseScraper.circuit_breakers.snapshot()
+    concurrency = BaseScraper.concurrency.snapshot()
+    rates = BaseScraper.scheduler.snapshot()
+    stats = {}
+    for host, st in latency.items():
+        stats[host] = dict(st)
+        stats[host]['circuit'] = breakers.get(host, {}).get('state', 'closed')
+        stats[host]['concurrency'] = concurrency.get(host, {}).get('limit')
+        stats[host]['rate'] = rates.get(host)
+    return stats
+
+
+def print_host_stats():
+    """In latency p50/p95/p99 + timeout + trạng thái breaker + concurrency theo host"""
+    stats = host_stats()
+    if not stats:
+        return
+    print(f"\nHost stats:")
+    for host, st in sorted(stats.items()):
+        print(f"  - {host}: n={st['count']} p50={st['p50']:.2f}s p95={st['p95']:.2f}s p99={st['p99']:.2f}s "
+              f"timeout=({st['connect_timeout']:.1f}s, {st['read_timeout']:.1f}s) circuit={st['circuit']} "
+              f"concurrency={st['concurrency'] or '-'}")
+
+
+def iter_url_source(paths: Iterable[str]) -> Iterator[str]:
+    """Đọc URL lazy từ các file (mỗi dòng 1 URL, bỏ dòng trống/#); hỗ trợ .gz và '-' = stdin"""
+    import gzip
+    for path in paths:
+        if path == '-':
+            f = sys.stdin
+        elif path.endswith('.gz'):
+            f = gzip.open(path, 'rt', encoding='utf-8')
+        else:
+            f = open(path, 'r', encoding='utf-8')
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def reextract_main(args):
+    """--reextract: extract lại toàn bộ archive bằng scraper hiện tại rồi export Excel"""
+    if not os.path.exists(args.archive):
+        print(f"✗ Không tìm thấy archive: {args.archive}")
+        sys.exit(1)
+    if not args.output:
+        args.output = f"products_reextract_{datetime.now().strftime('%y%m%d_%H%M%S')}.xlsx"
+    started = time.monotonic()
+    products = []
+    failed = 0
+    try:
+        for result in iter_reextract(args.archive, args.parse_processes, args.reextract_site):
+            if result.ok:
+                products.append(result.product)
+                if args.verbose:
+                    print(f"✓ {result.url}: {result.product.name}")
+            else:
+                failed += 1
+                print(f"✗ {result.url}: {result.error}")
+    except KeyboardInterrupt:
+        print(f"\n⚠️  Đã dừng - export các sản phẩm đã extract xong...")
+    print(f"\nRe-extract: {len(products)} sản phẩm, {failed} lỗi trong {time.monotonic() - started:.1f}s")
+    if not products:
+        sys.exit(1)
+    ExcelExporter().export(products, args.output,
+                           match_sheets(products, args.match_threshold) if args.match else None)
 
-        row = 2
-        for p in products:
-            for v in p.variants:
-                ws.cell(row=row, column=1, value=p.sku_prefix)
-                ws.cell(row=row, column=2, value=v.get('sku', ''))
-                ws.cell(row=row, column=3, value=v.get('option_1_type', ''))
-                ws.cell(row=row, column=4, value=v.get('option_1_value', ''))
-                ws.cell(row=row, column=5, value=v.get('option_2_type', ''))
-                ws.cell(row=row, column=6, value=v.get('option_2_value', ''))
-                ws.cell(row=row, column=7, value=v.get('option_2_color_code', ''))
-                ws.cell(row=row, column=8, value=v.get('option_3_type', ''))
-                ws.cell(row=row, column=9, value=v.get('option_3_value', ''))
-                ws.cell(row=row, column=10, value=v.get('price', 0))
-                ws.cell(row=row, column=11, value=v.get('compare_at_price') or p.compare_at_price or None)
-                ws.cell(row=row, column=12, value=v.get('cost_price') or None)
-                ws.cell(row=row, column=13, value=v.get('stock_quantity', 0))
-                ws.cell(row=row, column=14, value=v.get('is_default', False))
-                ws.cell(row=row, column=15, value=v.get('image_url', ''))
-                row += 1
-
-    def _create_attributes_sheet(self, ws, products: List[ProductData]):
-        """Tạo sheet Attributes"""
-        headers = ['product_sku_prefix', 'attribute_name', 'value', 'display_group', 'display_order']
-        self._set_header(ws, headers)
 
-        row = 2
-        for p in products:
-            for attr in p.attributes:
-                ws.cell(row=row, column=1, value=p.sku_prefix)
-                ws.cell(row=row, column=2, value=attr.get('attribute_name', ''))
-                ws.cell(row=row, column=3, value=attr.get('value', ''))
-                ws.cell(row=row, column=4, value=attr.get('display_group', 'Thông tin chung'))
-                ws.cell(row=row, column=5, value=attr.get('display_order', 0))
-                row += 1
-
-    def _create_media_sheet(self, ws, products: List[ProductData]):
-        """Tạo sheet Media"""
-        headers = ['product_sku_prefix', 'type', 'url', 'alt_text', 'display_order', 'is_primary']
-        self._set_header(ws, headers)
+def match_sheets(products: List[ProductData], threshold: float) -> Dict[str, List[Dict[str, Any]]]:
+    """--match: ghép sản phẩm trùng giữa các nhà bán lẻ -> sheet Matches + PriceComparison"""
+    from product_matching import ProductMatcher, merge_table, price_comparison
+    started = time.monotonic()
+    matcher = ProductMatcher(threshold=threshold)
+    groups = matcher.match(products)
+    st = matcher.stats
+    print(f"\n✓ Match: {st['groups']} nhóm / {sum(len(g.members) for g in groups)} sản phẩm trùng giữa các nhà bán lẻ "
+          f"({st['candidates']} cặp ứng viên LSH, {st['conflicts']} lần từ chối gộp nhóm xung đột, "
+          f"{time.monotonic() - started:.1f}s)")
+    return {'Matches': merge_table(products, groups), 'PriceComparison': price_comparison(products, groups)}
+
 
-        row = 2
-        for p in products:
-            for i, img_url in enumerate(p.images):
-                ws.cell(row=row, column=1, value=p.sku_prefix)
-                ws.cell(row=row, column=2, value='image')
-                ws.cell(row=row, column=3, value=img_url)
-                ws.cell(row=row, column=4, value=p.name)
-                ws.cell(row=row, column=5, value=i + 1)
-                ws.cell(row=row, column=6, value=i == 0)  # First image is primary
-                row += 1
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
 
 def main():
@@ -1005,47 +2918,251 @@ Hỗ trợ các trang:
         """
     )
     parser.add_argument('urls', nargs='*', help='URL sản phẩm cần cào')
-    parser.add_argument('-f', '--file', help='File chứa danh sách URL (mỗi dòng 1 URL)')
+    parser.add_argument('-f', '--file', action='append',
+                        help='File chứa danh sách URL (mỗi dòng 1 URL, hỗ trợ .gz, "-" = stdin); dùng nhiều lần được')
+    parser.add_argument('--discover', action='append', metavar='SEED',
+                        help='Tìm URL sản phẩm từ trang danh mục hoặc sitemap (.xml/.xml.gz) rồi cào luôn; dùng nhiều lần được')
+    parser.add_argument('--discover-max-pages', type=int, default=200,
+                        help='Số trang listing tối đa mỗi seed khi --discover (default: %(default)s)')
+    parser.add_argument('--archive', default='page_archive.db',
+                        help='SQLite lưu trang thô đã fetch (nén, content-addressed) - BẬT MẶC ĐỊNH, mọi trang HTML '
+                             'đều được ghi vào file này (default: %(default)s)')
+    parser.add_argument('--no-archive', action='store_true', help='Không lưu trang thô (tắt archive mặc định)')
+    parser.add_argument('--history', default='price_history.db',
+                        help='SQLite lịch sử giá/tồn kho theo SKU, chỉ ghi thay đổi (default: %(default)s)')
+    parser.add_argument('--no-history', action='store_true', help='Không ghi lịch sử giá')
+    parser.add_argument('--reextract', action='store_true',
+                        help='Không fetch: chạy lại scraper hiện tại trên các trang trong --archive (song song theo core)')
+    parser.add_argument('--reextract-site', metavar='SITE', help='Khi --reextract: chỉ các trang của site (vd: dienmayxanh.com)')
+    parser.add_argument('--no-api', action='store_true',
+                        help='Không dùng JSON API của site (Cellphones, FPT Shop), luôn cào HTML')
+    parser.add_argument('--expand-variants', action='store_true',
+                        help='DMX/TGDD: fetch song song trang riêng của từng variant để lấy giá/ảnh/tồn kho thật')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Chỉ export dòng thêm mới/thay đổi/bị xóa so với lần export trước (sheet Removed + Summary)')
+    parser.add_argument('--snapshot', default='export_snapshot.db',
+                        help='SQLite snapshot lần export trước, dùng với --changes-only (default: %(default)s)')
+    parser.add_argument('--full-catalog', action='store_true',
+                        help='Với --changes-only: input là toàn bộ catalog -> sản phẩm không còn trong lần chạy này '
+                             'cũng bị xóa (mặc định chỉ xóa sản phẩm có URL trả 404/410)')
+    parser.add_argument('--match', action='store_true',
+                        help='Ghép sản phẩm trùng giữa các nhà bán lẻ (MinHash/LSH), thêm sheet Matches + PriceComparison')
+    parser.add_argument('--match-threshold', type=float, default=0.6,
+                        help='Độ giống (Jaccard) tối thiểu để ghép khi --match (default: %(default)s)')
+    parser.add_argument('--images', metavar='DIR',
+                        help='Tải ảnh sản phẩm về cache local DIR (song song, khử trùng, có thumbnail) trước khi export')
+    parser.add_argument('--image-workers', type=int, default=8,
+                        help='Số ảnh tải song song khi --images (default: %(default)s)')
     parser.add_argument('-o', '--output', default=None, help='File Excel output (default: products_YYMMDD_HHMMSS.xlsx)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Hiển thị chi tiết')
     parser.add_argument('--selenium', '-s', action='store_true',
                         help='Dùng Selenium để cào trang có JavaScript (cần cài: pip install selenium)')
+    parser.add_argument('--browser', choices=('selenium', 'cdp'), default='selenium',
+                        help='Backend render JS cho --selenium/--hybrid: selenium, hoặc cdp = 1 Chromium nhiều tab '
+                             'song song qua DevTools protocol (default: %(default)s)')
+    parser.add_argument('--tabs', type=int, default=8, help='Số tab song song mỗi Chromium khi --browser cdp (default: %(default)s)')
+    parser.add_argument('--browsers', type=int, default=1, help='Số process Chromium khi --browser cdp (default: %(default)s)')
+    parser.add_argument('--hybrid', action='store_true',
+                        help='Cào HTML tĩnh trước, chỉ render bằng Selenium các trang thiếu dữ liệu bắt buộc')
+    parser.add_argument('--rate', type=positive_float, default=2.0,
+                        help='Số request/giây tối đa cho mỗi host (default: %(default)s)')
+    parser.add_argument('--ignore-robots', action='store_true',
+                        help='Bỏ qua Crawl-delay trong robots.txt')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Số URL cào song song; --browser cdp: tối thiểu browsers x tabs (default: %(default)s)')
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help='Số worker parse/trích xuất HTML (default: %(default)s)')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='Số process parse/trích xuất song song, 0 = dùng thread (default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help='Kích thước queue giữa các stage fetch/parse/export (default: %(default)s)')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                        help='Số request đồng thời tối đa cho mỗi host, tự điều chỉnh AIMD (default: %(default)s)')
+    parser.add_argument('--job-db', default='scrape_jobs.db',
+                        help='SQLite lưu checkpoint của job (default: %(default)s)')
+    parser.add_argument('--sku-db', default='sku_registry.db',
+                        help='SQLite registry SKU - giữ SKU ổn định giữa các lần cào (default: %(default)s)')
+    parser.add_argument('--resume', metavar='JOB', help='Tiếp tục job đã dừng (chỉ cào các URL chưa xong)')
+    parser.add_argument('--retry-failed', action='store_true', help='Khi --resume: cào lại cả các URL đã lỗi')
+    parser.add_argument('--timeout-floor', type=float, default=TimeoutSettings.read_floor,
+                        help='Read timeout tối thiểu theo host (giây, default: %(default)s)')
+    parser.add_argument('--timeout-ceiling', type=float, default=TimeoutSettings.read_ceiling,
+                        help='Read timeout tối đa theo host (giây, default: %(default)s)')
 
     args = parser.parse_args()
+    check_dependencies()
+    from sku_registry import SkuRegistry
+    BaseScraper.skus = SkuRegistry(args.sku_db)
 
-    # Load URLs from file if provided
-    if args.file:
-        with open(args.file, 'r', encoding='utf-8') as f:
-            file_urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-            args.urls = args.urls + file_urls if args.urls else file_urls
+    if args.reextract:
+        return reextract_main(args)
 
-    if not args.urls:
-        parser.error('Cần ít nhất 1 URL hoặc file chứa URL (-f)')
+    if not args.urls and not args.file and not args.discover and not args.resume:
+        parser.error('Cần ít nhất 1 URL, file chứa URL (-f) hoặc trang để tìm URL (--discover)')
 
     # Check Selenium availability
-    if args.selenium and not SELENIUM_AVAILABLE:
+    if args.hybrid and args.selenium:
+        print("  (--hybrid: bỏ qua --selenium, chỉ render browser khi HTML tĩnh thiếu dữ liệu)")
+        args.selenium = False
+    if args.browser == 'cdp' and (args.selenium or args.hybrid):
+        from cdp_browser import CDPRenderer, find_chrome
+        if find_chrome():
+            BaseScraper.renderer = CDPRenderer(browsers=args.browsers, tabs=args.tabs,
+                                               wait_selector='.owl-dots, .gallery, .slider-product')
+        else:
+            print("⚠️  --browser cdp: không tìm thấy Chromium/Chrome (cài chromium hoặc đặt CHROME_PATH)")
+    if args.hybrid and not BaseScraper.browser_available():
+        print("⚠️  Selenium không khả dụng, --hybrid chỉ dùng HTML tĩnh. Cài đặt: pip install selenium")
+    if args.selenium and not BaseScraper.browser_available():
         print("⚠️  Selenium không khả dụng. Cài đặt: pip install selenium")
         print("   Và cần có ChromeDriver trong PATH")
         print("   Tiếp tục với requests...")
         args.selenium = False
 
-    # Default output filename
-    if not args.output:
-        timestamp = datetime.now().strftime('%y%m%d_%H%M%S')
-        args.output = f'products_{timestamp}.xlsx'
-
-    # Scrape
-    manager = ProductScraperManager(use_selenium=args.selenium)
-    products = []
-
-    for url in args.urls:
-        print(f"\n{'='*60}")
-        print(f"Scraping: {url}")
-        print('='*60)
+    # Adaptive timeout theo latency của từng host
+    BaseScraper.latency.settings.read_floor = args.timeout_floor
+    BaseScraper.latency.settings.read_ceiling = max(args.timeout_floor, args.timeout_ceiling)
+
+    # Rate limit theo host
+    BaseScraper.scheduler = HostRateScheduler(rate=args.rate, respect_robots=not args.ignore_robots)
+
+    # Concurrency theo host tự điều chỉnh (AIMD)
+    BaseScraper.concurrency = AIMDController(maximum=args.max_concurrency)
+    if args.selenium and BaseScraper.renderer is None and args.workers > 1:
+        print("  (Selenium: chạy tuần tự, mỗi scraper chỉ có 1 browser)")
+        args.workers = 1
+    if BaseScraper.renderer is not None and args.workers < args.browsers * args.tabs:
+        # Mỗi fetch worker chờ 1 tab render -> cần đủ worker để mọi tab cùng chạy
+        print(f"  (--browser cdp: {args.browsers * args.tabs} fetch worker = {args.browsers} browser x {args.tabs} tab)")
+        args.workers = args.browsers * args.tabs
+
+    # Job store: checkpoint từng URL vào SQLite, dừng giữa chừng thì --resume JOB
+    from job_store import Frontier, JobStore
+    store = JobStore(args.job_db)
+    if args.resume:
+        if args.urls or args.file or args.discover:
+            parser.error('--resume đọc lại nguồn URL đã lưu của job, không nhận thêm URL / -f / --discover')
+        job = store.get_job(args.resume)
+        if job is None:
+            parser.error(f'Không tìm thấy job {args.resume} trong {args.job_db}')
+        job_id = args.resume
+        args.output = args.output or job['output']
+        source_spec, source_offset, source_done = job['sources'], job['source_offset'], job['source_done']
+        if not source_done:
+            missing = [path for path in source_spec.get('files', []) if path != '-' and not os.path.isfile(path)]
+            if missing:
+                parser.error(f"Job {job_id} chưa đọc hết file nguồn nhưng không còn thấy: {', '.join(missing)}")
+            if '-' in source_spec.get('files', []):
+                print(f"⚠️  Job đọc URL từ stdin: cần pipe lại đúng input cũ, bỏ qua {source_offset} dòng đầu đã đọc")
+        store.requeue(job_id, include_failed=args.retry_failed)
+        store.set_status(job_id, 'running')
+    else:
+        # File không tồn tại -> báo lỗi ngay, không tạo job rỗng rồi 'completed' với 0 URL
+        missing = [path for path in args.file or [] if path != '-' and not os.path.isfile(path)]
+        if missing:
+            parser.error(f"Không tìm thấy file URL: {', '.join(missing)}")
+        # Default output filename
+        if not args.output:
+            timestamp = datetime.now().strftime('%y%m%d_%H%M%S')
+            args.output = f'products_{timestamp}.xlsx'
+        source_spec = {'urls': args.urls,
+                       'files': [path if path == '-' else os.path.abspath(path) for path in args.file or []],
+                       'discover': args.discover or [], 'discover_max_pages': args.discover_max_pages}
+        source_offset, source_done = 0, False
+        job_id = store.create_job((), output=args.output, sources=source_spec)
+    progress = store.progress(job_id)
+    if args.resume:
+        print(f"Job: {job_id} - {progress['done']}/{progress['total']} URL đã xong, còn {progress['pending']} URL")
+    else:
+        print(f"Job: {job_id}")
+    print(f"  (dừng giữa chừng? tiếp tục bằng: --resume {job_id})")
+
+    manager = ProductScraperManager(use_selenium=args.selenium, expand_variants=args.expand_variants,
+                                    api_first=not args.no_api, hybrid=args.hybrid, keep_browsers=True)
+    archive = None
+    if not args.no_archive:
+        from page_archive import PageArchive
+        archive = PageArchive(args.archive)
+        print(f"  (lưu trang thô vào {args.archive}; tắt bằng --no-archive)")
+
+    # URL từ command line + file (-f) + discovery được đọc lazy, nạp dần vào job store khi cào.
+    # Vị trí đọc (số URL command line + dòng file đã nạp) lưu trong job -> --resume bỏ qua phần đã đọc;
+    # discovery không có thứ tự cố định nên chạy lại cả seed (URL đã có trong job được bỏ qua)
+    import itertools
+    consumed = [source_offset]
+
+    def counted(items: Iterable[str]) -> Iterator[str]:
+        for item in items:
+            consumed[0] += 1
+            yield item
+
+    sources = []
+    if not source_done:
+        listed = itertools.chain(source_spec.get('urls', []), iter_url_source(source_spec.get('files', [])))
+        sources.append(counted(itertools.islice(listed, source_offset, None)))
+    # Key sản phẩm đã cào lưu trong job store (chính xác, bộ nhớ cố định dù hàng triệu URL, còn khi --resume)
+    from job_store import KeySet
+    BaseScraper.canonicalizer = UrlCanonicalizer(fetched=KeySet(store, job_id))
+    crawler = None
+    if source_spec.get('discover') and not source_done:
+        from discovery import DiscoveryCrawler
+
+        def discovery_fetch(url: str) -> Tuple[bytes, Optional[str]]:
+            # Trang listing/sitemap: luôn dùng requests (qua rate limit/retry/breaker của host)
+            response = manager.scraper_for(url).fetch_response(url)
+            return response.content, response.encoding
+
+        crawler = DiscoveryCrawler(discovery_fetch, BaseScraper.canonicalizer.canonicalize,
+                                   max_pages=source_spec.get('discover_max_pages', args.discover_max_pages))
+        sources.append(crawler.discover(source_spec['discover']))
+    # Chuẩn hóa URL; URL trùng (tracking param, '/' cuối, mirror TGDD/DMX...) bị bỏ khi nạp vào frontier
+    # bằng UNIQUE (job, key) trong job store -> chính xác, cả với URL đã nạp trước khi --resume
+    canonicalize = BaseScraper.canonicalizer.canonicalize
+    url_source = (canonicalize(url) for url in itertools.chain.from_iterable(sources))
+
+    frontier = Frontier(store, job_id, url_source, position=lambda: consumed[0],
+                        key=BaseScraper.canonicalizer.static_key)
+    pending_before = progress['pending']
+
+    # SIGTERM xử lý như Ctrl+C: dừng, export phần đã cào, giữ checkpoint để resume
+    import signal
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    # Scrape: pipeline fetch -> parse/extract -> export (vòng lặp dưới đây là export sink)
+    pipeline = ScrapePipeline(manager, fetch_workers=args.workers, parse_workers=args.parse_workers,
+                              queue_size=args.queue_size, parse_processes=args.parse_processes,
+                              canonicalizer=BaseScraper.canonicalizer, archive=archive)
+    interrupted = False
+
+    try:
+        for done, result in enumerate(pipeline.run(BaseScraper.scheduler.interleave(frontier)), 1):
+            url = result.url
+            host = urlparse(url).netloc.lower()
+            total = f"{pending_before + frontier.added}{'' if frontier.exhausted else '+'}"
+            print(f"\n{'='*60}")
+            print(f"[{done}/{total}] Scraped: {url} ({result.elapsed:.1f}s)")
+            print(f"  concurrency {host}: {BaseScraper.concurrency.level(host)}")
+            print('='*60)
+
+            if isinstance(result.error, DuplicateUrlError):
+                store.record_skipped(job_id, url, str(result.error))
+                print(f"↷ Bỏ qua: trùng sản phẩm {result.error.canonical}")
+                continue
+
+            if not result.ok:
+                error = f"{result.error.__class__.__name__}: {result.error}"
+                if getattr(getattr(result.error, 'response', None), 'status_code', None) in GONE_STATUS:
+                    store.record_gone(job_id, url, error)
+                else:
+                    store.record_failure(job_id, url, error)
+                print(f"✗ Error: {result.error}")
+                if args.verbose:
+                    import traceback
+                    traceback.print_exception(type(result.error), result.error, result.error.__traceback__)
+                continue
 
-        try:
-            product = manager.scrape(url)
-            products.append(product)
+            product = result.product
+            store.record_success(job_id, url, asdict(product))
 
             print(f"✓ Name: {product.name}")
             print(f"✓ Price: {product.base_price:,.0f}đ")
@@ -1061,31 +3178,106 @@ Hỗ trợ các trang:
                     print(f"  - {attr['attribute_name']}: {attr['value']}")
                 if len(product.attributes) > 5:
                     print(f"  ... và {len(product.attributes) - 5} thông số khác")
-
-        except Exception as e:
-            print(f"✗ Error: {e}")
-            if args.verbose:
-                import traceback
-                traceback.print_exc()
-
-    # Export
-    if products:
+    except KeyboardInterrupt:
+        interrupted = True
+        print(f"\n⚠️  Đã dừng - export các sản phẩm đã cào xong...")
+
+    # Chỉ 'completed' khi đã đọc hết nguồn URL; còn lại -> --resume đọc tiếp từ vị trí đã lưu
+    store.set_status(job_id, 'completed' if frontier.exhausted and not interrupted else 'interrupted')
+
+    costs = manager.costs.snapshot()
+    if args.hybrid or args.verbose:
+        print(f"\nChi phí theo đường lấy dữ liệu:")
+        for path, cost in sorted(costs.items()):
+            print(f"  - {path}: {cost['pages']} trang, {cost['seconds']}s ({cost['per_page']}s/trang)")
+
+    if crawler:
+        print(f"\nDiscovery: {crawler.stats['products']} URL sản phẩm từ {crawler.stats['pages']} trang listing, "
+              f"{crawler.stats['sitemaps']} sitemap ({crawler.stats['errors']} lỗi)")
+
+    dupes = BaseScraper.canonicalizer.snapshot()
+    dupes['input'] += frontier.read - frontier.added
+    if dupes['input'] or dupes['canonical']:
+        print(f"\nURL trùng đã bỏ qua: {dupes['input']} trong input, {dupes['canonical']} theo rel=canonical")
+
+    manager.close()
+    if BaseScraper.renderer is not None:
+        if args.verbose:
+            print(f"\nCDP browser: {BaseScraper.renderer.stats()}")
+        BaseScraper.renderer.close()
+
+    if args.verbose:
+        print_host_stats()
+        for name, st in manager.api_stats().items():
+            print(f"  - API {name}: hits={st['hits']} misses={st['misses']} errors={st['errors']} "
+                  f"requests={st['requests']}{' (tắt: ' + ', '.join(st['disabled']) + ')' if st['disabled'] else ''}")
+        print(f"\nPipeline stats:")
+        for st in pipeline.stats_report():
+            print(f"  - {st['stage']}: workers={st['workers']} items={st['items']} busy={st['busy_s']}s "
+                  f"blocked={st['blocked_s']}s utilization={st['utilization']:.0%}")
+        sku = BaseScraper.sku_registry().summary()
+        print(f"\nSKU registry: {sku['skus']} SKU - cấp mới {sku['allocated']}, dùng lại {sku['reused']}, "
+              f"trùng hash {sku['collisions']}")
+
+    # Export (gồm cả kết quả của các lần chạy trước nếu resume)
+    products = [ProductData(**data) for data in store.iter_results(job_id)]
+    gone = store.gone_urls(job_id) if args.changes_only else []
+    if products and not args.no_history:
+        # Chỉ SKU mới / đổi giá / đổi tình trạng còn hàng mới thêm dòng lịch sử
+        from price_history import PriceHistory
+        history = PriceHistory(args.history)
+        delta = history.record(products)
+        history.close()
+        print(f"\n✓ Lịch sử giá ({args.history}): {delta['observed']} SKU - mới {delta['new']}, "
+              f"thay đổi {delta['changed']}")
+    if products and args.images:
+        # Stage media: mỗi ảnh (bản lớn nhất) chỉ tải 1 lần cho cả catalog, URL trùng được gộp
+        from media_pipeline import ImageCache, MediaPipeline
+        print(f"\nĐang tải ảnh vào {args.images}...")
+        media = MediaPipeline(ImageCache(args.images), workers=args.image_workers).process(products)
+        print(f"✓ Ảnh: {media['urls']} URL - tải {media['downloaded']}, có sẵn {media['cached']}, "
+              f"trùng {media['duplicate_content'] + media['duplicate_perceptual']}, dùng URL gốc {media['fallback']}, "
+              f"lỗi {media['failed']}")
+    if products or gone:
         print(f"\n{'='*60}")
         print(f"Exporting {len(products)} products to Excel...")
         print('='*60)
 
         exporter = ExcelExporter()
-        exporter.export(products, args.output)
+        extra = match_sheets(products, args.match_threshold) if args.match else {}
+        if args.changes_only:
+            # Chỉ các dòng thêm/đổi/xóa so với snapshot lần export trước. Dòng bị xóa chỉ tính cho sản phẩm đã cào
+            # lần này (ảnh/variant bị bỏ) và URL trả 404/410; --full-catalog (chạy hết) -> mọi sản phẩm vắng mặt
+            from export_diff import ExportSnapshot, change_sheets
+            canonicalizer = BaseScraper.canonicalizer
+            snapshot = ExportSnapshot(args.snapshot)
+            scope = None
+            if not (args.full_catalog and not interrupted):
+                scope = {p.sku_prefix for p in products}
+                scope |= snapshot.prefixes(canonicalizer.static_key(u) for u in gone)
+            changes = snapshot.diff(ExcelExporter.sheet_rows(products), scope=scope)
+            sheets, diff_sheets = change_sheets(changes)
+            exporter.write(sheets, args.output, {**diff_sheets, **extra})
+            snapshot.apply(changes, {canonicalizer.static_key(p.source_url): p.sku_prefix for p in products})
+            snapshot.close()
+            for st in diff_sheets['Summary']:
+                print(f"  - {st['sheet']}: +{st['inserted']} ~{st['updated']} -{st['removed']} "
+                      f"(không đổi {st['unchanged']})")
+        else:
+            exporter.export(products, args.output, extra)
 
         print(f"\n✓ Successfully exported to: {args.output}")
         print(f"✓ Products: {len(products)}")
         print(f"✓ Total variants: {sum(len(p.variants) for p in products)}")
         print(f"✓ Total attributes: {sum(len(p.attributes) for p in products)}")
         print(f"✓ Total images: {sum(len(p.images) for p in products)}")
-    else:
+    elif not interrupted:
         print("\n✗ No products scraped successfully")
         sys.exit(1)
 
+    if interrupted:
+        print(f"\nTiếp tục job: python product_scraper.py --resume {job_id}")
+        sys.exit(130)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Product Scrape Service
+Daemon giữ ProductScraperManager, connection pool, browser và cache (robots.txt,
+latency, circuit breaker) luôn "nóng", cung cấp HTTP API local để cào theo yêu cầu.
+
+Endpoints:
+    GET  /health          -> trạng thái service, uptime, số request đã phục vụ
+    GET  /stats           -> thống kê theo host (latency, timeout, circuit, concurrency, rate)
+    POST /scrape          {"url": "..."}            -> ProductData dạng JSON
+    POST /scrape/batch    {"urls": ["...", ...]}    -> danh sách kết quả theo đúng thứ tự input
+
+Batch job (cho danh sách URL lớn - kết quả stream ra ngay khi từng URL xong):
+    POST   /jobs                   {"urls": [...]}  -> 202 {"job_id": ...}
+    GET    /jobs                   -> danh sách job
+    GET    /jobs/<id>              -> trạng thái + tiến độ
+    GET    /jobs/<id>/stream       -> NDJSON (mặc định) hoặc SSE (?format=sse / Accept: text/event-stream)
+    GET    /jobs/<id>/results.xlsx -> Excel các sản phẩm đã cào xong (kể cả khi job đang chạy)
+    GET    /jobs/<id>/results.ndjson
+    DELETE /jobs/<id>              -> hủy các URL chưa chạy
+
+Mỗi response JSON có "timing" (ms) và header Server-Timing.
+
+Usage:
+    python scrape_service.py [--host 127.0.0.1] [--port 8765] [--workers 8] [--selenium] [--sku-db sku_registry.db]
+    curl -s localhost:8765/scrape -d '{"url": "https://www.dienmayxanh.com/may-lanh/..."}'
+"""
+
+import argparse
+import io
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from product_scraper import (
+    SELENIUM_AVAILABLE,
+    AIMDController,
+    BaseScraper,
+    ExcelExporter,
+    HostRateScheduler,
+    ProductData,
+    ProductScraperManager,
+    check_dependencies,
+    host_stats,
+    positive_float,
+)
+
+
+class ScrapeJob:
+    """1 batch job: kết quả từng URL được ghi thành event để stream cho client"""
+
+    def __init__(self, urls: List[str]):
+        self.id = uuid.uuid4().hex[:12]
+        self.urls = urls
+        self.total = len(urls)
+        self.status = 'running'
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.ok = 0
+        self.failed = 0
+        self.results: List[Dict[str, Any]] = []  # theo thứ tự hoàn thành
+        self.events: List[Dict[str, Any]] = []
+        self.futures: List[Future] = []
+        self._cond = threading.Condition()
+        if not urls:
+            self._finish('completed')
+
+    @property
+    def done(self) -> int:
+        return self.ok + self.failed
+
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+
+    def add_result(self, indexes: List[int], result: Dict[str, Any]):
+        """Ghi kết quả 1 URL (URL lặp lại trong input -> nhiều index)"""
+        with self._cond:
+            if self.finished:
+                return
+            for index in indexes:
+                item = dict(result, index=index)
+                self.results.append(item)
+                if item['ok']:
+                    self.ok += 1
+                else:
+                    self.failed += 1
+                self.events.append(dict(item, type='result'))
+            self.events.append({'type': 'progress', **self._progress()})
+            if self.done >= self.total:
+                self._finish('completed')
+            self._cond.notify_all()
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+        with self._cond:
+            if not self.finished:
+                self._finish('cancelled')
+            self._cond.notify_all()
+
+    def _finish(self, status: str):
+        self.status = status
+        self.finished_at = time.time()
+        self.events.append({'type': 'done', **self._progress()})
+
+    def _progress(self) -> Dict[str, Any]:
+        return {'job_id': self.id, 'status': self.status, 'done': self.done,
+                'total': self.total, 'ok': self.ok, 'failed': self.failed}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._cond:
+            summary = self._progress()
+        summary['created_at'] = self.created_at
+        summary['finished_at'] = self.finished_at
+        summary['elapsed_s'] = round((self.finished_at or time.time()) - self.created_at, 1)
+        return summary
+
+    def wait_events(self, offset: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """Event từ offset trở đi (chờ tối đa timeout nếu chưa có) -> (events, job đã xong)"""
+        with self._cond:
+            if offset >= len(self.events) and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[offset:], self.finished
+
+    def products(self) -> List[ProductData]:
+        """Các sản phẩm đã cào thành công tới thời điểm hiện tại"""
+        with self._cond:
+            results = list(self.results)
+        return [ProductData(**r['product']) for r in sorted(results, key=lambda r: r['index']) if r['ok']]
+
+
+class ScrapeService:
+    """Manager + thread pool dùng chung cho mọi request HTTP"""
+
+    def __init__(self, use_selenium: bool = False, workers: int = 8, max_batch: int = 500,
+                 max_jobs: int = 100):
+        self.manager = ProductScraperManager(use_selenium=use_selenium, keep_browsers=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scrape')
+        self.max_batch = max_batch
+        self.max_jobs = max_jobs
+        self.jobs: 'OrderedDict[str, ScrapeJob]' = OrderedDict()
+        self.started_at = time.time()
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    def scrape_one(self, url: str) -> Dict[str, Any]:
+        """Cào 1 URL, không raise - lỗi được trả về trong kết quả"""
+        started = time.monotonic()
+        try:
+            product = self.manager.scrape(url)
+            result = {'url': url, 'ok': True, 'product': asdict(product)}
+        except Exception as e:
+            result = {'url': url, 'ok': False, 'error': f"{e.__class__.__name__}: {e}"}
+        result['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return result
+
+    def scrape(self, url: str) -> Dict[str, Any]:
+        return self.executor.submit(self.scrape_one, url).result()
+
+    def scrape_batch(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Cào song song (xen kẽ host), trả kết quả theo thứ tự input; URL trùng chỉ cào 1 lần"""
+        futures = {}
+        for url in BaseScraper.scheduler.interleave(dict.fromkeys(urls)):
+            futures[url] = self.executor.submit(self.scrape_one, url)
+        return [futures[url].result() for url in urls]
+
+    def submit_job(self, urls: List[str]) -> ScrapeJob:
+        """Tạo job và đưa các URL vào thread pool (không chờ)"""
+        job = ScrapeJob(urls)
+        indexes: Dict[str, List[int]] = {}
+        for i, url in enumerate(urls):
+            indexes.setdefault(url, []).append(i)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict_jobs()
+        for url in BaseScraper.scheduler.interleave(indexes):
+            future = self.executor.submit(self.scrape_one, url)
+            future.add_done_callback(
+                lambda f, idx=indexes[url]: None if f.cancelled() else job.add_result(idx, f.result()))
+            job.futures.append(future)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ScrapeJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.summary() for job in jobs]
+
+    def _evict_jobs(self):
+        """Giữ tối đa max_jobs job, bỏ job cũ nhất đã xong trước"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        while len(self.jobs) > self.max_jobs and finished:
+            del self.jobs[finished.pop(0)]
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            served = self.requests_served
+        return {
+            'status': 'ok',
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'requests_served': served,
+            'selenium': self.manager.use_selenium,
+            'jobs_running': sum(1 for job in self.list_jobs() if job['status'] == 'running'),
+        }
+
+    def mark_served(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def close(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.manager.close()
+
+
+class ScrapeRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler - mỗi request chạy trên 1 thread riêng (ThreadingHTTPServer)"""
+
+    server_version = 'ProductScrapeService/1.0'
+
+    @property
+    def service(self) -> ScrapeService:
+        return self.server.service
+
+    def do_GET(self):
+        started = time.monotonic()
+        path, query = self._route()
+        if path == '/health':
+            self._send_json(200, self.service.health(), started)
+        elif path == '/stats':
+            self._send_json(200, {'hosts': host_stats()}, started)
+        elif path == '/jobs':
+            self._send_json(200, {'jobs': self.service.list_jobs()}, started)
+        elif path.startswith('/jobs/'):
+            self._get_job(path, query, started)
+        else:
+            self._send_json(404, {'error': f"Unknown path: {path}"}, started)
+
+    def do_DELETE(self):
+        started = time.monotonic()
+        path, _ = self._route()
+        job = self.service.get_job(path[len('/jobs/'):]) if path.startswith('/jobs/') else None
+        if job is None:
+            self._send_json(404, {'error': f"Unknown job: {path}"}, started)
+            return
+        job.cancel()
+        self._send_json(200, job.summary(), started)
+
+    def _get_job(self, path: str, query: Dict[str, List[str]], started: float):
+        parts = path.strip('/').split('/')  # ['jobs', id, (action)]
+        job = self.service.get_job(parts[1])
+        if job is None:
+            self._send_json(404, {'error': f"Unknown job: {parts[1]}"}, started)
+        elif len(parts) == 2:
+            self._send_json(200, job.summary(), started)
+        elif parts[2] == 'stream':
+            sse = (query.get('format', [''])[0] == 'sse'
+                   or 'text/event-stream' in (self.headers.get('Accept') or ''))
+            self._stream_job(job, sse)
+        elif parts[2] == 'results.xlsx':
+            buffer = io.BytesIO()
+            ExcelExporter().export(job.products(), buffer)
+            self._send_bytes(200, buffer.getvalue(),
+                             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                             filename=f"job_{job.id}.xlsx")
+        elif parts[2] == 'results.ndjson':
+            lines = [json.dumps(asdict(p), ensure_ascii=False) for p in job.products()]
+            self._send_bytes(200, ('\n'.join(lines) + '\n').encode('utf-8') if lines else b'',
+                             'application/x-ndjson', filename=f"job_{job.id}.ndjson")
+        else:
+            self._send_json(404, {'error': f"Unknown path: {path}"}, started)
+
+    def _stream_job(self, job: ScrapeJob, sse: bool, heartbeat: float = 15.0):
+        """Stream event của job tới khi job xong (HTTP/1.0: đóng kết nối = hết stream)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if sse else 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        offset = 0
+        try:
+            while True:
+                events, finished = job.wait_events(offset, heartbeat)
+                for event in events:
+                    data = json.dumps(event, ensure_ascii=False)
+                    line = f"event: {event['type']}\ndata: {data}\n\n" if sse else data + '\n'
+                    self.wfile.write(line.encode('utf-8'))
+                offset += len(events)
+                if not events:
+                    self.wfile.write(b': keepalive\n\n' if sse else b'{"type": "heartbeat"}\n')
+                self.wfile.flush()
+                if finished and offset >= len(job.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client ngắt kết nối - job vẫn tiếp tục chạy
+
+    def do_POST(self):
+        started = time.monotonic()
+        path, _ = self._route()
+        body, error = self._read_json()
+        if error:
+            self._send_json(400, {'error': error}, started)
+            return
+
+        if path == '/jobs':
+            urls = body.get('urls')
+            if not isinstance(urls, list) or not all(isinstance(u, str) and u for u in urls):
+                self._send_json(400, {'error': "'urls' must be a list of URLs"}, started)
+                return
+            job = self.service.submit_job(urls)
+            self._send_json(202, {
+                'job_id': job.id,
+                'total': job.total,
+                'status_url': f"/jobs/{job.id}",
+                'stream_url': f"/jobs/{job.id}/stream",
+                'results_url': f"/jobs/{job.id}/results.xlsx",
+            }, started)
+
+        elif path == '/scrape':
+            url = body.get('url')
+            if not isinstance(url, str) or not url:
+                self._send_json(400, {'error': "Missing 'url'"}, started)
+                return
+            result = self.service.scrape(url)
+            self._send_json(200 if result['ok'] else 502, result, started)
+
+        elif path == '/scrape/batch':
+            urls = body.get('urls')
+            if not isinstance(urls, list) or not all(isinstance(u, str) and u for u in urls):
+                self._send_json(400, {'error': "'urls' must be a list of URLs"}, started)
+                return
+            if len(urls) > self.service.max_batch:
+                self._send_json(413, {'error': f"Batch too large (max {self.service.max_batch})"}, started)
+                return
+            results = self.service.scrape_batch(urls)
+            self._send_json(200, {
+                'results': results,
+                'ok': sum(1 for r in results if r['ok']),
+                'failed': sum(1 for r in results if not r['ok']),
+            }, started)
+
+        else:
+            self._send_json(404, {'error': f"Unknown path: {path}"}, started)
+
+    def _route(self) -> Tuple[str, Dict[str, List[str]]]:
+        parts = urlsplit(self.path)
+        return parts.path.rstrip('/') or '/', parse_qs(parts.query)
+
+    def _read_json(self) -> Tuple[Dict[str, Any], str]:
+        """Đọc body JSON -> (dict, lỗi)"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, UnicodeDecodeError) as e:
+            return {}, f"Invalid JSON body: {e}"
+        if not isinstance(body, dict):
+            return {}, "JSON body must be an object"
+        return body, ''
+
+    def _send_bytes(self, status: int, data: bytes, content_type: str, filename: str = ''):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.end_headers()
+        self.wfile.write(data)
+        self.service.mark_served()
+
+    def _send_json(self, status: int, payload: Dict[str, Any], started: float):
+        total_ms = round((time.monotonic() - started) * 1000, 1)
+        payload['timing'] = {'total_ms': total_ms}
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Server-Timing', f'total;dur={total_ms}')
+        self.end_headers()
+        self.wfile.write(data)
+        self.service.mark_served()
+
+
+def create_server(host: str, port: int, service: ScrapeService) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ScrapeRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Daemon cào sản phẩm với HTTP API local')
+    parser.add_argument('--host', default='127.0.0.1', help='Địa chỉ bind (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8765, help='Port (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='Số URL cào song song (default: %(default)s)')
+    parser.add_argument('--max-batch', type=int, default=500,
+                        help='Số URL tối đa mỗi batch (default: %(default)s)')
+    parser.add_argument('--max-jobs', type=int, default=100,
+                        help='Số batch job giữ trong bộ nhớ, job cũ đã xong bị xóa trước (default: %(default)s)')
+    parser.add_argument('--rate', type=positive_float, default=2.0,
+                        help='Số request/giây tối đa cho mỗi host (default: %(default)s)')
+    parser.add_argument('--ignore-robots', action='store_true',
+                        help='Bỏ qua Crawl-delay trong robots.txt')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                        help='Số request đồng thời tối đa cho mỗi host (default: %(default)s)')
+    parser.add_argument('--selenium', '-s', action='store_true',
+                        help='Dùng Selenium (browser được giữ sống giữa các request)')
+    parser.add_argument('--sku-db', default='sku_registry.db',
+                        help='SQLite registry SKU, dùng chung với product_scraper.py (default: %(default)s)')
+    args = parser.parse_args()
+    check_dependencies()
+    from sku_registry import SkuRegistry
+    BaseScraper.skus = SkuRegistry(args.sku_db)
+
+    if args.selenium and not SELENIUM_AVAILABLE:
+        print("⚠️  Selenium không khả dụng. Tiếp tục với requests...")
+        args.selenium = False
+
+    BaseScraper.scheduler = HostRateScheduler(rate=args.rate, respect_robots=not args.ignore_robots)
+    BaseScraper.concurrency = AIMDController(maximum=args.max_concurrency)
+
+    service = ScrapeService(use_selenium=args.selenium, workers=args.workers, max_batch=args.max_batch,
+                           max_jobs=args.max_jobs)
+    server = create_server(args.host, args.port, service)
+    print(f"Scrape service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+SKU Registry
+Cấp SKU prefix ổn định và không trùng cho sản phẩm:
+- SKU = chữ cái đầu tên + hash (base32) của định danh sản phẩm (mã sản phẩm của site, không có thì URL chuẩn hóa)
+  -> cào lại cùng sản phẩm ra cùng SKU, upsert incremental không bị nhân bản
+- Registry SQLite (UNIQUE sku + UNIQUE identity): SKU đã cấp được giữ nguyên giữa các lần chạy,
+  hash trùng với sản phẩm khác -> thêm salt và thử lại; nhiều thread/process ghi cùng file vẫn không trùng
+- Cache LRU trong RAM -> lookup lặp lại không chạm SQLite
+- SKU variant = SKU sản phẩm + hash ngắn của giá trị option đã chuẩn hóa (không phụ thuộc thứ tự trên trang)
+
+Dùng bởi product_scraper.py, scrape_service.py (--sku-db). Xem registry:
+    python sku_registry.py [--db sku_registry.db] [IDENTITY]
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS skus (
+    sku         TEXT PRIMARY KEY,
+    identity    TEXT NOT NULL UNIQUE,
+    name        TEXT,
+    salt        INTEGER NOT NULL DEFAULT 0,
+    created_at  TEXT NOT NULL
+);
+"""
+
+# Crockford base32: không có I, L, O, U -> dễ đọc, không nhầm 0/O, 1/I
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+HASH_LENGTH = 8    # 40 bit: ~0.5 lần trùng hash trên 1 triệu sản phẩm, registry xử lý bằng salt
+VARIANT_HASH_LENGTH = 5    # Chỉ cần phân biệt các variant của cùng 1 sản phẩm
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def sku_prefix(name: str) -> str:
+    """Chữ cái đầu (bỏ dấu) của tối đa 4 từ đầu tiên trong tên"""
+    plain = unicodedata.normalize('NFKD', (name or '').replace('đ', 'd').replace('Đ', 'D'))
+    plain = ''.join(c for c in plain if not unicodedata.combining(c))
+    prefix = ''.join(w[0] for w in plain.split()[:4] if w[0].isascii() and w[0].isalpha())
+    return prefix.upper() or 'SP'
+
+
+def sku_hash(identity: str, salt: int = 0, length: int = HASH_LENGTH) -> str:
+    data = f"{identity}#{salt}" if salt else identity
+    value = int.from_bytes(hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+    return ''.join(ALPHABET[(value >> (5 * i)) & 31] for i in range(length))
+
+
+def _plain(text: str) -> str:
+    text = unicodedata.normalize('NFKD', (text or '').replace('đ', 'd').replace('Đ', 'D'))
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).lower().split())
+
+
+def variant_identity(product_sku: str, options: Iterable[Tuple[str, str]] = ()) -> str:
+    """Định danh variant: SKU sản phẩm + các cặp (loại option, giá trị) đã chuẩn hóa và sắp xếp"""
+    values = sorted(f"{_plain(kind)}={_plain(value)}" for kind, value in options if value)
+    return f"{product_sku}|{'|'.join(values)}"
+
+
+class SkuRegistry:
+    """SQLite registry identity -> SKU (WAL; path ':memory:' = chỉ trong process hiện tại)"""
+
+    def __init__(self, path: str = ':memory:', cache_size: int = 100000):
+        self.path = path
+        self.cache_size = cache_size
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()
+        self.stats = {'allocated': 0, 'reused': 0, 'collisions': 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def allocate(self, identity: str, name: str = '', prefix: Optional[str] = None, length: int = HASH_LENGTH) -> str:
+        """SKU của sản phẩm: lấy từ registry nếu đã cấp, không thì cấp mới (không trùng SKU đã có).
+
+        prefix: phần đầu SKU (mặc định: chữ cái đầu của name); variant dùng SKU sản phẩm làm prefix.
+        """
+        with self._lock:
+            sku = self._cache.get(identity)
+            if sku is not None:
+                self._cache.move_to_end(identity)
+                self.stats['reused'] += 1
+                return sku
+            sku = self._lookup(identity)
+            if sku is not None:
+                self.stats['reused'] += 1
+            else:
+                prefix = sku_prefix(name) if prefix is None else prefix
+                for salt in itertools.count():
+                    candidate = f"{prefix}-{sku_hash(identity, salt, length)}"
+                    cur = self._conn.execute(
+                        'INSERT OR IGNORE INTO skus (sku, identity, name, salt, created_at) VALUES (?, ?, ?, ?, ?)',
+                        (candidate, identity, name, salt, _now()))
+                    if cur.rowcount:
+                        sku = candidate
+                        self.stats['allocated'] += 1
+                        break
+                    # Bị bỏ qua: process khác vừa cấp cho identity này, hoặc SKU thuộc sản phẩm khác
+                    sku = self._lookup(identity)
+                    if sku is not None:
+                        self.stats['reused'] += 1
+                        break
+                    self.stats['collisions'] += 1
+            self._cache[identity] = sku
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return sku
+
+    def _lookup(self, identity: str) -> Optional[str]:
+        row = self._conn.execute('SELECT sku FROM skus WHERE identity = ?', (identity,)).fetchone()
+        return row[0] if row else None
+
+    def entry(self, identity: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cur = self._conn.execute('SELECT * FROM skus WHERE identity = ?', (identity,))
+            row = cur.fetchone()
+        return dict(zip((c[0] for c in cur.description), row)) if row else None
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            total, salted = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(salt > 0), 0) FROM skus').fetchone()
+        return {'skus': total, 'salted': salted, **self.stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Xem SKU registry')
+    parser.add_argument('identity', nargs='?', help='Định danh (vd: cellphones.com.vn/iphone-15.html hoặc cellphones.com.vn#MÃ_SP)')
+    parser.add_argument('--db', default='sku_registry.db', help='File SQLite (default: %(default)s)')
+    args = parser.parse_args()
+    registry = SkuRegistry(args.db)
+    if args.identity:
+        print(json.dumps(registry.entry(args.identity), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(registry.summary(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
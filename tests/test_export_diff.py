@@ -0,0 +1,84 @@
+"""ExportSnapshot: insert/update/remove theo khóa sheet, phạm vi xóa khi chỉ scrape 1 phần catalog"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from export_diff import ExportSnapshot, change_sheets, summary  # noqa: E402
+
+PRODUCT_HEADERS = ['sku_prefix', 'name', 'base_price']
+VARIANT_HEADERS = ['product_sku_prefix', 'sku', 'price']
+MEDIA_HEADERS = ['product_sku_prefix', 'url']
+
+
+def sheets(products):
+    """products: {prefix: (price, [ảnh])} -> {sheet: (headers, rows)}"""
+    return {
+        'Products': (PRODUCT_HEADERS, [[p, f"Máy {p}", price] for p, (price, _) in products.items()]),
+        'Variants': (VARIANT_HEADERS, [[p, f"{p}-V1", price] for p, (price, _) in products.items()]),
+        'Media': (MEDIA_HEADERS, [[p, img] for p, (_, images) in products.items() for img in images]),
+    }
+
+
+def counts(changes):
+    return {row['sheet']: (row['inserted'], row['updated'], row['removed']) for row in summary(changes)}
+
+
+class ExportDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = ExportSnapshot(os.path.join(self.tmp.name, 'snapshot.db'))
+        first = self.snapshot.diff(sheets({'A': (100, ['a1.jpg', 'a2.jpg']), 'B': (200, ['b1.jpg'])}))
+        self.assertEqual(counts(first)['Products'], (2, 0, 0))
+        self.snapshot.apply(first, sources={'shop.vn/a': 'A', 'shop.vn/b': 'B'})
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.tmp.cleanup()
+
+    def test_unchanged_rows_are_skipped_and_updates_detected(self):
+        changes = self.snapshot.diff(sheets({'A': (90, ['a1.jpg', 'a2.jpg']), 'B': (200, ['b1.jpg'])}))
+        self.assertEqual(counts(changes), {'Products': (0, 1, 0), 'Variants': (0, 1, 0), 'Media': (0, 0, 0)})
+        data, extra = change_sheets(changes)
+        self.assertEqual(data['Products'][1], [['A', 'Máy A', 90, 'update']])
+        self.assertNotIn('Removed', extra)
+
+    def test_partial_scrape_only_removes_rows_of_scraped_products(self):
+        # Chỉ scrape lại A (ảnh a2 đã bị gỡ); B không nằm trong input -> không được coi là bị xóa
+        scope = self.snapshot.prefixes(['shop.vn/a'])
+        self.assertEqual(scope, {'A'})
+        changes = self.snapshot.diff(sheets({'A': (100, ['a1.jpg'])}), scope=scope)
+        self.assertEqual(counts(changes), {'Products': (0, 0, 0), 'Variants': (0, 0, 0), 'Media': (0, 0, 1)})
+        self.assertEqual(changes['Media'].removed[0][1], ['A', 'a2.jpg'])
+
+    def test_gone_product_in_scope_is_removed(self):
+        # URL của B trả 404 -> prefix của B nằm trong scope dù không có dòng nào
+        scope = self.snapshot.prefixes(['shop.vn/a', 'shop.vn/b'])
+        changes = self.snapshot.diff(sheets({'A': (100, ['a1.jpg', 'a2.jpg'])}), scope=scope)
+        self.assertEqual(counts(changes), {'Products': (0, 0, 1), 'Variants': (0, 0, 1), 'Media': (0, 0, 1)})
+        self.snapshot.apply(changes)
+        self.assertEqual(self.snapshot.prefixes(['shop.vn/b']), set())
+        self.assertEqual(self.snapshot.stats()['Products'], 1)
+
+    def test_full_catalog_removes_every_missing_row(self):
+        changes = self.snapshot.diff(sheets({'A': (100, ['a1.jpg', 'a2.jpg'])}), scope=None)
+        self.assertEqual(counts(changes)['Products'], (0, 0, 1))
+        _, extra = change_sheets(changes)
+        self.assertIn({'sheet': 'Products', 'product_sku_prefix': 'B', 'sku': None, 'attribute_name': None,
+                       'url': None}, extra['Removed'])
+
+    def test_removals_disabled(self):
+        changes = self.snapshot.diff(sheets({}), removals=False)
+        self.assertEqual(counts(changes)['Products'], (0, 0, 0))
+
+    def test_diff_does_not_write_until_apply(self):
+        self.snapshot.diff(sheets({'C': (300, [])}))
+        self.assertEqual(counts(self.snapshot.diff(sheets({'C': (300, [])}), removals=False))['Products'], (1, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Import-time budget: `import product_scraper` không được kéo theo các dependency nặng"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('requests', 'bs4', 'openpyxl', 'selenium', 'lxml', 'urllib3', 'sqlite3')
+IMPORT_BUDGET_S = 0.25
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import product_scraper
+elapsed = time.perf_counter() - started
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def probe() -> dict:
+    # Process mới: sys.modules sạch, không bị ảnh hưởng bởi test khác
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+class ImportBudgetTest(unittest.TestCase):
+    def test_no_heavy_modules_at_import(self):
+        self.assertEqual(probe()['loaded'], [])
+
+    def test_import_time_budget(self):
+        # Lấy lần nhanh nhất trong 3 lần để bớt nhiễu của máy CI
+        elapsed = min(probe()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET_S, f"import product_scraper mất {elapsed * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""JobStore / Frontier: vị trí đọc source khi resume, khử trùng theo key, trạng thái gone/skipped"""
+
+import itertools
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from job_store import Frontier, JobStore, KeySet  # noqa: E402
+
+URLS = [f"https://shop.vn/p/{i}" for i in range(25)]
+
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'jobs.db')
+        self.store = JobStore(self.path)
+        self.job_id = self.store.create_job((), output='out.xlsx', sources={'urls': URLS})
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_frontier_resumes_from_saved_source_offset(self):
+        frontier = Frontier(self.store, self.job_id, iter(URLS), chunk_size=10)
+        taken = list(itertools.islice(frontier, 12))
+        for url in taken[:-1]:
+            self.store.record_success(self.job_id, url, {'url': url})
+        job = self.store.get_job(self.job_id)
+        self.assertEqual(job['source_offset'], 20)   # 2 chunk đã nạp
+        self.assertFalse(job['source_done'])
+
+        # "Crash": URL đang chạy quay lại pending, source đọc tiếp từ offset đã lưu
+        self.store.close()
+        self.store = JobStore(self.path)
+        self.assertEqual(self.store.requeue(self.job_id), 1)
+        job = self.store.get_job(self.job_id)
+        frontier = Frontier(self.store, self.job_id, itertools.islice(URLS, job['source_offset'], None), chunk_size=10,
+                            position=lambda: job['source_offset'] + frontier.read)
+        rest = list(frontier)
+        self.assertEqual(rest, URLS[11:])
+        job = self.store.get_job(self.job_id)
+        self.assertEqual(job['source_offset'], 25)
+        self.assertTrue(job['source_done'])
+        self.assertEqual(job['progress']['total'], 25)
+
+    def test_key_dedup_is_exact_and_survives_resume(self):
+        key = lambda url: url.split('?')[0]  # noqa: E731
+        self.assertEqual(self.store.add_urls(self.job_id, URLS[:5] + [URLS[0] + '?utm_source=x'], key=key), 5)
+        self.store.close()
+        self.store = JobStore(self.path)
+        frontier = Frontier(self.store, self.job_id, [URLS[1] + '?ref=a', URLS[5]], key=key)
+        self.assertEqual(len(list(frontier)), 6)
+        self.assertEqual((frontier.read, frontier.added), (2, 1))
+
+    def test_gone_and_skipped_are_not_requeued(self):
+        self.store.add_urls(self.job_id, URLS[:4])
+        list(Frontier(self.store, self.job_id))
+        self.store.record_gone(self.job_id, URLS[0], 'HTTPError: 404')
+        self.store.record_skipped(self.job_id, URLS[1], 'trùng sản phẩm')
+        self.store.record_failure(self.job_id, URLS[2], 'Timeout')
+        self.store.record_success(self.job_id, URLS[3], {'name': 'x'})
+        progress = self.store.progress(self.job_id)
+        self.assertEqual([progress[s] for s in ('gone', 'skipped', 'failed', 'done')], [1, 1, 1, 1])
+        self.assertEqual(self.store.gone_urls(self.job_id), [URLS[0]])
+        self.assertEqual(self.store.requeue(self.job_id, include_failed=True), 1)
+        self.assertEqual(list(self.store.pending_urls(self.job_id)), [URLS[2]])
+        self.assertEqual(list(self.store.iter_results(self.job_id)), [{'name': 'x'}])
+
+    def test_key_set(self):
+        keys = KeySet(self.store, self.job_id)
+        keys.add('shop.vn/p/1')
+        keys.add('shop.vn/p/1')
+        self.assertIn('shop.vn/p/1', keys)
+        self.assertNotIn('shop.vn/p/2', keys)
+        self.assertEqual(len(keys), 1)
+        self.assertNotIn('shop.vn/p/1', KeySet(self.store, 'job khác'))
+
+
+if __name__ == '__main__':
+    unittest.main()
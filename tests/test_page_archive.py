@@ -0,0 +1,61 @@
+"""PageArchive: body giải nén đúng (cả khi nén bằng dictionary), blob trùng lưu 1 lần, latest là lần fetch mới nhất"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from page_archive import PageArchive  # noqa: E402
+
+
+def html(i):
+    return ('<html>\n<head><meta charset="utf-8"><link rel="stylesheet" href="/static/site.css"></head>\n'
+            '<body>\n<div class="product"><h1>Sản phẩm %d</h1></div>\n<footer>%s</footer>\n</body>\n</html>'
+            % (i, 'Điện thoại giá tốt ' * 50)).encode('utf-8')
+
+
+class PageArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'pages.db')
+        self.archive = PageArchive(self.path, train_samples=2)
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmp.cleanup()
+
+    def test_roundtrip_with_and_without_dictionary(self):
+        for i in range(4):
+            self.archive.put(f"https://shop.vn/p/{i}", html(i), encoding='utf-8', headers={'ETag': f'"{i}"'})
+        self.assertEqual(self.archive.stats()['dictionaries'], 1)
+        self.archive.close()
+        self.archive = PageArchive(self.path, train_samples=2)
+        for page_id, url in self.archive.latest_pages():
+            page = self.archive.page(page_id)
+            i = int(url.rsplit('/', 1)[1])
+            self.assertEqual(page['body'], html(i))
+            self.assertEqual((page['encoding'], page['headers']), ('utf-8', {'ETag': f'"{i}"'}))
+
+    def test_identical_bodies_share_one_blob(self):
+        self.archive.put('https://shop.vn/a', html(1))
+        self.archive.put('https://shop.vn/a', html(1))
+        self.archive.put('https://shop.vn/b', html(1))
+        stats = self.archive.stats()
+        self.assertEqual((stats['pages'], stats['urls'], stats['blobs']), (3, 2, 1))
+
+    def test_latest_pages_returns_newest_fetch_per_url(self):
+        self.archive.put('https://shop.vn/a', html(1))
+        self.archive.put('https://other.vn/x', html(2))
+        self.archive.put('https://shop.vn/a', html(3))
+        latest = {url: self.archive.page(page_id)['body'] for page_id, url in self.archive.latest_pages(page_size=1)}
+        self.assertEqual(latest, {'https://shop.vn/a': html(3), 'https://other.vn/x': html(2)})
+        self.assertEqual([url for _, url in self.archive.latest_pages(site='other.vn')], ['https://other.vn/x'])
+        with self.assertRaises(KeyError):
+            self.archive.page(999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""PriceHistory: chỉ ghi khi giá đổi, quan sát đến muộn (cũ hơn latest) không ghi đè latest"""
+
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from price_history import PriceHistory  # noqa: E402
+
+
+def product(price, scraped_at, in_stock=True):
+    return SimpleNamespace(sku_prefix='IPHONE-AB12C', scraped_at=scraped_at, base_price=price, compare_at_price=None,
+                           variants=[{'sku': 'IPHONE-AB12C-X1Y2Z', 'price': price, 'in_stock': in_stock}])
+
+
+class PriceHistoryTest(unittest.TestCase):
+    SKU = 'IPHONE-AB12C-X1Y2Z'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.history = PriceHistory(os.path.join(self.tmp.name, 'prices.db'))
+
+    def tearDown(self):
+        self.history.close()
+        self.tmp.cleanup()
+
+    def test_only_changes_are_recorded(self):
+        self.assertEqual(self.history.record([product(100.0, '2024-05-01T10:00:00')])['new'], 1)
+        stats = self.history.record([product(100.0, '2024-05-02T10:00:00')])
+        self.assertEqual((stats['new'], stats['changed']), (0, 0))
+        self.assertEqual(self.history.record([product(90.0, '2024-05-03T10:00:00')])['changed'], 1)
+        self.assertEqual([r['price'] for r in self.history.history(self.SKU)], [100.0, 90.0])
+        self.assertEqual(len(self.history.history('IPHONE-AB12C')), 2)   # tra theo SKU prefix
+        latest = self.history.latest(self.SKU)
+        self.assertEqual((latest['price'], latest['last_seen_at']), (90.0, '2024-05-03T10:00:00'))
+
+    def test_out_of_order_observation_does_not_overwrite_latest(self):
+        self.history.record([product(90.0, '2024-05-03T10:00:00')])
+        stats = self.history.record([product(120.0, '2024-05-01T10:00:00', in_stock=False)])
+        self.assertEqual(stats['changed'], 1)
+        latest = self.history.latest(self.SKU)
+        self.assertEqual((latest['price'], latest['in_stock'], latest['observed_at']),
+                         (90.0, 1, '2024-05-03T10:00:00'))
+        self.assertEqual(latest['last_seen_at'], '2024-05-03T10:00:00')
+        self.assertEqual([r['price'] for r in self.history.history(self.SKU)], [120.0, 90.0])
+        self.assertEqual([r['price'] for r in self.history.history(self.SKU, until='2024-05-02')], [120.0])
+
+    def test_stale_unchanged_observation_keeps_last_seen(self):
+        self.history.record([product(90.0, '2024-05-03T10:00:00')])
+        self.history.record([product(90.0, '2024-05-01T10:00:00')])
+        self.assertEqual(self.history.latest(self.SKU)['last_seen_at'], '2024-05-03T10:00:00')
+        self.history.record([product(90.0, '2024-05-04T10:00:00')])
+        latest = self.history.latest(self.SKU)
+        self.assertEqual((latest['observed_at'], latest['last_seen_at']), ('2024-05-03T10:00:00', '2024-05-04T10:00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""UrlCanonicalizer (chuẩn hóa/khử trùng URL) và SKU ổn định giữa đường API và HTML"""
+
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from product_scraper import (BaseScraper, CellphonesScraper, FPTShopScraper, MagentoGraphQLApi,  # noqa: E402
+                             NextDataApi, UrlCanonicalizer)
+from sku_registry import SkuRegistry  # noqa: E402
+
+
+def page(url, canonical=None):
+    link = f'<link rel="canonical" href="{canonical}">' if canonical else ''
+    return f'<html><head><title>x</title>{link}</head><body></body></html>'.encode('utf-8')
+
+
+class UrlCanonicalizerTest(unittest.TestCase):
+    def setUp(self):
+        self.canon = UrlCanonicalizer()
+
+    def test_canonicalize(self):
+        self.assertEqual(self.canon.canonicalize('HTTPS://Shop.vn:443//dien-thoai/?utm_source=fb&b=2&a=1&gclid=x#top'),
+                         'https://shop.vn/dien-thoai?a=1&b=2')
+        self.assertEqual(self.canon.static_key('https://www.thegioididong.com/dtdd/iphone-15'),
+                         self.canon.static_key('http://dienmayxanh.com/dtdd/iphone-15/'))
+
+    def test_unique_drops_duplicate_input(self):
+        urls = ['https://shop.vn/a?utm_medium=x', 'https://shop.vn/a', 'https://m.shop.vn/a/', 'https://shop.vn/b']
+        self.assertEqual(list(self.canon.unique(urls)), ['https://shop.vn/a', 'https://shop.vn/b'])
+        self.assertEqual(self.canon.snapshot()['input'], 2)
+
+    def test_learned_canonical_marks_duplicate_only_after_success(self):
+        self.assertIsNone(self.canon.learn('https://shop.vn/a', page('https://shop.vn/a')))
+        # URL khác cùng canonical khi URL đầu còn đang extract -> trùng
+        self.assertEqual(self.canon.learn('https://shop.vn/a-khuyen-mai', page('https://shop.vn/a', '/a')), 'shop.vn/a')
+        self.canon.finished('https://shop.vn/a', ok=False)
+        # Extract lỗi -> URL khác được cào lại
+        self.assertIsNone(self.canon.duplicate_of('https://shop.vn/a-khuyen-mai'))
+        self.assertIsNone(self.canon.learn('https://shop.vn/a-khuyen-mai', page('https://shop.vn/a', '/a')))
+        self.canon.finished('https://shop.vn/a-khuyen-mai', ok=True)
+        self.assertEqual(self.canon.duplicate_of('https://shop.vn/a?utm_source=x'), 'shop.vn/a')
+        # Alias đã học không làm đổi static_key (định danh SKU / khóa job store)
+        self.assertEqual(self.canon.key('https://shop.vn/a-khuyen-mai'), 'shop.vn/a')
+        self.assertEqual(self.canon.static_key('https://shop.vn/a-khuyen-mai'), 'shop.vn/a-khuyen-mai')
+
+    def test_foreign_canonical_is_ignored(self):
+        self.assertIsNone(self.canon.learn('https://shop.vn/a', page('https://shop.vn/a', 'https://other.vn/a')))
+        self.assertEqual(self.canon.key('https://shop.vn/a'), 'shop.vn/a')
+
+
+class SkuAcrossFetchPathsTest(unittest.TestCase):
+    def setUp(self):
+        self._skus, self._canonicalizer = BaseScraper.skus, BaseScraper.canonicalizer
+        BaseScraper.skus = SkuRegistry()
+        BaseScraper.canonicalizer = UrlCanonicalizer()
+
+    def tearDown(self):
+        BaseScraper.skus.close()
+        BaseScraper.skus, BaseScraper.canonicalizer = self._skus, self._canonicalizer
+
+    def test_magento_api_and_html_give_same_sku(self):
+        scraper = CellphonesScraper()
+        url = 'https://cellphones.com.vn/iphone-15.html'
+        data = {'sku': 'MB-IP15 ', 'name': 'iPhone 15', 'url_key': 'iphone-15',
+                'price_range': {'minimum_price': {'final_price': {'value': 19990000}}}}
+        api = MagentoGraphQLApi(scraper).build(url, data)
+        # Block sản phẩm liên quan (cả trước lẫn lồng trong node chính) không được lấy mã
+        html = '''<html><body>
+            <div itemscope itemtype="http://schema.org/Product"><span itemprop="sku">OTHER</span></div>
+            <div itemscope itemtype="https://schema.org/Product"><h1>iPhone 15</h1><div itemprop="sku">mb-ip15</div>
+              <div itemprop="isRelatedTo" itemscope itemtype="http://schema.org/Product">
+                <span itemprop="sku">REL</span></div></div>
+            </body></html>'''
+        soup = BeautifulSoup(html, 'html.parser')
+        self.assertEqual(scraper.site_product_id(soup), 'mb-ip15')
+        product = scraper.extract(url + '?utm_source=x', soup)
+        self.assertEqual(product.sku_prefix, api.sku_prefix)
+        self.assertEqual(product.variants[0]['sku'], api.variants[0]['sku'])
+        self.assertEqual(BaseScraper.skus.summary()['skus'], 2)
+
+    def test_url_identity_ignores_learned_aliases(self):
+        scraper = CellphonesScraper()
+        url = 'https://cellphones.com.vn/iphone-15-khuyen-mai.html'
+        sku = scraper.generate_sku('iPhone 15', url)
+        BaseScraper.canonicalizer.learn(url, page(url, 'https://cellphones.com.vn/iphone-15.html'))
+        self.assertEqual(BaseScraper.canonicalizer.key(url), 'cellphones.com.vn/iphone-15.html')
+        self.assertEqual(scraper.generate_sku('iPhone 15', url + '?utm_source=zalo'), sku)
+
+    def test_json_ld_product_matching_title(self):
+        scraper = CellphonesScraper()
+        ld = [{'@type': 'Product', 'name': 'Ốp lưng', 'sku': 'CASE'}, {'@type': 'Product', 'name': 'iPhone 15', 'sku': 'IP15'}]
+        html = (f'<script type="application/ld+json">{json.dumps(ld)}</script>'
+                '<h1> iPhone  15 </h1>')
+        self.assertEqual(scraper.site_product_id(BeautifulSoup(html, 'html.parser')), 'IP15')
+
+    def test_next_data_page_and_api_give_same_sku(self):
+        scraper = FPTShopScraper()
+        url = 'https://fptshop.com.vn/dien-thoai/galaxy-s24'
+        props = {'product': {'name': 'Galaxy S24', 'price': 22990000, 'sku': '00912'},
+                 'related': [{'name': 'Galaxy A15', 'price': 4990000, 'sku': '00777'}]}
+        html = '<script id="__NEXT_DATA__" type="application/json">%s</script><h1>Galaxy S24</h1>' % json.dumps(
+            {'props': {'pageProps': props}})
+        product_id = scraper.site_product_id(BeautifulSoup(html, 'html.parser'))
+        self.assertEqual(product_id, '00912')
+        api = NextDataApi(scraper).build(url, props['product'])
+        self.assertEqual(scraper.generate_sku('Galaxy S24', url, product_id), api.sku_prefix)
+        self.assertNotEqual(scraper.generate_sku('Galaxy S24', url, '00777'), api.sku_prefix)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""SkuRegistry: SKU ổn định giữa các lần chạy, hash trùng được salt, định danh variant không phụ thuộc thứ tự"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sku_registry import SkuRegistry, sku_prefix, variant_identity  # noqa: E402
+
+
+class SkuRegistryTest(unittest.TestCase):
+    def test_sku_is_stable_across_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'skus.db')
+            registry = SkuRegistry(path)
+            sku = registry.allocate('cellphones.com.vn#IP15-128', name='Điện thoại iPhone 15 128GB')
+            self.assertTrue(sku.startswith('DTI-'))
+            self.assertEqual(registry.allocate('cellphones.com.vn#IP15-128', name='tên khác'), sku)
+            registry.close()
+            registry = SkuRegistry(path)
+            self.assertEqual(registry.allocate('cellphones.com.vn#IP15-128'), sku)
+            self.assertEqual(registry.summary()['allocated'], 0)
+            registry.close()
+
+    def test_hash_collisions_are_salted(self):
+        registry = SkuRegistry()
+        # 1 ký tự hash = 32 giá trị -> 20 identity gần như chắc chắn trùng hash
+        skus = [registry.allocate(f"shop.vn#{i}", prefix='X', length=1) for i in range(20)]
+        self.assertEqual(len(set(skus)), 20)
+        self.assertGreater(registry.summary()['salted'], 0)
+        self.assertEqual([registry.allocate(f"shop.vn#{i}", prefix='X', length=1) for i in range(20)], skus)
+        registry.close()
+
+    def test_variant_identity_normalizes_options(self):
+        a = variant_identity('IP-AB', [('Màu sắc', 'Đen'), ('Dung lượng', '128GB')])
+        b = variant_identity('IP-AB', [('dung  lượng', '128gb'), ('mau sac', 'den'), ('Bảo hành', '')])
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, variant_identity('IP-AB', [('Màu sắc', 'Trắng'), ('Dung lượng', '128GB')]))
+
+    def test_sku_prefix(self):
+        self.assertEqual(sku_prefix('Đồng hồ thông minh Apple Watch'), 'DHTM')
+        self.assertEqual(sku_prefix(''), 'SP')
+
+
+if __name__ == '__main__':
+    unittest.main()